@@ -13,16 +13,17 @@ import sys
 import csv
 import numpy as np
 from imaris_xml import ImarisXML
-from volpy import dist_matrix, find_neighbor
+from volpy import cross_dist_min
 from log import log, set_loglevel
 
 
-def print_summary(edm, spots_c, spots_r, pair):
+def print_summary(dist, spots_c, spots_r, pair):
     """Print summary of results.
 
     Parameters
     ---------
-    edm : the euclidean distance matrix
+    dist : float
+        The distance between the spots of the pair.
     spots_c : coordinate list of candidate spots
     spots_r : coordinate list of reference spots
     pair : (int, int)
@@ -33,7 +34,7 @@ def print_summary(edm, spots_c, spots_r, pair):
     log.warn('\nCalculating closest neighbour.')
     log.warn('Reference: \t\t[%s]\t%s' % (id_r, spots_r[id_r]))
     log.warn('Closest neighbour: \t[%s]\t%s' % (id_n, spots_c[id_n]))
-    log.warn('Distance: %s' % edm[id_r, id_n + len(spots_r)])
+    log.warn('Distance: %s' % dist)
 
 
 def parse_arguments():
@@ -47,6 +48,12 @@ def parse_arguments():
         # type=argparse.FileType('w'), help='File to store the results.')
     argparser.add_argument('--csv', default=sys.stdout,
         type=argparse.FileType('w'), help='CSV-file to store the results.')
+    argparser.add_argument('--float32', dest='dtype', action='store_const',
+        const=np.float32, default=np.float64,
+        help='use single precision distances to save memory.')
+    argparser.add_argument('--cache', nargs='?', const=True, default=None,
+        metavar='DIR',
+        help='cache the parsed worksheets next to the XML file or in DIR')
     argparser.add_argument('-v', '--verbosity', dest='verbosity',
         action='count', default=0)
     try:
@@ -55,7 +62,7 @@ def parse_arguments():
         argparser.error(str(err))
 
 
-def parse_coordinates(xmlfile, desc):
+def parse_coordinates(xmlfile, desc, cache=None):
     """Read the 'Position' sheet from the Imaris XML file.
 
     Returns
@@ -64,23 +71,27 @@ def parse_coordinates(xmlfile, desc):
         List of 3-tuples of floats, representing the coordinates.
     """
     log.warn('Reading %s file: %s' % (desc, xmlfile.name))
-    imsxml = ImarisXML(xmlfile)
+    imsxml = ImarisXML(xmlfile, streaming=True, cache=cache)
     coordinates = imsxml.coordinates('Position')
     log.warn("- %s objects: %s" % (desc, len(coordinates)))
     return coordinates
 
 
-def csv_write_distances(out_csv, edm, ref_id):
+def csv_write_distances(out_csv, spots, ref_id, dtype=np.float64):
     """Write distances from a given reference id to a CSV file.
 
     Parameters
     ----------
     out_csv : filehandle
-    edm : euclidean distance matrix
+    spots : np.ndarray
+        The coordinates of all spots (reference spots first).
     ref_id : int
-        The index number of the reference point in the edm.
+        The index number of the reference point in the spots array.
+    dtype : np.dtype, optional
+        The data type the distances are calculated with.
     """
-    dists_to_ref = edm[:][ref_id]
+    spots = np.asarray(spots, dtype=dtype)
+    dists_to_ref = np.sqrt(((spots - spots[ref_id]) ** 2).sum(axis=1))
     # TODO: this should rather write only the distances of points from the
     # candidate list, excluding the ones from the reference list...
     log.info("Distances to reference:\n%s" % dists_to_ref)
@@ -92,44 +103,60 @@ def csv_write_distances(out_csv, edm, ref_id):
     log.warn("Done.")
 
 
-def closest_pairs(spots_r, spots_c):
+def closest_pairs(spots_r, spots_c, dtype=np.float64):
     """Calculate the closest neighbours of given reference spots.
 
+    The distances are calculated block-wise (see volpy.cross_dist_min()), so
+    no matrix of all pairs is stored. If several candidates have the same
+    distance to a reference spot, the one with the lowest index is used.
+
     Parameters
     ----------
     spots_r, spots_c : coordinate lists
         The coordinates (lists of 3-tuples of floats) of objects.
+    dtype : np.dtype, optional
+        The data type of the returned distances.
 
     Returns
     -------
-    edm : euclidean distance matrix
+    dists : np.ndarray
+        The distances of the closest neighbours pairs.
     pairs : list((int, int))
         The list of pairs of closest neighbours (index numbers).
+
+    Example
+    -------
+    >>> # all four candidates have the same distance to the reference:
+    >>> closest_pairs([ [0, 0, 0] ], [ [0, 1, 0], [1, 0, 0], [0, -1, 0],
+    ...                                [-1, 0, 0] ])[1]
+    [(0, 0)]
+    >>> closest_pairs([ [0, 0, 0], [3, 3, 0] ],
+    ...               [ [2, 3, 0], [3, 2, 0], [1, 0, 0], [0, 1, 0] ])[1]
+    [(0, 2), (1, 0)]
     """
     pairs = []
-    edm = dist_matrix(np.vstack([spots_r, spots_c]))
-    # create a mask to ignore the reference spots
-    ref_mask = [1] * len(spots_r) + [0] * len(spots_c)
+    # the results are index numbers for spots_c already, so no masking of the
+    # reference spots is required:
+    (dists, nearest) = cross_dist_min(spots_r, spots_c)
+    dists = dists.astype(dtype)
     for refid in range(len(spots_r)):
-        # the result of find_neighbor() must be adjusted by the length of the
-        # spots_r list to retrieve the index number for the spots_c list:
-        nearest = find_neighbor(refid, edm, ref_mask) - len(spots_r)
-        pair = (refid, nearest)
-        print_summary(edm, spots_c, spots_r, pair)
+        pair = (refid, int(nearest[refid]))
+        print_summary(dists[refid], spots_c, spots_r, pair)
         pairs.append(pair)
-    return (edm, pairs)
+    return (dists, pairs)
 
 
 def main():
     """Parse the commandline and dispatch the calculations."""
     args = parse_arguments()
     set_loglevel(args.verbosity)
-    spots_r = parse_coordinates(args.reference, 'reference')
-    spots_c = parse_coordinates(args.candidate, 'candidate')
-    (edm, pairs) = closest_pairs(spots_r, spots_c)
+    spots_r = parse_coordinates(args.reference, 'reference', args.cache)
+    spots_c = parse_coordinates(args.candidate, 'candidate', args.cache)
+    pairs = closest_pairs(spots_r, spots_c, args.dtype)[1]
     if (args.csv.name != '<stdout>'):
+        spots = np.vstack([spots_r, spots_c])
         for pair in pairs:
-            csv_write_distances(args.csv, edm, pair[0])
+            csv_write_distances(args.csv, spots, pair[0], args.dtype)
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -6,22 +6,30 @@ Takes a CSV file exported from Imaris via the XT/Matlab interface containing
 coordinates of segmented cell junctions (via the "filaments" tool) and analyzes
 them. Optionally a 3D plot can be shown interactively or exported as a series
 of PNG files.
+
+In batch mode, all pairs of "*-p3d-*.csv" and "*-edges-*.csv" files found in a
+directory (e.g. written by the IceXTFilamentsExporter) are analyzed in parallel
+and the results are combined into a single table.
 """
 
+import os
 import sys
+import csv
+import glob
 import argparse
+import multiprocessing
 
 import volpy as vp
-import volpy.plot as plot
-from log import set_loglevel
+from log import log, prof, set_loglevel
+from misc import filename
 
 
 def parse_arguments():
     """Parse the commandline arguments."""
     argparser = argparse.ArgumentParser(description=__doc__)
-    argparser.add_argument('-p', '--p3d', required=True, type=file,
+    argparser.add_argument('-p', '--p3d', type=file,
         help='CSV file containing filament coordinates (Point3D)')
-    argparser.add_argument('-e', '--edges', required=True, type=file,
+    argparser.add_argument('-e', '--edges', type=file,
         help='CSV file containing filament edges')
     argparser.add_argument('-o', '--outfile', type=argparse.FileType('w'),
         help='CSV file to store the results')
@@ -30,25 +38,160 @@ def parse_arguments():
         help='plot parsed filament data')
     argparser.add_argument('--export-plot', dest='export_plot', default=False,
         help='path to export PNG series of plotted filament data')
+    argparser.add_argument('-b', '--batch', dest='batch', default=None,
+        help='directory with p3d / edges CSV pairs to process all at once')
+    argparser.add_argument('-j', '--jobs', dest='jobs', type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of parallel processes in batch mode (default: all CPUs)')
+    argparser.add_argument('--profile', dest='profile', nargs='?', const='',
+        default=None, metavar='JSON',
+        help='report time and memory per stage, optionally saved as JSON')
     argparser.add_argument('-v', '--verbose', dest='verbosity',
         action='count', default=0)
     try:
-        return argparser.parse_args()
+        args = argparser.parse_args()
     except IOError as err:
         argparser.error(str(err))
+    if args.batch is None and (args.p3d is None or args.edges is None):
+        argparser.error('either --p3d and --edges or --batch are required')
+    return args
+
+
+def find_pairs(path):
+    """Find matching pairs of p3d and edges CSV files in a directory.
+
+    Parameters
+    ----------
+    path : str
+        The directory to search in.
+
+    Returns
+    -------
+    pairs : list((str, str))
+        The (sorted) list of (p3d, edges) filename tuples.
+    """
+    pairs = []
+    for p3d in sorted(glob.glob(os.path.join(path, '*-p3d-*.csv'))):
+        (dirname, basename) = os.path.split(p3d)
+        # the last occurrence is the one added by the exporter:
+        (prefix, suffix) = basename.rsplit('-p3d-', 1)
+        edges = os.path.join(dirname, '%s-edges-%s' % (prefix, suffix))
+        if os.path.exists(edges):
+            pairs.append((p3d, edges))
+        else:
+            log.warn('No edges file found for "%s", skipping.' % p3d)
+    return pairs
+
+
+def init_worker(verbosity, profile=False):
+    """Set up logging and profiling in a worker process."""
+    set_loglevel(verbosity)
+    prof.enable(profile)
+
+
+def analyze(pair):
+    """Analyze a single junction, catching any errors.
+
+    Parameters
+    ----------
+    pair : (str, str)
+        The filenames of the p3d and edges CSV files.
+
+    Returns
+    -------
+    (p3d, results, error, profile) : (str, list, str, dict)
+        The results (see CellJunction.get_results()) are None if the junction
+        couldn't be processed, the error message is empty otherwise. The
+        profiling data (see log.Profiler.results()) is None if profiling is
+        disabled.
+    """
+    try:
+        junction = vp.CellJunction(pair[0], pair[1])
+        res = (pair[0], junction.get_results(), '')
+    # any failure must only affect this very junction, so
+    # pylint: disable-msg=W0703
+    except Exception as err:
+        log.error('Processing "%s" failed: %s' % (pair[0], err))
+        res = (pair[0], None, '%s: %s' % (type(err).__name__, err))
+    if not prof.enabled:
+        return res + (None,)
+    # hand over the data collected for this junction to the caller, which is
+    # merging it (the worker processes have their own profiler instances):
+    profile = prof.results()
+    prof.reset()
+    return res + (profile,)
+
+
+def run_batch(path, f_out, jobs=1, verbosity=0):
+    """Analyze all junctions in a directory and write a combined table.
+
+    Parameters
+    ----------
+    path : str
+        The directory containing the p3d and edges CSV files.
+    f_out : filehandle
+        Where to write the results table to.
+    jobs : int, optional
+        The number of parallel processes.
+    verbosity : int, optional
+        The log level for the worker processes.
+
+    Returns
+    -------
+    failed : int
+        The number of junctions that couldn't be processed.
+    """
+    pairs = find_pairs(path)
+    log.warn('Found %i junctions in "%s".' % (len(pairs), path))
+    if jobs > 1 and len(pairs) > 1:
+        pool = multiprocessing.Pool(jobs, init_worker,
+                                    (verbosity, prof.enabled))
+        results = pool.imap(analyze, pairs)
+    else:
+        pool = None
+        results = (analyze(pair) for pair in pairs)
+    out = csv.writer(f_out, dialect='excel', delimiter=';')
+    fields = vp.CellJunction.result_fields
+    out.writerow(['input filename'] + list(fields) + ['error'])
+    failed = 0
+    for (p3d, res, error, profile) in results:
+        if profile is not None:
+            prof.merge(profile)
+        if res is None:
+            failed += 1
+            out.writerow([filename(p3d)] + [''] * len(fields) + [error])
+        else:
+            out.writerow([filename(p3d)] + [value for (_, value) in res] +
+                         [''])
+    if pool is not None:
+        pool.close()
+        pool.join()
+    log.warn('Processed %i junctions, %i failed.' % (len(pairs), failed))
+    return failed
 
 
 def main():
     """Create the junction object and do the requested tasks."""
     args = parse_arguments()
     set_loglevel(args.verbosity)
+    prof.enable(args.profile is not None)
 
-    junction = vp.CellJunction(args.p3d, args.edges)
+    if args.batch is not None:
+        run_batch(args.batch, args.outfile or sys.stdout, args.jobs,
+                  args.verbosity)
+    else:
+        junction = vp.CellJunction(args.p3d, args.edges)
+        if args.outfile:
+            junction.write_output(args.outfile, args.p3d)
 
-    if args.outfile:
-        junction.write_output(args.outfile, args.infile)
+    if args.profile is not None:
+        log.warn(prof.report())
+        if args.profile:
+            prof.dump_json(args.profile)
 
-    if args.plot or args.export_plot:
+    if args.batch is None and (args.plot or args.export_plot):
+        # only required for plotting, so importing it here
+        import volpy.plot as plot
         plot.junction(junction, args.plot, args.export_plot)
 
 
@@ -8,6 +8,10 @@ coordinates of segmented objects and uses them to generate a 2D bitmap of a
 given size. The resulting bitmap is stored as a CSV file that can be used in
 ImageJ via the File>Import>Text_Image function, empty pixels are black, the
 others contain values > 0.
+
+If a size in Z is given, a 3D bitmap is generated and its slices are written
+one below the other, so the imported image can be split up into a stack using
+Image>Stacks>Tools>Montage to Stack (with one column).
 """
 
 import sys
@@ -29,6 +33,8 @@ def parse_arguments():
            help='CSV file to store the results.')
     addarg('-s', '--size', required=True, type=int,
            help='Size of generated bitmap in pixels.')
+    addarg('-z', '--zsize', required=False, type=int, default=None,
+           help='Number of slices for generating a 3D bitmap.')
     addarg('--delta', default=50, type=int,
            help='Offset used for indicating an object (default=50).')
     addarg('--crop', action='store_const', const=True, default=False,
@@ -37,6 +43,8 @@ def parse_arguments():
            help='Size of volume (x direction) in calibrated units .')
     addarg('-y', '--ymax', required=False, type=float, default=None,
            help='Size of volume (y direction) in calibrated units .')
+    addarg('--cache', nargs='?', const=True, default=None, metavar='DIR',
+           help='cache the parsed worksheets next to the XML file or in DIR')
     try:
         return argparser.parse_args()
     except IOError as err:
@@ -47,12 +55,18 @@ def main():
     """Read Imaris export and generate bitmap."""
     args = parse_arguments()
 
-    spots = StatisticsSpots(args.infile)
+    spots = StatisticsSpots(args.infile, cache=args.cache)
     if args.xmax is not None:
         spots.set_limits(xmax=args.xmax)
     if args.ymax is not None:
         spots.set_limits(ymax=args.ymax)
-    matrix = spots.gen_bitmap((args.size, args.size), crop=args.crop, delta=50)
+    size = (args.size, args.size)
+    if args.zsize is not None:
+        size += (args.zsize,)
+    matrix = spots.gen_bitmap(size, crop=args.crop, delta=args.delta)
+    if matrix.ndim == 3:
+        # stack the Z slices vertically:
+        matrix = matrix.transpose(2, 0, 1).reshape(-1, args.size)
     np.savetxt(args.outfile, matrix, fmt='%i')
 
 
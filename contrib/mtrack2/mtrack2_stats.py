@@ -123,14 +123,16 @@ def calc_rotation(deltas, normals, start):
     deg_rotation : float
         The rotation angle in arc degrees [-180, 180].
     '''
-    # TODO: move to volpy
     res = np.zeros((deltas.shape[0], 1))
-    for pos in range(start, res.shape[0] - 1):
-        # if any of the two normal vectors is zero, nothing moved
-        if (normals[pos - 1] * normals[pos] == 0.):
-            res[pos + 1] = 0
-        else:
-            res[pos + 1] = vp.angle_2d(deltas[pos - 1], deltas[pos])
+    pos = np.arange(start, res.shape[0] - 1)
+    if not len(pos):
+        return res
+    # NOTE: for pos == 0 this compares to the last vector (index -1), just
+    # like plain Python indexing does
+    rot = vp.angles_2d(deltas[pos - 1], deltas[pos])
+    # if any of the two normal vectors is zero, nothing moved
+    moved = (normals[pos - 1] * normals[pos]).ravel() != 0.
+    res[pos + 1, 0] = np.where(moved, rot, 0)
     return res
 
 
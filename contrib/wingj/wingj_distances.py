@@ -14,7 +14,7 @@ structures.
 """
 
 from volpy.imagej import read_csv_com, WingJStructure
-from log import log, set_loglevel
+from log import log, prof, set_loglevel
 import imaris_xml as ix
 import sys
 import argparse
@@ -32,6 +32,12 @@ def parse_arguments():
         help='ImageJ CSV export having "center of mass" measurements.')
     argparser.add_argument('-p', '--pixelsize', required=False, type=float,
         default=1.0, help='Pixel size to calibrate WingJ data.')
+    argparser.add_argument('--cache', nargs='?', const=True, default=None,
+        metavar='DIR',
+        help='cache the parsed worksheets next to the XML file or in DIR')
+    argparser.add_argument('--profile', dest='profile', nargs='?', const='',
+        default=None, metavar='JSON',
+        help='report time and memory per stage, optionally saved as JSON')
     argparser.add_argument('-v', '--verbosity', dest='verbosity',
         action='count', default=0)
     try:
@@ -45,10 +51,12 @@ def main():
     """Parse commandline arguments and run distance calculations."""
     args = parse_arguments()
     set_loglevel(args.verbosity)
+    prof.enable(args.profile is not None)
     log.warn('Calculating distances to WingJ structures...')
 
     if args.imsxml is not None:
-        coords = ix.ImarisXML(args.imsxml).coordinates_2d('Position')
+        coords = ix.ImarisXML(args.imsxml, streaming=True,
+                              cache=args.cache).coordinates_2d('Position')
     elif args.ijroi is not None:
         coords = read_csv_com(args.ijroi)
         coords *= args.pixelsize
@@ -60,6 +68,10 @@ def main():
     wingj.min_dist_csv_export(coords, args.directory)
 
     log.warn('Finished.')
+    if args.profile is not None:
+        log.warn(prof.report())
+        if args.profile:
+            prof.dump_json(args.profile)
 
 
 if __name__ == "__main__":
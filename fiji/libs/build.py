@@ -16,6 +16,7 @@ for path in sys.path:
 
 import log
 import misc
+import xmlbackend
 import imcf
 import microscopy
 # import ijpy
@@ -0,0 +1 @@
+../../../lib/python2.7/xmlbackend.py
\ No newline at end of file
@@ -5,11 +5,278 @@
 # TODO: do sanity checking
 # TODO: evaluate datatypes from XML cells
 
-import xml.etree.ElementTree as etree
+import os
+import zlib
+import json
+import errno
+import hashlib
+import zipfile
 import numpy as np
-from log import log
+import xmlbackend
+from log import log, truncated
 from misc import filename
 import volpy as vp
+from volpy import loader
+
+
+class WorksheetCache(object):
+
+    """A compressed ".npz" file storing the parsed worksheets of an XML file.
+
+    The cache file is placed next to the XML file (named like the XML file
+    plus ".npz") or in a given directory. It records the size, modification
+    time and SHA-1 hash of the XML file, the cached worksheets are only used
+    as long as all of these match.
+
+    Example
+    -------
+    >>> import tempfile, shutil
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> fname = os.path.join(tmpdir, 'spots.xml')
+    >>> open(fname, 'w').write('<Workbook/>')
+    >>> cache = WorksheetCache(fname)
+    >>> cache.sheets()
+    []
+    >>> cache.store({'Position': [['1.5', None, u'\\xb5m']]},
+    ...             {'Position': ['Position X', 'Unit', 'Unit']})
+    True
+    >>> WorksheetCache(fname).get('Position')
+    ([['1.5', None, u'\\xb5m']], ['Position X', 'Unit', 'Unit'])
+    >>> open(fname, 'a').write(' ')
+    >>> WorksheetCache(fname).sheets()
+    []
+    >>> shutil.rmtree(tmpdir)
+    """
+
+    # the version of the cache file format, stored in the metadata:
+    FORMAT_VERSION = 1
+
+    # the errors raised by np.load() for corrupt or truncated files:
+    READ_ERRORS = (IOError, ValueError, KeyError, EOFError,
+                   zipfile.BadZipfile, zlib.error)
+
+    def __init__(self, path, cachedir=None, namespace=''):
+        """Set up the cache for an XML file.
+
+        Parameters
+        ----------
+        path : str
+            The name of the XML file.
+        cachedir : str, optional
+            The directory to store the cache file in (created if necessary),
+            by default it is placed next to the XML file.
+        namespace : str, optional
+            The namespace the worksheets were parsed with.
+        """
+        self.path = path
+        self.namespace = namespace
+        if cachedir is None:
+            self.fname = path + '.npz'
+        else:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            # different files with the same name must not share a cache:
+            key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+            self.fname = os.path.join(cachedir, '%s-%s.npz' %
+                                      (os.path.basename(path), key[:12]))
+        self._stamp = loader.file_stamp(path)
+        self._sha1 = None
+        self.meta = self._load_meta()
+
+    def sha1(self):
+        """Get the SHA-1 hash of the contents of the XML file."""
+        if self._sha1 is None:
+            digest = hashlib.sha1()
+            with open(self.path, 'rb') as fhandle:
+                for block in iter(lambda: fhandle.read(2 ** 20), ''):
+                    digest.update(block)
+            self._sha1 = digest.hexdigest()
+        return self._sha1
+
+    def _load_meta(self):
+        """Read the metadata of the cache file, None if it is not valid."""
+        try:
+            with np.load(self.fname) as npz:
+                meta = json.loads(str(npz['meta']))
+        except self.READ_ERRORS as err:
+            if getattr(err, 'errno', None) != errno.ENOENT:
+                log.warn('Ignoring unreadable worksheet cache "%s": %s' %
+                         (self.fname, err))
+            return None
+        if (meta.get('version') != self.FORMAT_VERSION or
+                meta.get('namespace') != self.namespace or
+                not loader.stamp_matches(meta.get('stamp', {}), self.path) or
+                meta.get('sha1') != self.sha1()):
+            log.info('Worksheet cache "%s" is outdated.' % self.fname)
+            return None
+        return meta
+
+    def sheets(self):
+        """Get the names of the cached worksheets."""
+        if self.meta is None:
+            return []
+        return [_native(name) for name in self.meta['sheets']]
+
+    def ws_names(self):
+        """Get the names of all worksheets of the XML file (None if unknown).
+        """
+        if self.meta is None or self.meta['ws_names'] is None:
+            return None
+        return [_native(name) for name in self.meta['ws_names']]
+
+    def get(self, ws_name):
+        """Read a worksheet from the cache.
+
+        Returns
+        -------
+        (cells, header) : (list(list), list) or None
+            See ImarisXML.celldata() and ImarisXML.header(), None if the
+            worksheet is not cached.
+        """
+        if ws_name not in self.sheets():
+            return None
+        prefix = 'sheet%i' % self.meta['sheets'].index(ws_name)
+        try:
+            with np.load(self.fname) as npz:
+                cells = _unpack_rows(npz, prefix + '_cells')
+                header = _unpack_rows(npz, prefix + '_header')[0]
+        except self.READ_ERRORS as err:
+            log.warn('Ignoring unreadable worksheet cache "%s": %s' %
+                     (self.fname, err))
+            # the whole cache gets rebuilt by the next store():
+            self.meta = None
+            return None
+        log.info('Loaded worksheet "%s" from cache.' % ws_name)
+        return (cells, header)
+
+    def store(self, cells, headers, ws_names=None):
+        """Write worksheets to the cache, keeping the ones cached before.
+
+        As the whole file is rewritten (copying the previously cached arrays
+        as they are), new worksheets should be stored together rather than
+        one by one. Errors (e.g. a read-only directory) are logged but
+        otherwise ignored.
+
+        Parameters
+        ----------
+        cells, headers : dict
+            The worksheet contents and column labels, see ImarisXML.
+        ws_names : list(string), optional
+            The names of all worksheets in the XML file, if known.
+
+        Returns
+        -------
+        success : bool
+        """
+        arrays = {}
+        sheets = sorted(cells)
+        for (idx, ws_name) in enumerate(sheets):
+            arrays.update(_pack_rows(cells[ws_name], 'sheet%i_cells' % idx))
+            arrays.update(_pack_rows([headers.get(ws_name, [])],
+                                     'sheet%i_header' % idx))
+        kept = [name for name in self.sheets() if name not in cells]
+        if kept:
+            with np.load(self.fname) as npz:
+                for ws_name in kept:
+                    old = 'sheet%i_' % self.meta['sheets'].index(ws_name)
+                    new = 'sheet%i_' % len(sheets)
+                    sheets.append(ws_name)
+                    for key in npz.files:
+                        if key.startswith(old):
+                            arrays[new + key[len(old):]] = npz[key]
+        if ws_names is None:
+            ws_names = self.ws_names()
+        meta = {'version': self.FORMAT_VERSION, 'namespace': self.namespace,
+                'stamp': self._stamp, 'sha1': self.sha1(), 'sheets': sheets,
+                'ws_names': ws_names}
+        arrays['meta'] = np.array(json.dumps(meta))
+        try:
+            # write to a temporary file first, so other processes never see
+            # an incomplete cache:
+            tmpname = '%s.%i.tmp' % (self.fname, os.getpid())
+            with open(tmpname, 'wb') as npzfile:
+                np.savez_compressed(npzfile, **arrays)
+            os.rename(tmpname, self.fname)
+        except (IOError, OSError) as err:
+            log.warn('Could not write worksheet cache "%s": %s' %
+                     (self.fname, err))
+            return False
+        self.meta = meta
+        log.info('Written worksheet cache "%s".' % self.fname)
+        return True
+
+
+def _native(text):
+    """Convert an ASCII-only unicode object (e.g. from JSON) into a string."""
+    try:
+        return str(text)
+    except UnicodeEncodeError:
+        return text
+
+
+def _pack_rows(rows, prefix):
+    """Convert a list of lists of strings (or None) into flat arrays."""
+    flat = [val for row in rows for val in row]
+    # ElementTree returns plain strings for ASCII texts and unicode objects
+    # otherwise, the latter are stored UTF-8 encoded and flagged:
+    is_unicode = np.array([isinstance(val, unicode) for val in flat],
+                          dtype=bool)
+    texts = ['' if val is None else val for val in flat]
+    for idx in np.flatnonzero(is_unicode):
+        texts[idx] = texts[idx].encode('utf-8')
+    return {prefix + '_values': np.array(texts, dtype=np.string_),
+            prefix + '_lengths': np.array([len(row) for row in rows],
+                                          dtype=np.int64),
+            prefix + '_none': np.array([val is None for val in flat],
+                                       dtype=bool),
+            prefix + '_unicode': is_unicode}
+
+
+def _unpack_rows(npz, prefix):
+    """Restore the list of lists converted by _pack_rows()."""
+    flat = npz[prefix + '_values'].tolist()
+    for idx in np.flatnonzero(npz[prefix + '_none']):
+        flat[idx] = None
+    for idx in np.flatnonzero(npz[prefix + '_unicode']):
+        flat[idx] = flat[idx].decode('utf-8')
+    bounds = np.concatenate([[0], npz[prefix + '_lengths'].cumsum()]).tolist()
+    return [flat[bounds[i]:bounds[i + 1]] for i in xrange(len(bounds) - 1)]
+
+
+def _column_array(cells):
+    """Convert the cells of a column into an array of the most specific type.
+
+    Columns of integers (like "ID") are converted to ints, columns of numbers
+    to floats (empty cells becoming NaN), everything else is kept as strings
+    (empty cells becoming '').
+
+    Example
+    -------
+    >>> _column_array(['1', '2']).tolist()
+    [1, 2]
+    >>> _column_array(['1.5', None, '2']).tolist()
+    [1.5, nan, 2.0]
+    >>> _column_array(['um', None]).tolist()
+    ['um', '']
+    >>> _column_array([None, None]).tolist()
+    ['', '']
+    """
+    filled = [cell for cell in cells if cell not in (None, '')]
+    if filled:
+        for dtype in (np.int64, np.float64):
+            if dtype is np.int64 and len(filled) != len(cells):
+                continue
+            try:
+                values = np.array(filled).astype(dtype)
+            except (ValueError, OverflowError):
+                continue
+            if len(filled) == len(cells):
+                return values
+            out = np.empty(len(cells), dtype=dtype)
+            out.fill(np.nan)
+            out[[cell not in (None, '') for cell in cells]] = values
+            return out
+    return np.array(['' if cell is None else cell for cell in cells])
 
 
 class ImarisXML(object):
@@ -27,9 +294,58 @@ class ImarisXML(object):
     >>> if xmldata._worksheet('NonExistingWorksheet') is None:
     ...     True
     True
+
+    In streaming mode only the requested worksheets are extracted, without
+    building the tree of the whole document:
+    >>> import os, tempfile
+    >>> (fd, fname) = tempfile.mkstemp(suffix='.xml')
+    >>> os.fdopen(fd, 'w').write('<Workbook '
+    ...     'xmlns="urn:schemas-microsoft-com:office:spreadsheet" '
+    ...     'xmlns:ss="urn:schemas-microsoft-com:office:spreadsheet">'
+    ...     '<Worksheet ss:Name="Volume"><Table>'
+    ...     '<Row ss:StyleID="s1"><Cell><Data>Volume</Data></Cell></Row>'
+    ...     '<Row><Cell><Data>8.4</Data></Cell></Row>'
+    ...     '</Table></Worksheet></Workbook>')
+    >>> xmldata = ImarisXML(fname, streaming=True)
+    >>> xmldata.celldata('Volume')
+    [['8.4']]
+    >>> xmldata.tree is None
+    True
+    >>> ImarisXML(fname).worksheet_names()
+    ['Volume']
+    >>> xmldata.header('Volume')
+    ['Volume']
+    >>> xmldata.columns('Volume', ['Volume']).tolist()
+    [[8.4]]
+    >>> xmldata.records('Volume')['Volume'].tolist()
+    [8.4]
+
+    With a cache, the extracted worksheets are stored in a compressed file
+    that is used instead of parsing the XML again (see WorksheetCache):
+    >>> ImarisXML(fname, cache=True).celldata('Volume')
+    [['8.4']]
+    >>> os.path.exists(fname + '.npz')
+    True
+    >>> xmldata = ImarisXML(fname, cache=True)
+    >>> (xmldata.celldata('Volume'), xmldata.tree)
+    ([['8.4']], None)
+    >>> os.remove(fname + '.npz')
+
+    Files that are no Excel XML workbooks are rejected right away, without
+    parsing them:
+    >>> open(fname, 'w').write('<XYStage/>')
+    >>> ImarisXML(fname)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    TypeError: Unexpected root element "XYStage" ...
+    >>> os.remove(fname)
     """
 
-    def __init__(self, xmlfile, namespace=''):
+    # the namespace of Excel XML and the tag of its root element:
+    NAMESPACE = 'urn:schemas-microsoft-com:office:spreadsheet'
+    ROOT_TAG = 'Workbook'
+
+    def __init__(self, xmlfile, namespace='', streaming=False, cache=None):
         """Create a new Imaris-XML object from a file.
 
         Parameters
@@ -39,31 +355,130 @@ class ImarisXML(object):
         namespace : string, optional
             A string denoting the namespace expected in the XML file,
             defaults to the one used by MS Excel in its XML format.
+        streaming : bool, optional
+            If True, the file is not parsed into a tree. Instead, the
+            worksheets are extracted on demand by an incremental parser
+            discarding everything else (see _stream_cells()), so the memory
+            required depends on the requested worksheets only. A filehandle
+            given in this mode needs to be seekable.
+        cache : bool or str, optional
+            If True, the extracted worksheets are cached in a compressed file
+            next to the XML file (see WorksheetCache), a string specifies a
+            directory to store the cache file in instead. Worksheets found in
+            an up-to-date cache are loaded from there, the XML file is only
+            parsed (on demand) if other worksheets are requested.
+
+        Raises
+        ------
+        TypeError
+            If the file is not an Excel XML workbook with the expected
+            namespace. For files on disk this is checked before parsing (see
+            xmlbackend.check_root()).
         """
         self.tree = None
         self.cells = {}
+        self.headers = {}
+        self.streaming = streaming
+        self._index = {}   # worksheet name -> (element, list of row elements)
+        self._ws_names = None   # worksheet names in document order
+        self._unsaved = set()   # parsed worksheets not stored in the cache
+        self.source = xmlfile
         # by default, we expect the namespace of Excel XML:
-        self.namespace = 'urn:schemas-microsoft-com:office:spreadsheet'
+        self.namespace = self.NAMESPACE
         if namespace:
             self.namespace = namespace
-        log.info("Parsing XML file: %s" % filename(xmlfile))
-        self.tree = etree.parse(xmlfile)
+        path = loader.source_path(xmlfile)
+        if path is not None:
+            xmlbackend.check_root(path, self.ROOT_TAG, self.namespace)
+        self.cache = None
+        if cache:
+            if path is None:
+                log.warn("Can't cache worksheets of %s" % filename(xmlfile))
+            else:
+                cachedir = None if cache is True else cache
+                self.cache = WorksheetCache(path, cachedir, self.namespace)
+                self._ws_names = self.cache.ws_names()
+        if streaming:
+            log.info("Streaming XML file: %s" % filename(xmlfile))
+            return
+        if self.cache is None:
+            self._parse_tree()
+
+    def _parse_tree(self):
+        """Parse the whole XML file into a tree (unless done before)."""
+        if self.tree is not None:
+            return
+        log.info("Parsing XML file (%s): %s" %
+                 (xmlbackend.name, filename(self.source)))
+        self.tree = xmlbackend.parse(self.source)
         log.info("Done parsing XML: %s" % self.tree)
         self._check_namespace()
+        self._build_index()
 
-    def _check_namespace(self):
+    def _check_namespace(self, root=None):
         """Check if an XML tree has a certain namespace.
 
         Take an XML etree object and a string denoting the expected namespace,
         check if the namespace of the XML tree matches. Return the namespace if
         yes, raise a TypeError otherwise.
+
+        Parameters
+        ----------
+        root : etree element, optional
+            The root element to check, defaults to the one of the parsed tree.
         """
-        real_ns = self.tree.getroot().tag[1:].split("}")[0]
+        if root is None:
+            root = self.tree.getroot()
+        real_ns = root.tag[1:].split("}")[0]
         if not real_ns == self.namespace:
             log.critical("ERROR, couldn't find the expected XML namespace!")
             log.critical("Namespace parsed from XML: '%s'" % real_ns)
             raise TypeError
 
+    def _build_index(self):
+        """Index the worksheets of the parsed tree and their rows.
+
+        The whole tree is traversed once (in document order, so every row
+        belongs to the worksheet encountered last), subsequent lookups of
+        worksheets and rows don't need to search the tree again.
+        """
+        ws_tag = '{%s}Worksheet' % self.namespace
+        row_tag = '{%s}Row' % self.namespace
+        name_att = '{%s}Name' % self.namespace
+        self._index = {}
+        self._ws_names = []
+        rows = None
+        for elem in self.tree.getroot().iter():
+            if elem.tag == ws_tag:
+                rows = []
+                name = elem.get(name_att)
+                # we ignore broken files that contain multiple worksheets
+                # having identical names and just use the first one (blame the
+                # creator for such stupid files):
+                if name not in self._index:
+                    self._index[name] = (elem, rows)
+                    self._ws_names.append(name)
+            elif elem.tag == row_tag and rows is not None:
+                rows.append(elem)
+        log.info("Indexed worksheets: %s" % ', '.join(self._ws_names))
+
+    def worksheet_names(self):
+        """Get the names of all worksheets in the file (in document order).
+
+        In streaming mode this requires a pass over the whole file, unless a
+        previous pass (see _stream_cells()) already did that.
+
+        Returns
+        -------
+        names : list(string)
+        """
+        if self._ws_names is None:
+            if self.streaming:
+                self._stream_cells([])
+            else:
+                self._parse_tree()
+        return list(self._ws_names)
+
     def _worksheet(self, ws_name):
         """Look up a certain worksheet in the Excel XML tree.
 
@@ -77,15 +492,10 @@ class ImarisXML(object):
         worksheet : etree element
             The XML subtree pointing to the desired worksheet.
         """
-        pattern = ".//{%s}Worksheet[@{%s}Name='%s']" % \
-            (self.namespace, self.namespace, ws_name)
-        # we ignore broken files that contain multiple worksheets having
-        # identical names and just return the first one (blame the creator for
-        # such stupid files):
-        try:
-            worksheet = self.tree.findall(pattern)[0]
-        except IndexError:
+        self._parse_tree()
+        if ws_name not in self._index:
             return None
+        worksheet = self._index[ws_name][0]
         log.info("Found worksheet: %s" % worksheet)
         return worksheet
 
@@ -93,30 +503,153 @@ class ImarisXML(object):
         """Parse the cell-contents of a worksheet into a 2D array.
 
         After parsing the contents, they are added to the global map 'cells'
-        using the worksheet name as the key.
+        using the worksheet name as the key. Header rows (having a style
+        attribute) are not part of the contents, the last one of them holds
+        the column labels that are added to the map 'headers'.
 
         Parameters
         ----------
         ws_name : string
             The name of the worksheet to process.
         """
-        rows = self._worksheet(ws_name).findall('.//{%s}Row' % self.namespace)
+        if self._restore_cached(ws_name):
+            return
+        if self.streaming:
+            self._stream_cells([ws_name])
+            if ws_name not in self.cells:
+                raise KeyError("Worksheet '%s' not found!" % ws_name)
+            return
+        self._parse_tree()
+        if ws_name not in self._index:
+            raise KeyError("Worksheet '%s' not found!" % ws_name)
+        rows = self._index[ws_name][1]
         cells = []
+        header = []
         for row in rows:
             content = []
             # check if this is a header row:
             style_att = '{%s}StyleID' % self.namespace
             if style_att in row.attrib:
-                # we don't process the header row, so skip it
+                # the header row is not part of the contents, so skip it
+                header = [cell[0].text for cell in row]
                 continue
             for cell in row:
                 content.append(cell[0].text)
-            log.debug('length of row: %i' % len(row))
-            log.debug(content)
+            log.debug('length of row: %i', len(row))
+            log.debug('%s', truncated(content))
             cells.append(content)
         self.cells[ws_name] = cells
-        log.debug("--- cells ---\n%s\n--- cells ---" % self.cells)
-        log.info("Parsed rows: %i" % len(self.cells))
+        self.headers[ws_name] = header
+        self._unsaved.add(ws_name)
+        log.debug("--- cells ---\n%s\n--- cells ---", truncated(cells))
+        log.info("Parsed rows: %i", len(cells))
+
+    def _restore_cached(self, ws_name):
+        """Load a worksheet from the cache into 'cells' and 'headers'.
+
+        Returns
+        -------
+        found : bool
+            False if there is no cache or the worksheet is not cached.
+        """
+        if self.cache is None:
+            return False
+        cached = self.cache.get(ws_name)
+        if cached is None:
+            return False
+        (self.cells[ws_name], self.headers[ws_name]) = cached
+        return True
+
+    def _update_cache(self):
+        """Store the worksheets parsed since the last call in the cache.
+
+        This is done once per public call (like celldata()), so parsing
+        several worksheets rewrites the cache file only once.
+        """
+        if self.cache is None or not self._unsaved:
+            return
+        cells = dict((name, self.cells[name]) for name in self._unsaved)
+        self._unsaved = set()
+        self.cache.store(cells, self.headers, self._ws_names)
+
+    def _stream_cells(self, ws_names):
+        """Extract the cell-contents of worksheets using incremental parsing.
+
+        The file is parsed once, stopping as soon as all requested worksheets
+        were found (if the end of the file is reached, the names of all
+        worksheets are recorded on the way). Every row is discarded right
+        after processing it, as is every worksheet, so the memory required
+        for the parsing itself is independent of the size of the file. Like
+        in _parse_cells(), the contents are added to the map 'cells' and the
+        column labels to the map 'headers'.
+
+        Parameters
+        ----------
+        ws_names : list(string)
+            The names of the worksheets to process.
+        """
+        pending = set(ws_names)
+        ws_tag = '{%s}Worksheet' % self.namespace
+        row_tag = '{%s}Row' % self.namespace
+        name_att = '{%s}Name' % self.namespace
+        style_att = '{%s}StyleID' % self.namespace
+        if isinstance(self.source, basestring):
+            fhandle = open(self.source, 'rb')
+        else:
+            fhandle = self.source
+            fhandle.seek(0)
+        log.info("Extracting worksheets: %s" % ', '.join(ws_names))
+        parents = []   # the currently open elements
+        cells = None   # the rows of the requested worksheet being processed
+        names = []     # the names of the worksheets seen so far
+        events = xmlbackend.iterparse(fhandle, ('start', 'end'))
+        try:
+            for (event, elem) in events:
+                if event == 'start':
+                    if not parents:
+                        self._check_namespace(elem)
+                    parents.append(elem)
+                    if elem.tag == ws_tag:
+                        if elem.get(name_att) in pending:
+                            (cells, header) = ([], [])
+                        if elem.get(name_att) not in names:
+                            names.append(elem.get(name_att))
+                    continue
+                parents.pop()
+                if elem.tag == row_tag:
+                    if cells is None:
+                        pass
+                    elif style_att in elem.attrib:
+                        header = [cell[0].text for cell in elem]
+                    else:
+                        cells.append([cell[0].text for cell in elem])
+                elif elem.tag == ws_tag:
+                    if cells is not None:
+                        ws_name = elem.get(name_att)
+                        self.cells[ws_name] = cells
+                        self.headers[ws_name] = header
+                        self._unsaved.add(ws_name)
+                        pending.discard(ws_name)
+                        log.info("Parsed rows of '%s': %i" %
+                                 (ws_name, len(cells)))
+                        cells = None
+                else:
+                    continue
+                # processed rows and worksheets are not needed any more (they
+                # are the first children of their parent, except for a few
+                # non-row elements like "Column" or "Styles"):
+                elem.clear()
+                parents[-1].remove(elem)
+                if ws_names and not pending:
+                    break
+            else:
+                self._ws_names = names
+        finally:
+            if fhandle is not self.source:
+                fhandle.close()
+        if pending:
+            log.warn("Worksheets not found: %s" % ', '.join(sorted(pending)))
+        self._update_cache()
 
     def celldata(self, ws_name):
         """Provide access to the cell contents.
@@ -126,8 +659,10 @@ class ImarisXML(object):
 
         Parameters
         ----------
-        ws_name : string
-            The name of the desired worksheet.
+        ws_name : string or list(string)
+            The name of the desired worksheet, or a list of names to get the
+            contents of multiple worksheets at once (in streaming mode, all of
+            them are extracted in a single pass over the file).
 
         Returns
         -------
@@ -137,14 +672,137 @@ class ImarisXML(object):
               [r2c1, r2c2, r2c3, ...],
               [r3c1, r3c2, r3c3, ...],
               ...                      ]
+            If a list of names was given, a list of those is returned.
+        """
+        if isinstance(ws_name, basestring):
+            if not ws_name in self.cells:
+                self._parse_cells(ws_name)
+                self._update_cache()
+            return(self.cells[ws_name])
+        missing = [name for name in ws_name if name not in self.cells and
+                   not self._restore_cached(name)]
+        if self.streaming and missing:
+            self._stream_cells(missing)
+            missing = [name for name in missing if name not in self.cells]
+            if missing:
+                raise KeyError("Worksheet '%s' not found!" % missing[0])
+        for name in missing:
+            self._parse_cells(name)
+        self._update_cache()
+        return [self.cells[name] for name in ws_name]
+
+    def header(self, ws_name):
+        """Get the column labels of a worksheet.
+
+        Parameters
+        ----------
+        ws_name : string
+            The name of the worksheet.
+
+        Returns
+        -------
+        labels : list(string)
+            The contents of the (last) header row, an empty list if the
+            worksheet has no header.
         """
         if not ws_name in self.cells:
             self._parse_cells(ws_name)
-        return(self.cells[ws_name])
+            self._update_cache()
+        return self.headers[ws_name]
+
+    def _column_index(self, ws_name, label):
+        """Get the index of a labeled column, raising a KeyError if unknown."""
+        header = self.header(ws_name)
+        if label not in header:
+            raise KeyError("Worksheet '%s' has no column '%s'!" %
+                           (ws_name, label))
+        return header.index(label)
+
+    def _column_data(self, ws_name, idx, dtype=None):
+        """Convert the values of a column (given by its index) in bulk.
+
+        Returns
+        -------
+        values : np.ndarray (shape = (N,))
+            The values converted to "dtype" (or kept as strings if None).
+        """
+        values = np.array([row[idx] for row in self.celldata(ws_name)])
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+    def columns(self, ws_name, labels, dtype=np.float64):
+        """Extract columns of a worksheet (identified by their labels).
+
+        Parameters
+        ----------
+        ws_name : string
+            The name of the worksheet to process.
+        labels : string or list(string)
+            The label of the desired column (see header()) or a list of them.
+        dtype : np.dtype, optional
+            The data type the values are converted to.
+
+        Returns
+        -------
+        out : np.ndarray
+            An array of shape (N,) for a single label or (N, len(labels))
+            for a list of them.
+        """
+        if isinstance(labels, basestring):
+            return self._column_data(ws_name,
+                                     self._column_index(ws_name, labels),
+                                     dtype)
+        out = np.empty((len(self.celldata(ws_name)), len(labels)),
+                       dtype=dtype)
+        for (col, label) in enumerate(labels):
+            out[:, col] = self._column_data(
+                ws_name, self._column_index(ws_name, label), dtype)
+        return out
+
+    def records(self, ws_name, dtypes=None):
+        """Extract all columns of a worksheet into a record array.
+
+        Parameters
+        ----------
+        ws_name : string
+            The name of the worksheet to process.
+        dtypes : dict(string: np.dtype), optional
+            Data types for the columns (given by their labels). Other columns
+            are converted to ints or floats if possible and kept as strings
+            otherwise (see _column_array()).
+
+        Returns
+        -------
+        out : np.recarray
+            The records having the column labels as field names (columns
+            without a label are named like "f3").
+        """
+        if dtypes is None:
+            dtypes = {}
+        header = self.header(ws_name)
+        ncols = max([len(header)] +
+                    [len(row) for row in self.celldata(ws_name)[:1]])
+        arrays = []
+        names = []
+        for idx in range(ncols):
+            label = header[idx] if idx < len(header) else None
+            names.append(label or 'f%i' % idx)
+            if label in dtypes:
+                arrays.append(self._column_data(ws_name, idx, dtypes[label]))
+                continue
+            arrays.append(_column_array([row[idx] for row in
+                                         self.celldata(ws_name)]))
+        return np.rec.fromarrays(arrays, names=names)
 
     def coordinates(self, ws_name):
         """Extract coordinates and ID's from a list of worksheet-cells.
 
+        The columns are identified by their labels ("Position X", "Position
+        Y", "Position Z" and "ID"). If the worksheet doesn't have these, the
+        default layout of Imaris exports is assumed (the first three columns
+        and the eighth one for the ID).
+
         Parameters
         ----------
         ws_name : string
@@ -155,20 +813,23 @@ class ImarisXML(object):
         out : np.ndarray
             A numpy ndarray of shape (N,3) containing 3-tuples (floats) using
             the ID as index, representing the coordinates in (x, y, z) order.
+            The rows are ordered by their ID (keeping the order of the
+            worksheet for identical ones).
         """
-        coords = []
-        # make sure the cells were already parsed:
-        if not ws_name in self.cells:
-            self._parse_cells(ws_name)
-        # extract positions and ID:
-        for cell in self.cells[ws_name]:
-            idx = int(cell[7])
-            x = float(cell[0])
-            y = float(cell[1])
-            z = float(cell[2])
-            coords.insert(idx, (x, y, z))
+        labels = ['Position X', 'Position Y', 'Position Z', 'ID']
+        header = self.header(ws_name)
+        if all([label in header for label in labels]):
+            cols = [header.index(label) for label in labels]
+        else:
+            cols = [0, 1, 2, 7]
+        coords = np.empty((len(self.celldata(ws_name)), 3))
+        for (axis, idx) in enumerate(cols[:3]):
+            coords[:, axis] = self._column_data(ws_name, idx, np.float64)
+        ids = self._column_data(ws_name, cols[3], int)
+        # place the rows according to their ID in one step:
+        coords = coords[np.argsort(ids, kind='mergesort')]
         log.debug("Parsed coordinates: %i" % len(coords))
-        return np.array(coords)
+        return coords
 
     def coordinates_2d(self, ws_name):
         """A wrapper to retrieve a view on the 2D coordinates only."""
@@ -179,17 +840,48 @@ class StatisticsSpots(vp.Points3D):
 
     """Class representing "spots" objects exported from the statistics tab."""
 
-    def __init__(self, infile):
-        """Load spots positions from a statistics XML export."""
+    def __init__(self, infile, cache=None):
+        """Load spots positions from a statistics XML export.
+
+        Parameters
+        ----------
+        infile : file or str
+        cache : bool or str, optional
+            Cache the extracted worksheets, see ImarisXML.
+        """
+        self.xml_cache = cache
         super(StatisticsSpots, self).__init__(infile)
 
     def __load_data__(self, infile):
         """Override the loading by using the XML importer."""
-        xmldata = ImarisXML(infile)
+        xmldata = ImarisXML(infile, streaming=True, cache=self.xml_cache)
         self.data = xmldata.coordinates('Position')
         del xmldata
-        log.info('Created %i spots from XML export.\n%s' %
-                 (len(self.data), str(self.data)))
+        log.info('Created %i spots from XML export.\n%s', len(self.data),
+                 truncated(self.data))
+
+
+def find_exports(path, pattern='*.xml', namespace=''):
+    """Find the Excel XML workbooks (e.g. Imaris exports) in a directory.
+
+    Only the beginning of every file is checked (see xmlbackend.find_files()),
+    so this can be used to pre-filter the inputs of a batch run cheaply.
+
+    Parameters
+    ----------
+    path : str
+        The directory to search in.
+    pattern : str, optional
+        A glob pattern preselecting the files.
+    namespace : str, optional
+        The expected namespace, see ImarisXML.
+
+    Returns
+    -------
+    fnames : list(str)
+    """
+    return xmlbackend.find_files(path, ImarisXML.ROOT_TAG,
+                                 namespace or ImarisXML.NAMESPACE, pattern)
 
 if __name__ == "__main__":
     print('Running doctest on file "%s".' % __file__)
@@ -11,6 +11,25 @@ always use the same logger instance (that "singleton" functionality is built
 into the logging module, we just do the setup here). This can easily be checked
 by looking at the log handlers in the different modules.
 
+The module also provides "prof", a simple profiler collecting wall time, call
+counts and peak array sizes for named stages of a pipeline (see the Profiler
+class). It is disabled by default, enabling it is up to the calling script:
+>>> from log import prof
+>>> prof.enable()
+>>> with prof.stage('tesselation'):
+...     pass
+>>> log.warn(prof.report())
+
+Formatting large objects (e.g. point lists or distance matrices) for a message
+that gets dropped anyway is expensive, so the formatting should be left to the
+logger by passing the objects as arguments. The helpers Lazy, lazy_pformat()
+and truncated() defer the formatting to that point, the latter two also
+shorten long sequences (see MAXITEMS):
+>>> from log import truncated, lazy_pformat
+>>> path = range(5000)
+>>> log.debug('path: %s', truncated(path))
+>>> log.info('path: %s', lazy_pformat(path))
+
 The logging levels, in increasing order of importance, are:
 
 DEBUG
@@ -26,10 +45,16 @@ code can be used:
 >>> log.setLevel(loglevel)
 """
 
+import time
+import pprint
 import logging
 
 log = logging.getLogger('imcf_logger')
 
+# the number of items shown by truncated() and lazy_pformat(), None to show
+# everything:
+MAXITEMS = 100
+
 # we always log to stdout, so add a console handler to the logger
 STREAM_HDL = logging.StreamHandler()
 log.addHandler(STREAM_HDL)
@@ -61,6 +86,308 @@ def set_filehandler(fname, no_stderr=False, mode='a'):
         log.removeHandler(STREAM_HDL)
     return FILE_HDL
 
+
+class Lazy(object):
+
+    """Defer a function call until its result is formatted for a message.
+
+    Example
+    -------
+    >>> msg = Lazy(', '.join, ['a', 'b'])
+    >>> '%s' % msg
+    'a, b'
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+# the former name of the class:
+lazy = Lazy
+
+
+def _is_ndarray(obj):
+    """Check for a numpy array without importing numpy for other objects."""
+    if not (hasattr(obj, 'shape') and hasattr(obj, 'dtype')):
+        return False
+    # numpy is not available on Jython, so it is only imported here:
+    import numpy
+    return isinstance(obj, numpy.ndarray)
+
+
+def _truncate(obj, maxitems, fmt):
+    """Format an object, shortening long arrays, lists and tuples."""
+    if maxitems is None:
+        return fmt(obj)
+    if _is_ndarray(obj):
+        import numpy
+        return numpy.array2string(obj, threshold=maxitems, edgeitems=3)
+    if isinstance(obj, (list, tuple)) and len(obj) > maxitems:
+        half = max(maxitems // 2, 1)
+        items = [fmt(item) for item in obj[:half]] + ['...'] + \
+            [fmt(item) for item in obj[-half:]]
+        brackets = '[]' if isinstance(obj, list) else '()'
+        return '%s%s%s (%i items)' % (brackets[0], ', '.join(items),
+                                      brackets[1], len(obj))
+    return fmt(obj)
+
+
+def truncated(obj, maxitems=None):
+    """Defer formatting an object with str(), shortening long sequences.
+
+    Parameters
+    ----------
+    obj : object
+        Lists and tuples having more than "maxitems" items are shortened to
+        their first and last ones, numpy arrays are summarized like
+        np.array2string() does.
+    maxitems : int, optional
+        Defaults to the module variable MAXITEMS.
+
+    Returns
+    -------
+    msg : Lazy
+
+    Example
+    -------
+    >>> str(truncated(range(1000), 4))
+    '[0, 1, ..., 998, 999] (1000 items)'
+    >>> str(truncated((1, 2)))
+    '(1, 2)'
+    """
+    if maxitems is None:
+        maxitems = MAXITEMS
+    return Lazy(_truncate, obj, maxitems, str)
+
+
+def lazy_pformat(obj, maxitems=None):
+    """Defer pprint.pformat() of an object, shortening long sequences.
+
+    See truncated() for the parameters.
+
+    Example
+    -------
+    >>> print(lazy_pformat([(1, 2)] * 20, 4))
+    [(1, 2), (1, 2), ..., (1, 2), (1, 2)] (20 items)
+    """
+    if maxitems is None:
+        maxitems = MAXITEMS
+    return Lazy(_truncate, obj, maxitems, pprint.pformat)
+
+
+class _NoStage(object):
+
+    """Context manager doing nothing, used while profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class _Stage(object):
+
+    """Context manager timing a single pass through a stage (see Profiler)."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._leave(self.name, time.time() - self.start)
+        return False
+
+
+class Profiler(object):
+
+    """Collect timing, call counts and peak array sizes of pipeline stages.
+
+    Stages are named blocks of code wrapped in a "with prof.stage(name):"
+    statement, they can be nested. For each stage the wall time, the number
+    of calls and the size of the largest array allocated within are recorded
+    (arrays have to be reported explicitly using track()). Additionally there
+    are named counters, see count().
+
+    Profiling is disabled by default, then stage() returns a shared dummy
+    context manager while count() and track() return immediately, so the
+    instrumentation can stay in place without any noticeable overhead.
+
+    This module doesn't depend on numpy (it is also used from Jython), arrays
+    are only inspected for their "nbytes" attribute.
+
+    Example
+    -------
+    >>> prof = Profiler()
+    >>> with prof.stage('not recorded'):
+    ...     prof.count('items')
+    >>> prof.results()['stages']
+    {}
+    >>> prof.enable()
+    >>> for i in range(3):
+    ...     with prof.stage('load'):
+    ...         with prof.stage('parse'):
+    ...             size = prof.track(1024)
+    ...         prof.count('items', 2)
+    >>> res = prof.results()
+    >>> res['order'], res['counters']
+    (['load', 'parse'], {'items': 6})
+    >>> res['stages']['load']['calls'], res['stages']['load']['peak_bytes']
+    (3, 1024)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}    # name -> [calls, seconds, peak_bytes]
+        self.order = []     # the stage names in order of their first use
+        self.counters = {}
+        self._active = []   # the names of the currently running stages
+
+    def enable(self, enabled=True):
+        """Switch profiling on (or off)."""
+        self.enabled = enabled
+
+    def reset(self):
+        """Discard all collected data (the enabled state is kept)."""
+        self.stages = {}
+        self.order = []
+        self.counters = {}
+        self._active = []
+
+    def stage(self, name):
+        """Get a context manager recording a pass through the named stage.
+
+        Time spent in a stage that is re-entered recursively is only counted
+        once, for the outermost pass.
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def _enter(self, name):
+        """Register the start of a stage."""
+        if name not in self.stages:
+            self.stages[name] = [0, 0.0, 0]
+            self.order.append(name)
+        self.stages[name][0] += 1
+        self._active.append(name)
+
+    def _leave(self, name, seconds):
+        """Register the end of a stage that took the given time."""
+        self._active.pop()
+        if name not in self._active:
+            self.stages[name][1] += seconds
+
+    def count(self, name, inc=1):
+        """Increase the named counter."""
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + inc
+
+    def track(self, array):
+        """Record the size of an array for all currently running stages.
+
+        Parameters
+        ----------
+        array : np.ndarray or int
+            The array (or its size in bytes).
+
+        Returns
+        -------
+        array : np.ndarray or int
+            The unmodified parameter, so the call can wrap an allocation.
+        """
+        if not self.enabled:
+            return array
+        nbytes = int(getattr(array, 'nbytes', array))
+        for name in self._active:
+            if nbytes > self.stages[name][2]:
+                self.stages[name][2] = nbytes
+        return array
+
+    def results(self):
+        """Get the collected data as a dict (suitable for JSON).
+
+        Returns
+        -------
+        results : dict
+            The "stages" entry maps the stage names to dicts having the keys
+            "calls", "seconds" and "peak_bytes", the "order" entry is the list
+            of stage names in order of their first use and "counters" maps the
+            counter names to their values.
+        """
+        stages = {}
+        for (name, (calls, seconds, peak)) in self.stages.items():
+            stages[name] = {'calls': calls, 'seconds': seconds,
+                            'peak_bytes': peak}
+        return {'stages': stages, 'order': list(self.order),
+                'counters': dict(self.counters)}
+
+    def merge(self, results):
+        """Add the results of another profiler, e.g. from a worker process.
+
+        Times, calls and counters are summed up, peak sizes are maximized.
+        """
+        for name in results['order']:
+            stage = results['stages'][name]
+            if name not in self.stages:
+                self.stages[name] = [0, 0.0, 0]
+                self.order.append(name)
+            self.stages[name][0] += stage['calls']
+            self.stages[name][1] += stage['seconds']
+            self.stages[name][2] = max(self.stages[name][2],
+                                       stage['peak_bytes'])
+        for (name, value) in results['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """Format the collected data as a table.
+
+        Returns
+        -------
+        report : str
+        """
+        lines = ['%-32s %8s %12s %12s' %
+                 ('stage', 'calls', 'time [s]', 'peak [MB]')]
+        for name in self.order:
+            (calls, seconds, peak) = self.stages[name]
+            lines.append('%-32s %8i %12.4f %12.2f' %
+                         (name, calls, seconds, peak / 1024.0 ** 2))
+        for name in sorted(self.counters):
+            lines.append('%-32s %8i' % (name, self.counters[name]))
+        return '\n'.join(lines)
+
+    def dump_json(self, fname):
+        """Write the collected data (see results()) to a JSON file."""
+        # imported here as it's not available on older Jython versions:
+        import json
+        fout = open(fname, 'w')
+        try:
+            json.dump(self.results(), fout, indent=2, sort_keys=True)
+        finally:
+            fout.close()
+
+
+# the profiler instance shared across modules (like the logger above):
+prof = Profiler()
+
 # from http://stackoverflow.com/questions/4722745
 #
 # formatter = logging.Formatter(
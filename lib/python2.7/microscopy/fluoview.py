@@ -2,7 +2,7 @@
 
 """Tools to process data produced with Olympus FluoView."""
 
-import xml.etree.ElementTree as etree
+import xmlbackend
 from log import log
 
 from microscopy.experiment import MosaicExperiment
@@ -46,12 +46,15 @@ class FluoViewMosaic(MosaicExperiment):
     >>> ij.write_stitching_macro(code, 'stitch_all.ijm', dname)
     """
 
+    # the tag of the root element of a project file:
+    ROOT_TAG = 'XYStage'
+
     def __init__(self, infile, runparser=True):
         """Parse all required values from the XML file.
 
         Instance Variables
         ------------------
-        tree : xml.etree.ElementTree
+        tree : ElementTree (of the backend selected in xmlbackend)
         supplement : {'mcount': int, # highest index reported by FluoView
                       'xdir': str,   # X axis direction
                       'ydir': str    # Y axis direction
@@ -74,17 +77,18 @@ class FluoViewMosaic(MosaicExperiment):
         Evaluate the XML tree for known elements like the root tag (expected to
         be "XYStage", and some of the direct children to make sure the parsed
         file is in fact a FluoView mosaic XML file. Raises exceptions in case
-        something expected can't be found in the tree.
+        something expected can't be found in the tree. The root tag is checked
+        before parsing the whole file (see xmlbackend.check_root()), so other
+        files are rejected right away.
 
         Returns
         -------
         tree : xml.etree.ElementTree
         """
         log.info('Validating FluoView Mosaic XML...')
-        tree = etree.parse(self.infile['full'])
+        xmlbackend.check_root(self.infile['full'], self.ROOT_TAG)
+        tree = xmlbackend.parse(self.infile['full'])
         root = tree.getroot()
-        if not root.tag == 'XYStage':
-            raise TypeError('Unexpected value: %s' % root.tag)
         # find() raises an AttributeError if no such element is found:
         xdir = root.find('XAxisDirection').text
         ydir = root.find('YAxisDirection').text
@@ -168,6 +172,27 @@ class FluoViewMosaic(MosaicExperiment):
             log.warn('First incomplete/missing subvolume: %s' % subvol_fname)
 
 
+def find_mosaic_logs(path, pattern='*.log'):
+    """Find the FluoView mosaic project files in a directory.
+
+    Only the beginning of every file is checked (see xmlbackend.find_files()),
+    so this can be used to pre-filter the inputs of a batch run cheaply.
+
+    Parameters
+    ----------
+    path : str
+        The directory to search in.
+    pattern : str, optional
+        A glob pattern preselecting the files.
+
+    Returns
+    -------
+    fnames : list(str)
+    """
+    return xmlbackend.find_files(path, FluoViewMosaic.ROOT_TAG,
+                                 pattern=pattern)
+
+
 if __name__ == "__main__":
     print('Running doctest on file "%s".' % __file__)
     import doctest
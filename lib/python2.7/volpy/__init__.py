@@ -6,14 +6,16 @@ Provides distance, area, mesh-related calculations on spots in three
 dimensional space.
 """
 
-from log import log
+from log import log, prof, truncated, lazy_pformat
 import numpy as np
-import numpy.matlib as matlib
-import scipy
+from scipy.spatial import cKDTree, ConvexHull
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 import math
 import pprint
 import csv
 from misc import filename
+from volpy import loader
 
 # TODO:
 # - extend the Filament class to be able to return the masks of the individual
@@ -23,13 +25,29 @@ from misc import filename
 __all__ = [
     'build_tuple_seq',
     'dist_matrix',
+    'cross_dist',
+    'cross_dist_min',
+    'min_cross_pair',
     'get_max_dist_pair',
+    'farthest_pair',
     'path_greedy',
     'sort_neighbors',
+    'path_greedy_pts',
+    'sort_neighbors_pts',
     'tri_area',
+    'tri_areas',
+    'tri_normals',
+    'edge_lengths',
+    'rasterize',
+    'angles',
+    'angles_2d',
     'tesselate',
+    'tesselate_pts',
     'Filament',
+    'FilamentGraph',
     'Points3D',
+    'CondensedEDM',
+    'SpatialIndex',
     'GreedyPath',
     'CellJunction',
     # 'find_neighbor',
@@ -39,39 +57,127 @@ __all__ = [
 
 ppr = pprint.PrettyPrinter(indent=4)
 
+# default upper limit (in bytes) for the temporary arrays used when calculating
+# distance matrices in blocks, see dist_matrix() for details:
+EDM_MAXMEM = 64 * 1024 ** 2
 
-def dist_matrix(pts):
+
+def _block_rows(nrows, ncols, ndim, maxmem=None):
+    """Calculate the number of rows per block for a blocked EDM calculation.
+
+    Each row of a block requires a temporary array of (ncols * ndim) squared
+    differences plus the (ncols) sums of them, all of them float64. The number
+    of rows is chosen such that these temporaries stay below "maxmem" bytes,
+    but at least one row is processed per block.
+
+    Example
+    -------
+    >>> _block_rows(1000, 1000, 3, maxmem=32 * 1000 * 10)
+    10
+    >>> _block_rows(1000, 1000, 3, maxmem=1)
+    1
+    >>> _block_rows(5, 1000, 3)
+    5
+    """
+    if maxmem is None:
+        maxmem = EDM_MAXMEM
+    rowmem = max(ncols * (ndim + 1) * 8, 1)
+    return int(min(max(nrows, 1), max(1, maxmem // rowmem)))
+
+
+def _dist_blocks(pts_a, pts_b, maxmem=None):
+    """Generate blocks of rows of the distance matrix between two point sets.
+
+    The distances from all points in "pts_a" to all points in "pts_b" are
+    calculated in blocks of consecutive rows, keeping the memory required for
+    temporary arrays below "maxmem" bytes (see _block_rows()).
+
+    Parameters
+    ----------
+    pts_a, pts_b : np.ndarray (shape = (N, D) and (M, D))
+    maxmem : int, optional
+        Upper limit in bytes for the temporary arrays, EDM_MAXMEM if None.
+
+    Returns
+    -------
+    generator of (start, stop, block)
+        The block contains the distances of the points pts_a[start:stop] to
+        all points of pts_b as np.ndarray (shape = (stop - start, M)).
+
+    Example
+    -------
+    >>> pts = np.array([ [1, 2], [4, 6], [1, 6] ], dtype=float)
+    >>> for (start, stop, block) in _dist_blocks(pts, pts, maxmem=1):
+    ...     print((start, stop, block.tolist()))
+    (0, 1, [[0.0, 5.0, 4.0]])
+    (1, 2, [[5.0, 0.0, 3.0]])
+    (2, 3, [[4.0, 3.0, 0.0]])
+    """
+    nrows = pts_a.shape[0]
+    step = _block_rows(nrows, pts_b.shape[0], pts_a.shape[1], maxmem)
+    for start in xrange(0, nrows, step):
+        stop = min(start + step, nrows)
+        yield (start, stop, _dists(pts_a[start:stop], pts_b))
+
+
+def _dists(pts_a, pts_b):
+    """Calculate the (N x M) distances between two (small) point sets."""
+    # (N, 1, D) - (1, M, D) broadcasts to (N, M, D):
+    delta = pts_a[:, np.newaxis, :] - pts_b[np.newaxis, :, :]
+    delta **= 2
+    return np.sqrt(delta.sum(axis=2))
+
+
+def _as_points(pts):
+    """Make sure point coordinates are a 2d float ndarray (N points x D)."""
+    pts = np.asarray(pts, dtype=np.float64)
+    if pts.ndim == 1:
+        pts = pts.reshape((-1, 1))
+    return pts
+
+
+def dist_matrix(pts, dtype=np.float64, maxmem=None, out=None,
+                condensed=False):
     """Calculate the euclidean distance matrix (EDM) for a set of points.
 
     Parameters
     ----------
-    pts : np.ndarray (shape = (2,))
+    pts : np.ndarray (shape = (N, D))
+    dtype : np.dtype, optional
+        The data type of the resulting matrix, e.g. np.float32 to halve the
+        memory required for large point sets (default: np.float64).
+    maxmem : int, optional
+        Upper limit in bytes for the temporary arrays used during the
+        calculation, defaults to EDM_MAXMEM.
+    out : np.ndarray, optional
+        An existing array (shape = (N, N)) to store the results in, e.g. a
+        np.memmap to place matrices larger than the available RAM on disk.
+        Its data type takes precedence over the "dtype" parameter.
+    condensed : bool, optional
+        Request a CondensedEDM instead, storing only the upper triangle of
+        the matrix (halving the memory). If "out" is given in this case, it
+        has to be a 1d array of length N * (N - 1) / 2.
 
     Returns
     -------
-    dist_mat : np.ndarray
-        The distance matrix as 2d ndarray.
+    dist_mat : np.ndarray or CondensedEDM
+        The distance matrix as 2d ndarray (or as CondensedEDM).
 
     Implementation Details
     ----------------------
-    Uses two auxiliary matrixes to easily calculate the distance from each
-    point to every other point in the list using this approach:
-    (1) aux matrixes:
-    repmat(l, n1, n2): l is repeated n1 times, along axis 1, and n2 times along
-    axis 2, so repmat(pts, len(pts), 1) =
-        array( [ [1, 2], [4, 6], [1, 2], [4, 6] ] )
-    repeat(l, n, a): each element of l is repeated n times along axis a (w/o
-    'a' a plain list is generated), so repeat(pts, 2, 1) =
-        array( [ [1, 2], [1, 2], [4, 6], [4, 6] ] )
-    (2) Pythagoras:
-    Then, the element-wise difference of the generated matrixes is calculated
-    each value is squared:
-        array( [ [ 0,  0], [ 9, 16], [ 9, 16], [ 0,  0] ] )
-    These squares are then summed up (linewise) using sum(..., axis=1):
-        array([ 0, 25, 25,  0])
-    Finally the square root is taken for each element:
-        array([ 0.,  5.,  5.,  0.])
-    To transform the list into a distance matrix reshape() is used.
+    The matrix is calculated in blocks of consecutive rows (see
+    _dist_blocks()), so the memory required in addition to the resulting
+    matrix is bounded by "maxmem" instead of growing with N^2. For every block
+    the coordinate differences of the block's points to all points are
+    calculated using numpy broadcasting:
+        pts[start:stop, np.newaxis, :] - pts[np.newaxis, :, :]
+    (Pythagoras) Then each value is squared, the squares are summed up along
+    the last axis and finally the square root is taken for each element, e.g.
+    for the two points [1, 2] and [4, 6]:
+        differences: [ [ [ 0,  0], [-3, -4] ], [ [ 3,  4], [ 0,  0] ] ]
+        squares:     [ [ [ 0,  0], [ 9, 16] ], [ [ 9, 16], [ 0,  0] ] ]
+        sums:        [ [ 0, 25], [25,  0] ]
+        roots:       [ [ 0.,  5.], [ 5.,  0.] ]
 
     Example
     -------
@@ -85,17 +191,162 @@ def dist_matrix(pts):
            [ 3.47275107,  2.45967478,  0.        ,  1.14455231,  0.96436508],
            [ 2.41039416,  1.3190906 ,  1.14455231,  0.        ,  1.94422221],
            [ 3.99374511,  3.17804972,  0.96436508,  1.94422221,  0.        ]])
+    >>> dist_matrix([ [1, 2], [4, 6] ], dtype=np.float32, maxmem=1).dtype
+    dtype('float32')
+    >>> dist_matrix([ [1, 2], [4, 6], [1, 6] ], condensed=True)
+    CondensedEDM(3 points, float64)
     """
-    dist_mat = scipy.sqrt(
-        matlib.sum(
-            (
-                matlib.repmat(pts, len(pts), 1) -
-                matlib.repeat(pts, len(pts), axis=0)
-            ) ** 2,
-            axis=1
-        )
-    )
-    return dist_mat.reshape((len(pts), len(pts)))
+    pts = _as_points(pts)
+    if condensed:
+        return _condensed_dist_matrix(pts, dtype, maxmem, out)
+    return cross_dist(pts, pts, dtype, maxmem, out)
+
+
+def _condensed_dist_matrix(pts, dtype=np.float64, maxmem=None, out=None):
+    """Calculate the upper triangle of the EDM, see dist_matrix()."""
+    count = len(pts)
+    size = count * (count - 1) // 2
+    if out is None:
+        out = prof.track(np.empty(size, dtype=dtype))
+    elif out.shape != (size,):
+        raise ValueError('Output array has shape %s, expected %s.' %
+                         (out.shape, (size,)))
+    step = _block_rows(count, count, pts.shape[1], maxmem)
+    for start in xrange(0, count, step):
+        stop = min(start + step, count)
+        # only the columns right of the diagonal are required:
+        block = _dists(pts[start:stop], pts[start + 1:])
+        for row in xrange(start, stop):
+            offset = _condensed_index(count, row, row + 1)
+            out[offset:offset + count - row - 1] = block[row - start,
+                                                         row - start:]
+    return CondensedEDM(out, count)
+
+
+def _condensed_index(count, row, col):
+    """Map (row, col) with row < col to the index in a condensed EDM.
+
+    Works with scalars as well as with ndarrays of index numbers.
+
+    Example
+    -------
+    >>> [_condensed_index(4, i, j) for (i, j) in [(0,1), (0,3), (1,2), (2,3)]]
+    [0, 2, 3, 5]
+    """
+    return count * row - row * (row + 1) // 2 + col - row - 1
+
+
+def cross_dist(pts_a, pts_b, dtype=np.float64, maxmem=None, out=None):
+    """Calculate the distances from all points of one set to another set.
+
+    In contrast to stacking both sets and calling dist_matrix() on them, only
+    the (N x M) block of distances between the two sets is calculated.
+
+    Parameters
+    ----------
+    pts_a, pts_b : np.ndarray (shape = (N, D) and (M, D))
+    dtype, maxmem, out :
+        See dist_matrix(), the shape of "out" has to be (N, M).
+
+    Returns
+    -------
+    dists : np.ndarray (shape = (N, M))
+        The distances of the points from pts_a (rows) to those of pts_b.
+
+    Example
+    -------
+    >>> cross_dist([ [1, 1], [6, 1] ], [ [4, 5], [6, 2] ]).tolist()
+    [[5.0, 5.0990195135927845], [4.47213595499958, 1.0]]
+    """
+    pts_a = _as_points(pts_a)
+    pts_b = _as_points(pts_b)
+    shape = (len(pts_a), len(pts_b))
+    if out is None:
+        out = prof.track(np.empty(shape, dtype=dtype))
+    elif out.shape != shape:
+        raise ValueError('Output array has shape %s, expected %s.' %
+                         (out.shape, shape))
+    for (start, stop, block) in _dist_blocks(pts_a, pts_b, maxmem):
+        out[start:stop] = block
+    return out
+
+
+def cross_dist_min(pts_a, pts_b, maxmem=None):
+    """Find the closest point of one set for every point of another set.
+
+    The distances are calculated block-wise, so only the minima need to be
+    stored instead of the full (N x M) matrix.
+
+    Parameters
+    ----------
+    pts_a, pts_b : np.ndarray (shape = (N, D) and (M, D))
+    maxmem : int, optional
+        Upper limit for temporary arrays, see dist_matrix().
+
+    Returns
+    -------
+    (mins, argmins)
+        mins : np.ndarray (shape = (N,))
+            The distance from each point of pts_a to the closest one of pts_b.
+        argmins : np.ndarray (shape = (N,))
+            The index numbers (in pts_b) of these closest points. If more than
+            one point has the minimal distance, the first one is used.
+
+    Example
+    -------
+    >>> (mins, argmins) = cross_dist_min([ [1, 1], [6, 1] ],
+    ...                                  [ [3, 2], [4, 1], [5, 2] ])
+    >>> argmins.tolist()
+    [0, 2]
+    >>> mins.tolist()
+    [2.23606797749979, 1.4142135623730951]
+    """
+    pts_a = _as_points(pts_a)
+    pts_b = _as_points(pts_b)
+    mins = np.empty(len(pts_a))
+    argmins = np.empty(len(pts_a), dtype=int)
+    for (start, stop, block) in _dist_blocks(pts_a, pts_b, maxmem):
+        argmins[start:stop] = block.argmin(axis=1)
+        mins[start:stop] = block[np.arange(stop - start),
+                                 argmins[start:stop]]
+    return (mins, argmins)
+
+
+def min_cross_pair(pts_a, pts_b, maxmem=None):
+    """Get points with minimal distance from set_1 to set_2.
+
+    Identify the tuple (point_1, point_2) with the minimal distance where
+    "point_N" is from "set_N", this is equivalent to get_min_dist_pair() but
+    without calculating the EDM of the stacked sets.
+
+    Parameters
+    ----------
+    pts_a, pts_b : np.ndarray (shape = (N, D) and (M, D))
+        The coordinates of set_1 and set_2.
+    maxmem : int, optional
+        Upper limit for temporary arrays, see dist_matrix().
+
+    Returns
+    -------
+    (i1, i2) : tuple(int)
+        The tuple of index numbers (i1 in set_1, i2 in set_2) of the minimal
+        distance pair. If more than one pair has the same minimal distance,
+        the first one (in row-col order) is returned.
+
+    Example
+    -------
+    2 |     *   *
+    1 | x     *   x
+    0-+------------
+      0 1 2 3 4 5 6
+    >>> pl1 = np.array([[1,1],[6,1]])  # marked as 'x' above
+    >>> pl2 = np.array([[3,2],[4,1],[5,2]])  # marked as '*' above
+    >>> min_cross_pair(pl1, pl2)
+    (1, 2)
+    """
+    (mins, argmins) = cross_dist_min(pts_a, pts_b, maxmem)
+    row = int(mins.argmin())
+    return (row, int(argmins[row]))
 
 
 def get_max_dist_pair(edm):
@@ -122,6 +373,85 @@ def get_max_dist_pair(edm):
     return np.unravel_index(edm.argmax(), edm.shape)
 
 
+def _max_dist_blocked(pts, maxmem=None):
+    """Find the pair with the largest distance without storing the full EDM.
+
+    The distance matrix is calculated block by block (see _dist_blocks()),
+    remembering only the first (in row-col order) occurrence of the maximum,
+    which gives the same result as get_max_dist_pair(dist_matrix(pts)).
+    """
+    best = (-1.0, (0, 0))
+    for (start, _, block) in _dist_blocks(pts, pts, maxmem):
+        pos = np.unravel_index(block.argmax(), block.shape)
+        if block[pos] > best[0]:
+            best = (block[pos], (int(pos[0] + start), int(pos[1])))
+    return best[1]
+
+
+def farthest_pair(pts, maxmem=None):
+    """Determine points with largest distance using their coordinates.
+
+    Gives the same result as get_max_dist_pair(dist_matrix(pts)) but only
+    compares the points that can be part of the farthest pair at all:
+
+    (1) a pair found by two farthest-point sweeps gives a lower bound L for
+        the diameter of the point cloud, any point whose distance to the
+        center of the bounding box plus the maximum distance of all points to
+        that center is below L can't be part of the farthest pair
+    (2) both points of the farthest pair are vertices of the convex hull, so
+        only hull vertices (and duplicates thereof) of the remaining points
+        are kept
+
+    If the hull can't be calculated for degenerate inputs (e.g. all points
+    on a plane in 3D), all points remaining after step (1) are compared.
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, D))
+    maxmem : int, optional
+        Upper limit for temporary arrays, see dist_matrix().
+
+    Returns
+    -------
+    (i1, i2) : tuple(int)
+        The tuple of index numbers of the largest distance pair.
+
+    Example
+    -------
+    >>> farthest_pair([ [1.8, 4.1, 4.0], [2.8, 4.7, 4.5], [5.2, 4.2, 4.7],
+    ...                 [4.1, 4.5, 4.6], [3.7, 3.4, 4.5]])
+    (0, 2)
+    >>> circle = [[np.cos(x), np.sin(x), 0] for x in np.arange(0, 6.2, 0.1)]
+    >>> farthest_pair(circle)
+    (1, 32)
+    """
+    pts = _as_points(pts)
+    dist_to = lambda pos: np.sqrt(((pts - pos) ** 2).sum(axis=1))
+    # (1) lower bound by farthest-point sweeps, upper bounds by the center:
+    far1 = dist_to(pts[0]).argmax()
+    dists = dist_to(pts[far1])
+    lower = dists.max()
+    center = (pts.min(axis=0) + pts.max(axis=0)) / 2.0
+    dists = dist_to(center)
+    # the margin makes sure rounding errors never drop a candidate:
+    keep = dists + dists.max() >= lower * (1.0 - 1e-9)
+    candidates = np.flatnonzero(keep)
+    # (2) reduce to the vertices of the convex hull:
+    if len(candidates) > 2 * (pts.shape[1] + 1) and pts.shape[1] > 1:
+        try:
+            hull = candidates[ConvexHull(pts[candidates]).vertices]
+            # points having the same coordinates as a hull vertex must be
+            # considered as well to get the same result as with a full EDM:
+            dups = cKDTree(pts[hull]).query(pts[candidates])[0] == 0
+            candidates = candidates[dups]
+        except (RuntimeError, ValueError) as err:
+            log.info('No convex hull (%s), using all candidates.' % err)
+    log.debug('Farthest pair candidates: %i of %i', len(candidates),
+              len(pts))
+    pair = _max_dist_blocked(pts[candidates], maxmem)
+    return (int(candidates[pair[0]]), int(candidates[pair[1]]))
+
+
 def get_min_dist_pair(edm, split):
     """Get points with minimal distance from set_1 to set_2.
 
@@ -129,6 +459,9 @@ def get_min_dist_pair(edm, split):
     and "set_2") and identify the tuple (point_1, point_2) with the minimal
     distance where "point_N" is from "set_N".
 
+    If the coordinates of both sets are available, min_cross_pair() should be
+    used instead, as it doesn't require the EDM of the stacked sets.
+
     Parameters
     ----------
     edm : euclidean distance matrix
@@ -158,16 +491,16 @@ def get_min_dist_pair(edm, split):
     # argmin() returns the smallest entry, unravel_index() converts the index
     # back to the tuple usable for the 2d edm array
     minpos = np.unravel_index(subset.argmin(), subset.shape)
-    log.debug(subset)
-    log.info(minpos)
-    log.info(subset[minpos])
+    log.debug('%s', truncated(subset))
+    log.info('%s', minpos)
+    log.info('%s', subset[minpos])
     log.info('---')
     # now we need to convert the array coordinates back to the form usable
     # with the original (non-subset) EDM:
     minpos_orig = (minpos[0], minpos[1] + split)
-    log.debug(edm)
-    log.info(minpos_orig)
-    log.info(edm[minpos_orig])
+    log.debug('%s', truncated(edm))
+    log.info('%s', minpos_orig)
+    log.info('%s', edm[minpos_orig])
     return minpos_orig
 
 
@@ -244,35 +577,118 @@ def path_greedy(edm, mask_ref, pair):
     >>> path_greedy(edm, [0,0,1,0,0], (3,0))
     ([3, 4, 1, 0], [1, 1, 1, 1, 1], 4.024730596576215)
     """
-    sequence = []
-    pathlen = 0
+    return _greedy_walk(_edm_rows(edm), len(edm[0]), mask_ref, pair)
 
-    if mask_ref is None:
-        # create an empty mask with the number of points:
-        mask = [0] * len(edm[0])
-    else:
-        # 'list' is a mutable type, so we explicitly copy it and return a new
-        # mask at the end, to avoid silently modifying the reference
-        mask = mask_ref[:]
 
-    # make sure the end point is unmasked, otherwise we'll loop endlessly:
-    mask[pair[1]] = 0
+def path_greedy_pts(pts, mask_ref, pair):
+    """Use greedy search to find a path between a pair of points.
+
+    Same as path_greedy() but working directly on the coordinates, so no
+    distance matrix is required (the distances from the current point to all
+    others are calculated in each step instead).
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, D))
+        The coordinates of all points.
+    mask_ref, pair :
+        See path_greedy().
+
+    Returns
+    -------
+    (sequence, mask, pathlen)
+        See path_greedy().
+
+    Example
+    -------
+    >>> path_greedy_pts([ [1.8, 4.1, 4.0], [2.8, 4.7, 4.5], [5.2, 4.2, 4.7],
+    ...                   [4.1, 4.5, 4.6], [3.7, 3.4, 4.5]],
+    ...                 [0, 0, 1, 0, 0], (3, 0))
+    ([3, 4, 1, 0], [1, 1, 1, 1, 1], 4.024730596576215)
+    """
+    pts = _as_points(pts)
+    return _greedy_walk(_pts_rows(pts), len(pts), mask_ref, pair)
+
+
+def _edm_rows(edm):
+    """Create a function copying EDM rows into a given buffer."""
+    def rows(idx, out):
+        """Store the distances from point "idx" to all points in "out"."""
+        out[:] = edm[idx]
+    return rows
+
+
+def _pts_rows(pts):
+    """Create a function calculating EDM rows from coordinates.
+
+    The function returned uses a single working array for the coordinate
+    differences, so no memory is allocated per row.
+    """
+    delta = np.empty(pts.shape)
+
+    def rows(idx, out):
+        """Store the distances from point "idx" to all points in "out"."""
+        np.subtract(pts, pts[idx], out=delta)
+        np.multiply(delta, delta, out=delta)
+        delta.sum(axis=1, out=out)
+        np.sqrt(out, out=out)
+    return rows
+
+
+def _greedy_walk(rows, count, mask_ref=None, pair=None):
+    """Walk from point to point, always taking the closest unvisited one.
+
+    This is the engine behind path_greedy() and sort_neighbors(). It keeps a
+    single working buffer for the distances of the current point, masked
+    points are invalidated in-place by setting their distance to infinity.
+
+    Parameters
+    ----------
+    rows : function(idx, out)
+        Provides the distances from point "idx" to all others in "out".
+    count : int
+        The total number of points.
+    mask_ref : list, optional
+        The array mask (a binary list) of points to ignore or 'None'.
+    pair : tuple(int), optional
+        The pair of index numbers denoting start and stop. If 'None', the walk
+        starts at point 0 and continues until all points were visited.
 
-    cur = pair[0]
+    Returns
+    -------
+    (sequence, mask, pathlen)
+        See path_greedy().
+    """
+    sequence = []
+    pathlen = 0
+    masked = np.zeros(count, dtype=bool)
+    if mask_ref is not None:
+        masked[:] = np.asarray(mask_ref, dtype=bool)
+    if pair is None:
+        (cur, stop) = (0, None)
+    else:
+        (cur, stop) = pair
+        # make sure the end point is unmasked, otherwise we'll loop endlessly:
+        masked[stop] = False
+    dists = np.empty(count)
     while True:
         sequence.append(cur)
-        mask[cur] = 1
-        closest = find_neighbor(cur, edm, mask)
-        pathlen += edm[cur, closest]
-        log.debug('accumulated path length: %s' % pathlen)
-        if closest == pair[1]:
-            sequence.append(pair[1])
-            mask[closest] = 1
+        masked[cur] = True
+        if stop is None and masked.all():
+            break
+        rows(cur, dists)
+        np.putmask(dists, masked, np.inf)
+        closest = int(dists.argmin())
+        pathlen += dists[closest]
+        if closest == stop:
+            sequence.append(stop)
+            masked[closest] = True
             break
         cur = closest
-    log.info('path length: %s' % pathlen)
-    log.info('path (%s->%s): %s' % (pair[0], pair[1], sequence))
-    return (sequence, mask, pathlen)
+    if pair is not None:
+        log.info('path length: %s', pathlen)
+        log.info('path (%s->%s): %s', pair[0], pair[1], truncated(sequence))
+    return (sequence, masked.astype(int).tolist(), pathlen)
 
 
 def cut_extrema(lst):
@@ -319,23 +735,36 @@ def sort_neighbors(edm):
     >>> sort_neighbors(edm)
     [0, 1, 3, 2, 4]
     """
-    adjacents = []
-
-    # inital mask is 0 everywhere (no masking at all):
-    mask = [0] * edm.shape[0]
-
-    # for convenience we use a set instead of a list, so we don't have
-    # to care on what position the current element is
-    pointset = set(range(edm.shape[0]))
-    cur = 0
-    while len(pointset) > 0:
-        adjacents.append(cur)
-        pointset.remove(cur)
-        mask[cur] = 1
-        closest = find_neighbor(cur, edm, mask)
-        # print str(cur) + ' - ' + str(closest)
-        cur = closest
-    log.debug(adjacents)
+    adjacents = _greedy_walk(_edm_rows(edm), edm.shape[0])[0]
+    log.debug('%s', truncated(adjacents))
+    return adjacents
+
+
+def sort_neighbors_pts(pts):
+    """Sort a list of indices to minimize the distance between elements.
+
+    Same as sort_neighbors() but working directly on the coordinates, so no
+    distance matrix is required.
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, D))
+        The coordinates of all points.
+
+    Returns
+    -------
+    adjacents : list
+        The list of indices in sorted order.
+
+    Example
+    -------
+    >>> sort_neighbors_pts([ [1.8, 4.1, 4.0], [2.8, 4.7, 4.5], [5.2, 4.2, 4.7],
+    ...                      [4.1, 4.5, 4.6], [3.7, 3.4, 4.5]])
+    [0, 1, 3, 2, 4]
+    """
+    pts = _as_points(pts)
+    adjacents = _greedy_walk(_pts_rows(pts), len(pts))[0]
+    log.debug('%s', truncated(adjacents))
     return adjacents
 
 
@@ -417,7 +846,7 @@ def vappend(lst, val, desc="list"):
     Note: this works only as lists are mutable and we're operating on the
     given list directly.
     """
-    log.debug("appending to %s: %s" % (desc, str(val)))
+    log.debug("appending to %s: %s", desc, val)
     lst.append(val)
 
 
@@ -435,6 +864,9 @@ def tesselate(pl1, pl2, edm):
     raised - this case is simply not covered yet, as no real-world application
     produced such data.
 
+    See tesselate_pts() for a version working directly on the coordinates,
+    which doesn't require a distance matrix.
+
     Parameters
     ----------
     pl1, pl2 : lists
@@ -470,6 +902,61 @@ def tesselate(pl1, pl2, edm):
       (Traceback stack omitted)
     IndexError: Pointlist too short.
     """
+    return _zipper(pl1, pl2, lambda pt1, pt2: edm[pt1, pt2])
+
+
+def tesselate_pts(pl1, pl2, pts):
+    """Calculate a polygonal partition of a surface given by coordinates.
+
+    Same as tesselate(), but the distances are calculated directly from the
+    coordinates, only for the pairs of points that need to be compared. This
+    works in linear time and memory, regardless of the number of points.
+
+    Parameters
+    ----------
+    pl1, pl2 : lists
+        The pointlists (index numbers).
+    pts : np.ndarray (shape = (N, D))
+        The coordinates of the points.
+
+    Returns
+    -------
+    (edges, triangles)
+    edges : np.ndarray (shape = (E, 2))
+        The pairs of index numbers denoting the edges.
+    triangles : np.ndarray (shape = (T, 3))
+        The index numbers of the vertices of the triangles.
+
+    Example
+    -------
+    >>> pts = [ [0,4], [4,2], [7,3], [8,6], [5,8], [3,5] ]
+    >>> (edges, triangles) = tesselate_pts([0, 1, 2, 3], [0, 5, 4, 3], pts)
+    >>> edges.tolist()
+    [[1, 5], [2, 5], [2, 4]]
+    >>> triangles.tolist()
+    [[1, 5, 0], [2, 5, 1], [2, 4, 5], [2, 4, 3]]
+    """
+    coords = np.asarray(pts, dtype=np.float64).tolist()
+
+    def dist(pt1, pt2):
+        """Calculate the distance between two points (like dist_matrix)."""
+        return math.sqrt(sum([(c1 - c2) * (c1 - c2)
+                              for (c1, c2) in zip(coords[pt1], coords[pt2])]))
+
+    with prof.stage('tesselate'):
+        (edges, triangles) = _zipper(pl1, pl2, dist)
+        prof.count('tesselate.triangles', len(triangles))
+        return (np.array(edges, dtype=int).reshape(-1, 2),
+                np.array(triangles, dtype=int).reshape(-1, 3))
+
+
+def _zipper(pl1, pl2, dist):
+    """Run the tesselation of two pointlists (see tesselate() for details).
+
+    The pointlists are walked with one index pointer each, "dist" is a
+    function returning the distance between two points given by their index
+    numbers.
+    """
     # remove first and last items and get copies of the remaining pointlists
     (start_a, end_a, list_a) = cut_extrema(pl1)
     (start_b, end_b, list_b) = cut_extrema(pl2)
@@ -478,36 +965,38 @@ def tesselate(pl1, pl2, edm):
     if len(list_a) == 0 or len(list_b) == 0:
         raise IndexError('Pointlist too short.')
 
-    edges = []
-    triangles = []
-    vappend(edges, (list_a[0], list_b[0]), 'edges')
-    vappend(triangles, (list_a[0], list_b[0], start_a), 'triangles')
+    (pos_a, pos_b) = (0, 0)
+    (last_a, last_b) = (len(list_a) - 1, len(list_b) - 1)
+    edges = [(list_a[0], list_b[0])]
+    triangles = [(list_a[0], list_b[0], start_a)]
 
     # Process pointlists A and B simultaneously and determine the distances of
-    # A0-B1 and B0-A1. Remove the first element from the list where the
-    # shorter edge ends (B0 in case of A0-B1 etc.) and then add the edge A0-B0
-    # to the edgelist. If one list reaches its last element, always pop the
-    # first element of the other one until both lists have length 1.
-    while len(list_a) > 1 or len(list_b) > 1:
-        log.debug("-------------\nlist_A: %s\nlist_B: %s" % (list_a, list_b))
-        if len(list_a) == 1:
-            out = list_b.pop(0)
-        elif len(list_b) == 1:
-            out = list_a.pop(0)
+    # A0-B1 and B0-A1 (0 being the current pointer positions). Advance the
+    # pointer of the list where the shorter edge ends (B in case of A0-B1
+    # etc.) and then add the edge A0-B0 to the edgelist. If one pointer
+    # reaches the end of its list, always advance the other one until both
+    # lists are processed.
+    while pos_a < last_a or pos_b < last_b:
+        if pos_a == last_a:
+            advance_a = False
+        elif pos_b == last_b:
+            advance_a = True
         else:
-            # check distances of A0-B1 and B0-A1
-            if edm[list_a[0], list_b[1]] > edm[list_b[0], list_a[1]]:
-                out = list_a.pop(0)
-            else:
-                out = list_b.pop(0)
-        vappend(edges, (list_a[0], list_b[0]), 'edges')
-        vappend(triangles, (list_a[0], list_b[0], out), 'triangles')
-        log.debug("removed 1st element from list: %s" % out)
+            advance_a = (dist(list_a[pos_a], list_b[pos_b + 1]) >
+                         dist(list_b[pos_b], list_a[pos_a + 1]))
+        if advance_a:
+            out = list_a[pos_a]
+            pos_a += 1
+        else:
+            out = list_b[pos_b]
+            pos_b += 1
+        edges.append((list_a[pos_a], list_b[pos_b]))
+        triangles.append((list_a[pos_a], list_b[pos_b], out))
     # finally add the last triangle containing the endpoint
-    vappend(triangles, (list_a[0], list_b[0], end_a), 'triangles')
+    triangles.append((list_a[pos_a], list_b[pos_b], end_a))
 
-    log.info("-- edges from tesselation: %s" % edges)
-    log.debug("triangles from tesselation: %s" % triangles)
+    log.info("-- tesselation: %i edges, %i triangles" %
+             (len(edges), len(triangles)))
     return (edges, triangles)
 
 
@@ -542,13 +1031,164 @@ def tri_area(point1, point2, point3):
     return 0.5 * np.linalg.norm(np.cross(vec1, vec2))
 
 
+def tri_areas(pts, triangles):
+    """Calculate the areas of triangles given by vertex indices.
+
+    Array version of tri_area(), processing all triangles at once. The
+    results are equal within floating-point rounding: the squared lengths of
+    the cross products are summed up in a different order than by the BLAS
+    dot product used by np.linalg.norm().
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, 3))
+        The vertex coordinates.
+    triangles : np.ndarray (shape = (T, 3))
+        The indices of the three vertices of each triangle.
+
+    Returns
+    -------
+    areas : np.ndarray (shape = (T,))
+        The areas of the triangles in square units.
+
+    Example
+    -------
+    >>> pts = [[3,0,0], [0,4,0], [0,0,0], [0,0,2]]
+    >>> tri_areas(pts, [[0,1,2], [0,2,3], [1,1,2]]).tolist()
+    [6.0, 3.0, 0.0]
+    """
+    (pt1, pt2, pt3) = _tri_coords(pts, triangles)
+    cross = np.cross(pt2 - pt1, pt2 - pt3)
+    return 0.5 * np.sqrt(_rowdot(cross, cross))
+
+
+def tri_normals(pts, triangles):
+    """Calculate the unit normal vectors of triangles.
+
+    The orientation follows the right-hand rule for the vertex order, the
+    normal of a degenerated triangle (without area) is the zero vector.
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, 3))
+        The vertex coordinates.
+    triangles : np.ndarray (shape = (T, 3))
+        The indices of the three vertices of each triangle.
+
+    Returns
+    -------
+    normals : np.ndarray (shape = (T, 3))
+
+    Example
+    -------
+    >>> pts = [[3,0,0], [0,4,0], [0,0,0], [0,0,2]]
+    >>> tri_normals(pts, [[0,1,2], [0,2,3], [2,1,0]]).tolist()
+    [[0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [0.0, 0.0, -1.0]]
+    """
+    (pt1, pt2, pt3) = _tri_coords(pts, triangles)
+    cross = np.cross(pt2 - pt1, pt3 - pt1)
+    norms = np.sqrt(_rowdot(cross, cross))
+    norms[norms == 0] = 1.
+    return cross / norms[:, np.newaxis]
+
+
+def _tri_coords(pts, triangles):
+    """Get the vertex coordinates of triangles as three (T, 3) arrays."""
+    pts = np.asarray(pts, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=int).reshape(-1, 3)
+    return (pts[triangles[:, 0]], pts[triangles[:, 1]], pts[triangles[:, 2]])
+
+
+def edge_lengths(pts, edges):
+    """Calculate the lengths of edges given by vertex indices.
+
+    Parameters
+    ----------
+    pts : np.ndarray (shape = (N, D))
+        The vertex coordinates.
+    edges : np.ndarray (shape = (E, 2))
+        The indices of the two vertices of each edge.
+
+    Returns
+    -------
+    lengths : np.ndarray (shape = (E,))
+
+    Example
+    -------
+    >>> edge_lengths([[1, 2], [4, 6], [1, 6]], [[0, 1], [2, 1]]).tolist()
+    [5.0, 3.0]
+    """
+    pts = np.asarray(pts, dtype=np.float64)
+    edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+    delta = pts[edges[:, 0]] - pts[edges[:, 1]]
+    # same operations as in _dists(), so the results match the EDM entries:
+    delta **= 2
+    return np.sqrt(delta.sum(axis=1))
+
+
+def _rowdot(vec_a, vec_b):
+    """Calculate the dot products of corresponding rows of two arrays."""
+    # matmul() on stacks of vectors uses the same summation as np.dot(), so
+    # the results are identical to calling np.dot() on every single pair:
+    return np.matmul(vec_a[:, np.newaxis, :], vec_b[:, :, np.newaxis])[:, 0, 0]
+
+
+def angles(v1u, v2u, normalize=False):
+    """Calculate the angles between pairs of vectors (in arc degrees).
+
+    Array version of angle(), processing all vector pairs at once. The same
+    rules apply: a pair containing a zero vector has an angle of 0, and
+    pairs where the arccos() is undefined due to rounding errors are treated
+    as parallel (0) or anti-parallel (180) vectors.
+
+    Parameters
+    ----------
+    v1u, v2u : np.ndarray (shape = (N, D) or (D,))
+        The vectors to compare, a single vector is compared to all vectors of
+        the other array.
+    normalize : bool
+        Defines whether we should normalize the given vectors. Otherwise they
+        need to be normalized already.
+
+    Returns
+    -------
+    deg : np.ndarray (shape = (N,))
+        The angles between the vectors in arc degrees.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> x = np.array([[1,0,0], [1,2,3], [0,0,0]])
+    >>> y = np.array([[1,0,1], [1,2,1], [1,2,1]])
+    >>> angles(x, y, normalize=True).round(6).tolist()
+    [45.0, 29.205932, 0.0]
+    >>> angles(x[:2], [-2,0,0], normalize=True).round(6).tolist()
+    [180.0, 105.50136]
+    """
+    (v1u, v2u) = np.broadcast_arrays(np.atleast_2d(v1u), np.atleast_2d(v2u))
+    v1u = np.asarray(v1u, dtype=np.float64)
+    v2u = np.asarray(v2u, dtype=np.float64)
+    zero = ~v1u.any(axis=1) | ~v2u.any(axis=1)
+    if normalize:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            v1u = v1u / np.sqrt(_rowdot(v1u, v1u))[:, np.newaxis]
+            v2u = v2u / np.sqrt(_rowdot(v2u, v2u))[:, np.newaxis]
+    with np.errstate(invalid='ignore'):
+        rad = np.arccos(_rowdot(v1u, v2u))
+    undef = np.isnan(rad)
+    rad[undef] = np.where((v1u[undef] == v2u[undef]).all(axis=1), 0., np.pi)
+    rad[zero] = 0.
+    return rad * (180 / np.pi)
+
+
 def angle(v1u, v2u, normalize=False):
     """Calculate the angle between vectors (in arc degrees).
 
     Calculates the angle in degrees between two n-dimensional unit vectors
     given as np.ndarrays. The normalization can be done by the function if
     desired. Note that when calculating angles between large number of vectors,
-    it is most likely more efficient to normalize them in advance.
+    it is most likely more efficient to normalize them in advance and to use
+    angles() to process all of them at once.
 
     Parameters
     ----------
@@ -579,21 +1219,44 @@ def angle(v1u, v2u, normalize=False):
     >>> angle(x[0], x[1], normalize=True)
     0.0
     """
-    log.debug('vector shapes: %s %s' % (v1u.shape, v2u.shape))
-    if not v1u.any():
-        return 0.
-    if not v2u.any():
-        return 0.
-    if normalize:
-        v1u = v1u / np.linalg.norm(v1u)
-        v2u = v2u / np.linalg.norm(v2u)
-    rad = np.arccos(np.dot(v1u, v2u))
-    if math.isnan(rad):
-        if (v1u == v2u).all():
-            rad = 0.0
-        else:
-            rad = np.pi
-    return rad * (180 / np.pi)
+    return angles(v1u, v2u, normalize)[0]
+
+
+def angles_2d(vec1, vec2):
+    """Calculate the relative angles between pairs of vectors in 2D.
+
+    Array version of angle_2d(), processing all vector pairs at once.
+
+    Parameters
+    ----------
+    vec1, vec2 : np.ndarray (shape = (N, 2))
+        The vectors to compare.
+
+    Returns
+    -------
+    deg : np.ndarray (shape = (N,))
+        The angles between the vectors in arc degrees [-180, 180].
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> vec1 = np.array([[1,0], [1,1], [-3,-0.1], [1,0]])
+    >>> vec2 = np.array([[0,1], [1,-1], [1,6], [-1,0]])
+    >>> angles_2d(vec1, vec2).tolist()
+    [90.0, -90.0, -101.37147464102202, 180.0]
+    """
+    vec1 = np.asarray(vec1)
+    vec2 = np.asarray(vec2)
+    if (vec1.ndim != 2 or vec1.shape[1] != 2 or vec1.shape != vec2.shape):
+        raise TypeError('Can handle only 2-D vectors!')
+    # arctan2() gives the angles between (1,0) and the vector defined by the
+    # coordinates, and it takes Y coords first, then X...
+    delta = np.degrees(np.arctan2(vec2[:, 1], vec2[:, 0]) -
+                       np.arctan2(vec1[:, 1], vec1[:, 0]))
+    # we need to compensate a possible "overflow" manually:
+    delta[delta < -180] += 360
+    delta[delta > 180] -= 360
+    return delta
 
 
 def angle_2d(vec1, vec2):
@@ -601,7 +1264,8 @@ def angle_2d(vec1, vec2):
 
     Calculates the relative angle in degrees between two 2-dimensional vectors
     given as np.ndarrays. Positive numbers correspond to a "right turn", while
-    negative numbers correspond to a "left turn".
+    negative numbers correspond to a "left turn". See angles_2d() for
+    processing many vector pairs at once.
 
     Parameters
     ----------
@@ -631,21 +1295,350 @@ def angle_2d(vec1, vec2):
     """
     if (vec1.shape != (2,) or vec2.shape != (2,)):
         raise TypeError('Can handle only 2-D vectors!')
-    x_coords = np.array([vec1[0], vec2[0]])
-    y_coords = np.array([vec1[1], vec2[1]])
-    # arctan2() gives the angles between (1,0) and the vector defined by the
-    # coordinates, and it takes Y coords first, then X...
-    angles = np.arctan2(y_coords, x_coords)
-    delta = math.degrees(angles[1] - angles[0])
-    # we need to compensate a possible "overflow" manually:
-    if delta < -180:
-        log.debug('delta below -180')
-        delta = 360 - abs(delta)
-    if delta > 180:
-        log.debug('delta above 180')
-        delta = -360 + abs(delta)
-    log.debug('angle_2d(%s, %s): %f' % (vec1, vec2, delta))
-    return delta
+    return float(angles_2d(vec1[np.newaxis], vec2[np.newaxis])[0])
+
+
+def rasterize(pix, shape, weights=None, dtype=np.int, out=None,
+              chunksize=2 ** 20):
+    """Accumulate points given as pixel (or voxel) indices into a grid.
+
+    The values are summed up per grid cell using np.bincount(), processing
+    the points in chunks to limit the size of the temporary arrays. An
+    existing grid can be given as "out" to accumulate points from multiple
+    calls, e.g. when streaming them from a large file. Like with regular
+    indexing, negative indices are counted from the end of an axis.
+
+    Parameters
+    ----------
+    pix : np.ndarray (shape = (N, D))
+        The integer grid indices of the points, D being 2 or 3.
+    shape : tuple(int)
+        The shape of the grid.
+    weights : np.ndarray (shape = (N,)), optional
+        The values to add for each point (1 by default).
+    dtype : np.dtype, optional
+        The data type of the grid, ignored if "out" is given.
+    out : np.ndarray, optional
+        A grid of the given shape to add the values to.
+    chunksize : int, optional
+        The number of points to process at once.
+
+    Returns
+    -------
+    grid : np.ndarray
+
+    Example
+    -------
+    >>> rasterize([[0, 1], [2, 0], [0, 1], [-1, 0]], (3, 2))
+    array([[0, 2],
+           [0, 0],
+           [2, 0]])
+    >>> grid = rasterize([[0, 0, 1]], (2, 2, 2), weights=[0.5], dtype=float)
+    >>> rasterize([[0, 0, 1]], (2, 2, 2), weights=[2], out=grid)[0].tolist()
+    [[0.0, 2.5], [0.0, 0.0]]
+    """
+    pix = np.asarray(pix, dtype=np.intp).reshape(-1, len(shape))
+    if weights is not None:
+        weights = np.asarray(weights).ravel()
+        if len(weights) != len(pix):
+            raise ValueError('Number of weights does not match the points!')
+    if out is None:
+        out = prof.track(np.zeros(shape, dtype=dtype))
+    elif out.shape != tuple(shape):
+        raise ValueError('Shape of the output grid does not match!')
+    flat_out = out.reshape(-1)
+    size = flat_out.size
+    for start in xrange(0, len(pix), chunksize):
+        chunk = pix[start:start + chunksize]
+        if ((chunk < -np.array(shape)) | (chunk >= shape)).any():
+            raise IndexError('Point outside of the grid!')
+        # mode 'wrap' maps the (valid) negative indices to the axis ends:
+        flat = np.ravel_multi_index(chunk.T, shape, mode='wrap')
+        if weights is None:
+            counts = np.bincount(flat, minlength=size)
+        else:
+            counts = np.bincount(flat, weights[start:start + chunksize],
+                                 minlength=size)
+        np.add(flat_out, counts, out=flat_out, casting='unsafe')
+    if not np.may_share_memory(flat_out, out):
+        # reshape() had to copy a non-contiguous grid:
+        out[...] = flat_out.reshape(shape)
+    return out
+
+
+class CondensedEDM(object):
+
+    """A symmetric euclidean distance matrix storing only its upper triangle.
+
+    The distances are kept in a 1d array in row-major order of the upper
+    triangle (without the diagonal), the same layout as used by
+    scipy.spatial.distance.pdist(). This requires only half of the memory of
+    the full matrix while still providing the usual access patterns of the
+    EDM ndarrays used throughout volpy, so it can be used transparently in
+    their place:
+
+    - edm[i, j] for single entries (0 on the diagonal)
+    - edm[i] for full rows
+    - edm[rows, cols] with slices or index arrays for sub-matrices
+    - edm.shape, edm.argmax() and np.asarray(edm) for the dense matrix
+
+    Example
+    -------
+    >>> edm = dist_matrix([ [1, 2], [4, 6], [1, 6] ], condensed=True)
+    >>> (edm[0, 1], edm[1, 0], edm[2, 2])
+    (5.0, 5.0, 0.0)
+    >>> edm[1].tolist()
+    [5.0, 0.0, 3.0]
+    >>> edm[:1, 1:].tolist()
+    [[5.0, 4.0]]
+    >>> np.unravel_index(edm.argmax(), edm.shape)
+    (0, 1)
+    >>> (np.asarray(edm) == dist_matrix([ [1, 2], [4, 6], [1, 6] ])).all()
+    True
+    >>> edm[-1, 0] == np.asarray(edm)[-1, 0] == edm[2, 0]
+    True
+    >>> edm[3, 0]
+    Traceback (most recent call last):
+        ...
+    IndexError: Index (3, 0) out of range for 3 points
+    """
+
+    def __init__(self, dists, count):
+        """Wrap a condensed distance array.
+
+        Parameters
+        ----------
+        dists : np.ndarray (shape = (count * (count - 1) / 2,))
+            The distances of the upper triangle in row-major order.
+        count : int
+            The number of points, i.e. the number of rows of the full EDM.
+        """
+        if len(dists) != count * (count - 1) // 2:
+            raise ValueError('Condensed EDM size mismatch for %s points: %s'
+                             % (count, len(dists)))
+        self.dists = dists
+        self.count = count
+        self.shape = (count, count)
+        self.dtype = dists.dtype
+
+    def __repr__(self):
+        return "CondensedEDM(%s points, %s)" % (self.count, self.dtype)
+
+    def __len__(self):
+        return self.count
+
+    def __array__(self, dtype=None):
+        return self.dense(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            if isinstance(key, (int, long, np.integer)):
+                return self.row(key)
+            key = (key, slice(None))
+        (rows, cols) = key
+        if (isinstance(rows, (int, long, np.integer)) and
+                isinstance(cols, (int, long, np.integer))):
+            return self.get(rows, cols)
+        index = np.arange(self.count)
+        return self.block(index[rows], index[cols])
+
+    def get(self, row, col):
+        """Get a single entry of the matrix (negative indices wrap around)."""
+        (orig_row, orig_col) = (row, col)
+        if row < 0:
+            row += self.count
+        if col < 0:
+            col += self.count
+        if not (0 <= row < self.count and 0 <= col < self.count):
+            raise IndexError('Index (%s, %s) out of range for %s points' %
+                             (orig_row, orig_col, self.count))
+        if row == col:
+            return self.dtype.type(0)
+        if row > col:
+            (row, col) = (col, row)
+        return self.dists[_condensed_index(self.count, row, col)]
+
+    def row(self, row, out=None):
+        """Get a full row of the matrix (its distances to all points).
+
+        The entries right of the diagonal are a contiguous part of the
+        condensed array, the ones left of it are gathered from the previous
+        rows.
+        """
+        if row < 0:
+            row += self.count
+        if out is None:
+            out = np.empty(self.count, dtype=self.dtype)
+        prev = np.arange(row)
+        out[:row] = self.dists[_condensed_index(self.count, prev, row)]
+        out[row] = 0
+        start = _condensed_index(self.count, row, row + 1)
+        out[row + 1:] = self.dists[start:start + self.count - row - 1]
+        return out
+
+    def block(self, rows, cols):
+        """Get the sub-matrix of the given (1d or scalar) row / col indices."""
+        shape = np.shape(rows) + np.shape(cols)
+        (grid_r, grid_c) = np.meshgrid(rows, cols, indexing='ij')
+        lower = np.minimum(grid_r, grid_c)
+        upper = np.maximum(grid_r, grid_c)
+        diag = lower == upper
+        res = np.zeros(lower.shape, dtype=self.dtype)
+        res[~diag] = self.dists[_condensed_index(self.count, lower[~diag],
+                                                 upper[~diag])]
+        return res.reshape(shape)
+
+    def argmax(self):
+        """Get the (flat) index of the maximum in the full matrix.
+
+        As the first occurrence of a maximum in the full matrix is always in
+        its upper triangle, this is the same as the result of argmax() on the
+        corresponding dense ndarray (unless all distances are zero).
+        """
+        if self.count < 2:
+            return 0
+        pos = int(self.dists.argmax())
+        if self.dists[pos] == 0:
+            # the diagonal (i.e. the very first entry) is a maximum as well:
+            return 0
+        # invert _condensed_index() to get the row:
+        rows = np.arange(self.count)
+        row = np.searchsorted(_condensed_index(self.count, rows, rows + 1),
+                              pos, side='right') - 1
+        col = pos - _condensed_index(self.count, row, row + 1) + row + 1
+        return int(row * self.count + col)
+
+    def dense(self, dtype=None):
+        """Get the full (square) matrix as np.ndarray."""
+        full = np.zeros(self.shape, dtype=dtype or self.dtype)
+        (rows, cols) = np.triu_indices(self.count, 1)
+        full[rows, cols] = self.dists
+        full[cols, rows] = self.dists
+        return full
+
+
+class SpatialIndex(object):
+
+    """A spatial index (KD-tree) for neighbour queries on a set of points.
+
+    Building the index takes O(N log N) time and O(N) memory, the individual
+    queries are then answered in O(log N) without calculating any distance
+    matrix.
+
+    Example
+    -------
+    >>> idx = SpatialIndex([ [1.8, 4.1, 4.0], [2.8, 4.7, 4.5], [5.2, 4.2, 4.7],
+    ...                      [4.1, 4.5, 4.6], [3.7, 3.4, 4.5]])
+    >>> idx.knn([ [4.0, 4.4, 4.6] ], k=2)[1].tolist()
+    [[3, 4]]
+    >>> idx.radius([2.0, 4.0, 4.0], 1.5)
+    [0, 1]
+    >>> idx.nearest(3)
+    2
+    >>> idx.nearest(2, [0, 0, 1, 1, 0])
+    4
+    """
+
+    def __init__(self, pts):
+        """Build the KD-tree for the given coordinates.
+
+        Parameters
+        ----------
+        pts : np.ndarray (shape = (N, D))
+            The coordinates of the points to index.
+
+        Instance Variables
+        ------------------
+        data : np.ndarray (shape = (N, D))
+        tree : scipy.spatial.cKDTree
+        """
+        self.data = _as_points(pts)
+        self.tree = cKDTree(self.data)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def knn(self, pts, k=1):
+        """Find the k nearest neighbours of the given coordinates.
+
+        Parameters
+        ----------
+        pts : np.ndarray (shape = (M, D))
+            The coordinates of the query points (not required to be part of
+            the index).
+        k : int
+            The number of neighbours to look up per query point.
+
+        Returns
+        -------
+        (dists, ids)
+            dists : np.ndarray (shape = (M, k))
+                The distances to the neighbours in ascending order.
+            ids : np.ndarray (shape = (M, k))
+                The corresponding index numbers of the neighbours.
+        """
+        pts = _as_points(pts)
+        (dists, ids) = self.tree.query(pts, k=k)
+        return (dists.reshape((-1, k)), ids.reshape((-1, k)))
+
+    def radius(self, point, rad):
+        """Find all indexed points within a given distance of a point.
+
+        Parameters
+        ----------
+        point : np.ndarray (shape = (D,))
+        rad : float
+
+        Returns
+        -------
+        ids : list(int)
+            The index numbers of the points in ascending order.
+        """
+        return sorted(self.tree.query_ball_point(np.asarray(point), rad))
+
+    def nearest(self, pid, mask=None):
+        """Find the closest neighbour of an indexed point, respecting a mask.
+
+        This is the index-based counterpart of find_neighbor(): the reference
+        point is always excluded, as are all points that are masked. If there
+        are multiple neighbours with the same distance, the one with the
+        lowest index number is returned. The number of neighbours requested
+        from the tree is doubled until an unmasked one was found, so heavily
+        masked point sets will degrade towards a linear scan.
+
+        Parameters
+        ----------
+        pid : int
+            The index of the reference point.
+        mask : list or np.ndarray, optional
+            A binary list, points with a non-zero entry are ignored.
+
+        Returns
+        -------
+        closest : int
+            The index of the closest neighbour or None if all points are
+            masked.
+        """
+        count = len(self)
+        ignore = np.zeros(count, dtype=bool)
+        if mask is not None:
+            ignore[:] = np.asarray(mask, dtype=bool)
+        ignore[pid] = True
+        k = 2
+        while True:
+            k = min(k, count)
+            (dists, ids) = self.tree.query(self.data[pid], k=k)
+            (dists, ids) = (np.atleast_1d(dists), np.atleast_1d(ids))
+            valid = ~ignore[ids]
+            if valid.any():
+                best = dists[valid][0]
+                # only if the farthest result is closer than the best one we
+                # can be sure to have seen all candidates with equal distance:
+                if dists[-1] > best or k == count:
+                    return int(ids[valid & (dists == best)].min())
+            elif k == count:
+                return None
+            k *= 2
 
 
 class Points3D(object):
@@ -655,10 +1648,14 @@ class Points3D(object):
     def __init__(self, csvfile):
         """Load point coordinates from a CSV file."""
         self.edm = None                         # euclidean distance matrix
+        self.edm_dtype = np.float64             # data type of the EDM
+        self.edm_condensed = False              # use a CondensedEDM
+        self.edm_cache = None                   # on-disk cache (EDMCache)
+        self.index = None                       # spatial index (KD-tree)
         self.mdpair = None                      # the max-distance pair
         self.data = None
         self.__load_data__(csvfile)
-        log.debug(ppr.pformat(self.data))
+        log.debug('%s', lazy_pformat(self.data))
         self.limits = [[0, 0], [0, 0], [0, 0]]  # bounding box
         self.set_limits_defaults()
 
@@ -670,9 +1667,11 @@ class Points3D(object):
         from different data than the default CSV reader used here.
         """
         # np.loadtxt() returns an ndarray() of floats, complains on non-floats
-        self.data = np.loadtxt(infile, delimiter=',')
-        log.info('Parsed %i points from CSV.\n%s' %
-                 (len(self.data), str(self.data)))
+        # (the loader caches the parsed data in a binary sidecar file)
+        with prof.stage('points.load'):
+            self.data = prof.track(loader.loadtxt(infile, delimiter=','))
+        log.info('Parsed %i points from CSV.\n%s', len(self.data),
+                 truncated(self.data))
 
     def set_limits(self, xmin=None, xmax=None, ymin=None, ymax=None,
                    zmin=None, zmax=None):
@@ -691,7 +1690,7 @@ class Points3D(object):
             self.limits[2][0] = zmin
         if zmax is not None:
             self.limits[2][1] = zmax
-        log.debug("Setting volume limits:\n%s" % ppr.pformat(self.limits))
+        log.debug("Setting volume limits:\n%s", lazy_pformat(self.limits))
 
     def set_limits_defaults(self):
         """Set the default volume limits using min/max coordinates."""
@@ -707,13 +1706,31 @@ class Points3D(object):
         return self.data
 
     def get_edm(self):
-        """Get the euclidean distance matrix of the points."""
+        """Get the euclidean distance matrix of the points.
+
+        If an on-disk cache is set (see volpy.edmcache.EDMCache), the matrix
+        is memory-mapped from there instead of being recalculated.
+        """
         # lazy initialization of the EDM:
-        if self.edm is None:
-            self.edm = dist_matrix(self.data)
-            log.info(ppr.pformat(self.edm))
+        if self.edm is not None:
+            return self.edm
+        with prof.stage('points.edm'):
+            if self.edm_cache is not None:
+                self.edm = self.edm_cache.get_edm(self.data, self.edm_dtype,
+                                                  self.edm_condensed)
+            else:
+                self.edm = dist_matrix(self.data, dtype=self.edm_dtype,
+                                       condensed=self.edm_condensed)
+                log.info('%s', lazy_pformat(self.edm))
         return self.edm
 
+    def get_index(self):
+        """Get the spatial index (a SpatialIndex object) of the points."""
+        # lazy initialization of the index:
+        if self.index is None:
+            self.index = SpatialIndex(self.data)
+        return self.index
+
     def get_mdpair(self):
         """Get the pair of points with the maximum distance.
 
@@ -724,7 +1741,8 @@ class Points3D(object):
         """
         # lazy initialization of the maxdistpair:
         if self.mdpair is None:
-            self.mdpair = get_max_dist_pair(self.get_edm())
+            with prof.stage('points.mdpair'):
+                self.mdpair = farthest_pair(self.data)
         return self.mdpair
 
     def get_mdpair_coords(self):
@@ -746,135 +1764,337 @@ class Points3D(object):
         -------
         dist : float
         """
-        return self.get_edm()[self.get_mdpair()]
+        (pt1, pt2) = self.get_mdpair_coords()
+        return np.sqrt(((pt1 - pt2) ** 2).sum())
 
-    def gen_bitmap(self, size, crop=False, delta=1):
-        """Generate a 2D bitmap of the coordinates.
+    def gen_bitmap(self, size, crop=False, delta=1, dtype=np.int,
+                   weights=None, chunksize=2 ** 20):
+        """Generate a 2D or 3D bitmap of the coordinates.
 
-        The bitmap is a matrix (size[0] x size[1]) with all values set to
-        zero, except those where an object exists (converted from object
-        coordinate space to the bitmap coordinate space).
+        The bitmap is a matrix (size[0] x size[1] [x size[2]]) with all values
+        set to zero, except those where an object exists (converted from
+        object coordinate space to the bitmap coordinate space).
 
         Parameters
         ----------
-        size : (int, int)
+        size : (int, int) or (int, int, int)
         crop : Bool
             Set to True if empty parts of the target coordinate space should
             be cropped away before generating the bitmap.
         delta : int
             Can be used to specify the offset that gets added at a position
             when an object is mapped to a pixel.
+        dtype : np.dtype, optional
+            The data type of the bitmap.
+        weights : np.ndarray (shape = (N,)), optional
+            Individual values for the objects, multiplied by "delta".
+        chunksize : int, optional
+            The number of objects to map at once (see rasterize()).
 
         Returns
         -------
         bitmap : ndarray
         """
-        bitmap = np.zeros((size[0], size[1]), dtype=np.int)
-        coords = self.data
-        xmin = self.limits[0][0]
-        ymin = self.limits[1][0]
-        xmax = self.limits[0][1]
-        ymax = self.limits[1][1]
+        size = tuple(size)
+        ndim = len(size)
+        if ndim not in (2, 3):
+            raise ValueError('Can generate only 2D or 3D bitmaps!')
+        upper = np.array([self.limits[dim][1] for dim in range(ndim)])
         if crop:
-            xcrop = xmin
-            ycrop = ymin
+            lower = np.array([self.limits[dim][0] for dim in range(ndim)])
         else:
-            xcrop = ycrop = 0
-        for point in coords:
-            pix_x = int(((point[0] - xcrop) / (xmax - xcrop)) * (size[0] - 1))
-            pix_y = int(((point[1] - ycrop) / (ymax - ycrop)) * (size[1] - 1))
-            # print "(%f,%f) -> (%i,%i)" % (point[0], point[1], pix_x, pix_y)
-            bitmap[pix_x, pix_y] += delta
-
+            lower = np.zeros(ndim)
+        scale = np.array(size) - 1
+        if weights is None:
+            values = None
+        else:
+            values = np.asarray(weights) * delta
+        bitmap = np.zeros(size, dtype=dtype)
+        for start in xrange(0, len(self.data), chunksize):
+            coords = self.data[start:start + chunksize, :ndim]
+            # astype() truncates towards zero, just like int() does:
+            pix = (((coords - lower) / (upper - lower)) * scale).astype(int)
+            if values is None:
+                rasterize(pix, size, out=bitmap, chunksize=chunksize)
+            else:
+                rasterize(pix, size, values[start:start + chunksize],
+                          out=bitmap, chunksize=chunksize)
+        if values is None and delta != 1:
+            bitmap *= delta
         return bitmap
 
 
+class FilamentGraph(object):
+
+    """Undirected graph of filament vertices in compressed sparse row form.
+
+    The neighbours of vertex "i" are stored in indices[indptr[i]:indptr[i+1]],
+    in the order of appearance of the corresponding edges. Vertices may have
+    any number of connections, so branched filaments are supported as well.
+    Duplicate edges (in either direction) and self-loops are ignored. Note
+    that the former Vertex class did record a self-loop as a connection (it
+    then counted against the maximum of two), dropping them is deliberate.
+
+    Example
+    -------
+    >>> # a ring 0-1-2-3-0 with a branch 2-4-5:
+    >>> graph = FilamentGraph([[0, 1], [1, 2], [2, 3], [3, 0], [2, 4], [4, 5],
+    ...                        [1, 0]])
+    >>> graph.degree().tolist()
+    [2, 2, 3, 2, 2, 1]
+    >>> graph.neighbors(2).tolist()
+    [1, 3, 4]
+    >>> graph.branch_points().tolist(), graph.end_points().tolist()
+    ([2], [5])
+    >>> graph.segments()
+    [[2, 1, 0, 3, 2], [2, 4, 5]]
+    >>> len(graph.components())
+    1
+    >>> FilamentGraph([[0, 1], [1, 2], [2, 0]]).ring()
+    [0, 1, 2]
+    >>> FilamentGraph([[0, 1], [1, 2], [2, 0], [3, 4], [4, 5]]).segments()
+    [[3, 4, 5], [0, 1, 2, 0]]
+    """
+
+    def __init__(self, edges, count=None):
+        """Build the graph from an array of edges.
+
+        Parameters
+        ----------
+        edges : np.ndarray (shape = (E, 2))
+            The index numbers of the vertices connected by each edge, e.g. as
+            read by np.loadtxt() from an edges CSV file.
+        count : int, optional
+            The number of vertices, by default the highest index plus one.
+
+        Instance Variables
+        ------------------
+        edges : np.ndarray (shape = (E, 2))
+            The (unique) edges of the graph.
+        count : int
+        indptr, indices : np.ndarray
+            The CSR representation of the adjacency.
+        """
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        # remove duplicates, keeping the first occurrence of every edge:
+        (_, first) = np.unique(np.sort(edges, axis=1), axis=0,
+                               return_index=True)
+        self.edges = edges[np.sort(first)]
+        if count is None:
+            count = self.edges.max() + 1 if len(self.edges) else 0
+        self.count = count
+        # every edge is stored in both directions, interleaved so that a
+        # stable sort keeps the neighbours in order of their appearance:
+        src = self.edges.ravel()
+        dst = self.edges[:, ::-1].ravel()
+        order = np.argsort(src, kind='mergesort')
+        self.indices = dst[order]
+        self._edge_ids = order // 2
+        self.indptr = np.zeros(count + 1, dtype=int)
+        np.cumsum(np.bincount(src, minlength=count), out=self.indptr[1:])
+
+    def __repr__(self):
+        return "FilamentGraph(%i vertices, %i edges)" % \
+            (self.count, len(self.edges))
+
+    def degree(self):
+        """Get the number of connections of every vertex."""
+        return np.diff(self.indptr)
+
+    def neighbors(self, vtx):
+        """Get the index numbers of the vertices connected to a vertex."""
+        return self.indices[self.indptr[vtx]:self.indptr[vtx + 1]]
+
+    def branch_points(self):
+        """Get the vertices having more than two connections."""
+        return np.flatnonzero(self.degree() > 2)
+
+    def end_points(self):
+        """Get the vertices having exactly one connection."""
+        return np.flatnonzero(self.degree() == 1)
+
+    def components(self):
+        """Get the connected components of the graph.
+
+        Returns
+        -------
+        components : list(np.ndarray)
+            The (sorted) vertex index numbers of every component having at
+            least one edge, ordered by their lowest index number.
+        """
+        adjacency = csr_matrix((np.ones(len(self.indices)), self.indices,
+                                self.indptr), shape=(self.count, self.count))
+        labels = connected_components(adjacency, directed=False)[1]
+        labels = labels[self.degree() > 0]
+        vertices = np.flatnonzero(self.degree() > 0)
+        (_, first) = np.unique(labels, return_index=True)
+        return [vertices[labels == labels[pos]] for pos in np.sort(first)]
+
+    def segments(self):
+        """Split the graph into unbranched segments.
+
+        A segment is a sequence of vertices between two nodes (end or branch
+        points), where all inner vertices have exactly two connections.
+        Closed loops without any node form a single segment, starting and
+        ending with their lowest vertex.
+
+        Returns
+        -------
+        segments : list(list(int))
+        """
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        edge_ids = self._edge_ids.tolist()
+        degree = self.degree().tolist()
+        visited = [False] * len(self.edges)
+        segments = []
+
+        def walk(start, slot):
+            """Follow the edges from a CSR slot until reaching a node."""
+            segment = [start]
+            while True:
+                visited[edge_ids[slot]] = True
+                cur = indices[slot]
+                segment.append(cur)
+                if degree[cur] != 2 or cur == start:
+                    return segment
+                # continue with the other connection of the current vertex:
+                slot = indptr[cur]
+                if visited[edge_ids[slot]]:
+                    slot += 1
+
+        nodes = [vtx for vtx in xrange(self.count)
+                 if degree[vtx] not in (0, 2)]
+        for node in nodes:
+            for slot in xrange(indptr[node], indptr[node + 1]):
+                if not visited[edge_ids[slot]]:
+                    segments.append(walk(node, slot))
+        # the remaining edges belong to closed loops:
+        for vtx in xrange(self.count):
+            if degree[vtx] and not visited[edge_ids[indptr[vtx]]]:
+                segments.append(walk(vtx, indptr[vtx]))
+        return segments
+
+    def ring(self):
+        """Get the vertex sequence of a graph forming a single closed loop.
+
+        The sequence starts at the lowest vertex and follows its first
+        connection. An IndexError is raised if the graph is not a ring (i.e.
+        if it contains end points, branches or multiple components).
+
+        Returns
+        -------
+        path : list(int)
+            The vertex index numbers (without repeating the first one).
+        """
+        if len(self.branch_points()) > 0:
+            raise IndexError('Filament has branches, not a ring!')
+        segments = self.segments()
+        if len(segments) != 1 or segments[0][0] != segments[0][-1]:
+            log.error("\nERROR building filament path!\n")
+            log.error("Segments: %s", truncated(segments))
+            raise IndexError("Couldn't build filament path!")
+        return segments[0][:-1]
+
+
 class Filament(object):
 
-    """Filament objects in 3D space based on a Points3D object."""
+    """Filament objects in 3D space based on a Points3D object.
 
-    def __init__(self, p3d, csv_edges):
+    Example
+    -------
+    >>> p3d = Points3D(['0,0,0', '2,0,0', '2,1,0', '0,1,0'])
+    >>> filament = Filament(p3d, ['0,1', '1,2', '3,2', '3,0'])
+    >>> filament.path, filament.length
+    ([0, 1, 2, 3], 6.0)
+    >>> filament.splitpaths((1, 3))
+    ([1, 2, 3], [3, 0, 1])
+    >>> filament.split_lengths((1, 3))
+    (3.0, 3.0)
+    >>> p3d.edm is None
+    True
+    """
+
+    def __init__(self, p3d, csv_edges, ring=True):
         """Set up the 'Filaments' object by parsing data from CSV files.
 
-        TODO:
-        [x] filament should not inherit from Points3D as this would prevent
-            reusing a Points3D object for multiple filaments
-        [x] instead, a p3d object should be created separately and a reference
-            to it should be passed to the filament upon creation
-        [-] populate p3d obj from csv_coords
-        [x] populate filament list of connections (edges) from csv_edges
-        [-] build masks
-        [x] calculate lengths
+        Parameters
+        ----------
+        p3d : Points3D
+            The vertex coordinates of the filament.
+        csv_edges : str or filehandle
+            The CSV file containing the edges (pairs of vertex index numbers).
+        ring : bool, optional
+            If True (default), the filament is required to be a closed loop
+            and its vertex sequence is built (see FilamentGraph.ring()).
+
+        Instance Variables
+        ------------------
+        graph : FilamentGraph
+        path : list(int)
+            The vertex sequence of a ring filament (None otherwise).
+        cumlen : np.ndarray
+            The cumulative lengths along the path, cumlen[i] being the length
+            from path[0] to path[i] and cumlen[-1] the length of the closed
+            loop (None if not a ring filament).
+        length : float
+            The overall length of the filament.
         """
         self.p3d = p3d
-        # create a list with index numbers of all p3d points:
-        self.vertices = dict()
-        edges_raw = np.loadtxt(csv_edges, dtype=int, delimiter=',')
-        for edge in edges_raw:
-            # if self.vertices[edge[0]] is None:
-            if not edge[0] in self.vertices:
-                self.vertices[edge[0]] = Vertex(edge[0])
-            # if self.vertices[edge[1]] is None:
-            if not edge[1] in self.vertices:
-                self.vertices[edge[1]] = Vertex(edge[1])
-            self.vertices[edge[0]].connect(edge)
-            self.vertices[edge[1]].connect(edge)
-        log.debug(self.vertices)
-        self.path, self.length = self.buildpath()
-
-        # self.edges = list()
+        self.path = None
+        self.cumlen = None
+        self._pos = None   # the position of every vertex in the path
+        with prof.stage('filament.load'):
+            edges_raw = prof.track(loader.loadtxt(csv_edges, dtype=int,
+                                                  delimiter=','))
+        with prof.stage('filament.graph'):
+            self.graph = FilamentGraph(edges_raw, len(p3d.get_coords()))
+        log.debug(self.graph)
+        with prof.stage('filament.path'):
+            if ring:
+                self.path, self.length = self.buildpath()
+            else:
+                lengths = edge_lengths(self.p3d.get_coords(),
+                                       self.graph.edges)
+                self.length = lengths.sum()
 
     def buildpath(self):
-        """Take a list of edges and generate a sequence from it."""
-        path = list()
-        pathlen = 0
-        i = 0
-        path.append(i)
-        vtx = self.vertices[i]  # shorthand for current vertex
-        path.append(vtx.connections[0])
-        pathlen += self.p3d.get_edm()[path[len(path)-2], path[-1]]
-        vtx.connections[0] = None
-        while self.vertices:
-            # log.debug("----------- processing remaining vertices -----------")
-            i = path[-1]
-            vtx = self.vertices[i]
-            # log.debug('cur vertex id: %s, last path id: %s' % (vtx.idx, i))
-            if not vtx.idx == i:
-                raise IndexError
-            inext = None
-            # log.debug("last path elemet (i): %s" % i)
-            for iconn in xrange(len(vtx.connections)):
-                # log.debug(" -- conn-ptr: %s, cur vtx:" % (iconn, vtx))
-                if vtx.connections[iconn] is None:
-                    # "connection is 'None', skipping..."
-                    continue
-                if vtx.connections[iconn] == path[len(path)-2]:
-                    # connection is the preceding one, so just remove it
-                    vtx.connections[iconn] = None
-                else:
-                    # connection links to a successor element, store it
-                    inext = vtx.connections[iconn]
-                    vtx.connections[iconn] = None
-                # log.debug(self.vertices)
-            if vtx.connections == [None, None]:
-                # all connections processed, remove the vertex:
-                self.vertices.pop(i)
-            if inext is not None:
-                log.debug("%s + [%s]" % (path, inext))
-                path.append(inext)
-                pathlen += self.p3d.get_edm()[path[len(path)-2], path[-1]]
-            else:
-                # this can happen if the edges don't form a ring
-                # TODO: write a test case!
-                if self.vertices:
-                    log.error("\nERROR building filament path!\n")
-                    log.error("Vtx connections: %s" % vtx.connections)
-                    log.error("Remaining vertices: %s" % self.vertices)
-                    raise IndexError("Couldn't build filament path!")
-        # TODO: this should go into a subclass "FilamentRing" or similar:
-        if not path[0] == path[-1]:
-            raise ValueError('Path endpoints are not connected!')
-        return (path[:-1], pathlen)
+        """Generate the vertex sequence of a closed filament (a ring).
+
+        The segment lengths are calculated directly from the coordinates, so
+        no distance matrix is required.
+
+        Returns
+        -------
+        (path, pathlen) : (list(int), float)
+        """
+        path = self.graph.ring()
+        closed = np.array(path + path[:1])
+        lengths = edge_lengths(self.p3d.get_coords(),
+                               np.vstack([closed[:-1], closed[1:]]).T)
+        # cumsum() keeps the sequential summation order of a plain loop:
+        self.cumlen = np.concatenate([[0.], lengths.cumsum()])
+        self._pos = np.full(self.graph.count, -1, dtype=int)
+        self._pos[path] = np.arange(len(path))
+        return (path, self.cumlen[-1])
+
+    def segments(self):
+        """Get the unbranched segments of the filament (see FilamentGraph)."""
+        return self.graph.segments()
+
+    def components(self):
+        """Get the connected components of the filament (see FilamentGraph)."""
+        return self.graph.components()
+
+    def _split_positions(self, splitpoints):
+        """Get the (sorted) path positions of two vertices."""
+        positions = []
+        for vtx in splitpoints:
+            if not 0 <= vtx < len(self._pos) or self._pos[vtx] < 0:
+                raise ValueError('%s is not in the path' % vtx)
+            positions.append(self._pos[vtx])
+        return (min(positions), max(positions))
 
     def splitpaths(self, splitpoints):
         """Split a path using a start and stop index.
@@ -882,15 +2102,23 @@ class Filament(object):
         Returns (split0, split1) where split0[0] == split1[-1] and split1[0] ==
         split0[-1].
         """
-        i_start = self.path.index(splitpoints[0])
-        i_stop = self.path.index(splitpoints[1])
-        if i_start > i_stop:
-            i_start, i_stop = i_stop, i_start
-        log.debug("splitting path at positions: %s, %s" % (i_start, i_stop))
+        (i_start, i_stop) = self._split_positions(splitpoints)
+        log.debug("splitting path at positions: %s, %s", i_start, i_stop)
         split0 = self.path[i_start:i_stop+1]
         split1 = self.path[i_stop:] + self.path[:i_start+1]
         return (split0, split1)
 
+    def split_lengths(self, splitpoints):
+        """Get the lengths of the two parts created by splitpaths().
+
+        Returns
+        -------
+        (len0, len1) : (float, float)
+        """
+        (i_start, i_stop) = self._split_positions(splitpoints)
+        len0 = self.cumlen[i_stop] - self.cumlen[i_start]
+        return (len0, self.length - len0)
+
 
 class GreedyPath(object):
 
@@ -917,137 +2145,91 @@ class GreedyPath(object):
         mask : numpy.float64
             6.5106588526894855
         """
-        (path, mask, length) = path_greedy(p3d.get_edm(), mask, extrema)
+        # use the EDM if it's already there, otherwise don't require it:
+        if p3d.edm is not None:
+            (path, mask, length) = path_greedy(p3d.edm, mask, extrema)
+        else:
+            (path, mask, length) = path_greedy_pts(p3d.get_coords(), mask,
+                                                   extrema)
         self.path = path
         self.mask = mask
         self.length = length
 
 
-class Vertex(object):
-
-    """A class for vertices with a maximum of two connections per vertex."""
-
-    def __init__(self, idx):
-        """Create a new vertex object with empty connections.
-
-        Parameters
-        ----------
-        idx : int
-            The (unique) index number of this vertex.
-
-        Instance Variables
-        ------------------
-        idx : int
-        connections : list(int)
-            The index numbers of connected vertices. Can be None if not
-            connected. If only *one* connection exists, it will always be
-            stored in connections[0], while connections[1] will be None.
-        """
-        self.idx = idx
-        self.connections = list((None, None))
-
-    def __repr__(self):
-        return "id: %s, conn: %s" % (self.idx, self.connections)
-
-    def add_conn(self, end):
-        """Add a new connection between this anbetween this and another vertex.
-
-        Create a new connection between this vertex and another one, denoted by
-        the index number of the endpoint of this connection. Does nothing if
-        the connection already exists, raises an IndexError if this vertex
-        already has two (distinct) connections.
-
-        Parameters
-        ----------
-        end : int
-            The index number of the vertex to connect to.
-        """
-        # do nothing in case the connection already exists:
-        if end in self.connections:
-            return
-        for i in xrange(len(self.connections)):
-            if self.connections[i] is None:
-                self.connections[i] = end
-                return
-        # if we did not return by now, the vertex already has its maximum
-        # number of connections - which is usually an error:
-        raise IndexError('Vertex %s reached its maximum number of connections'
-                         ' (%s).' % (self.idx, end,
-                         self.connections))
-
-    def connect(self, edge):
-        """Add a new edge to this vertex.
-
-        Currently mostly a wrapper to be agnostic against the order of index
-        numbers given in the edge tuple, plus some sanity checking. Raises an
-        IndexError in case the edge doesn't belong to this vertex.
-
-        Parameters
-        ----------
-        connections : list(int)
-        """
-        if edge[0] == self.idx:
-            self.add_conn(edge[1])
-        elif edge[1] == self.idx:
-            self.add_conn(edge[0])
-        else:
-            log.error('Vtx: %s, edge: %s, %s' % (self.idx, edge[0], edge[1]))
-            raise IndexError('Edge does not belong to this vertex!')
-
-
 class CellJunction(Points3D):
 
     """Class representing cell junctions (rims of touching areas)."""
 
+    # the names of the values returned by get_results(), they don't depend on
+    # the data so they can be used as column labels for multiple junctions:
+    result_fields = (
+        'largest distance points (indices)',
+        'coordinates of first point',
+        'coordinates of second point',
+        'distance',
+        'longest transversal edge',
+        'overall area',
+        'perimeter',
+    )
+
     def __init__(self, csv_p3d, csv_edges):
         """Run tesselation method to calculate an area approximation.
 
         The points with the maximum distance in the given Points3D object are
         considered to be the extrema of the cell junction, they are used to
         build the connecting paths and to run the tesselation algorithm.
+
+        No distance matrix is required for any of these steps, so junctions
+        with a large number of points can be processed as well.
+
+        Parameters
+        ----------
+        csv_p3d, csv_edges : str or filehandle
+            The CSV files containing the coordinates and the filament edges.
         """
-        super(CellJunction, self).__init__(csv_p3d)
-        self._te_max = None   # ID of longest transversal edge
-        self._vtxlist = []   # a list of lists of 3-tuples of coordinates
-        self._area = 0   # combined area of all tesselation polygons
-
-        filaments = Filament(self, csv_edges)
-        self.perimeter = filaments.length
-        paths = filaments.splitpaths(self.get_mdpair())
-        paths[1].reverse()
-        log.info("-- filament path 0:\n%s" % paths[0])
-        log.info("-- filament path 1:\n%s" % paths[1])
-        edges, triangles = tesselate(paths[0], paths[1], self.get_edm())
-        self.edges = edges
-        self.triangles = triangles
+        with prof.stage('junction'):
+            super(CellJunction, self).__init__(csv_p3d)
+            # if an EDM is requested, only its upper triangle is required:
+            self.edm_condensed = True
+            self._te_max = None   # ID of longest transversal edge
+            self._vtxlist = []   # a list of lists of 3-tuples of coordinates
+            self._tri_areas = None   # areas of the tesselation triangles
+            self._area = 0   # combined area of all tesselation polygons
+
+            filaments = Filament(self, csv_edges)
+            self.perimeter = filaments.length
+            paths = filaments.splitpaths(self.get_mdpair())
+            paths[1].reverse()
+            log.info("-- filament path 0:\n%s", truncated(paths[0]))
+            log.info("-- filament path 1:\n%s", truncated(paths[1]))
+            # the mesh is stored as index arrays, shape (E, 2) and (T, 3):
+            (self.edges, self.triangles) = tesselate_pts(paths[0], paths[1],
+                                                         self.data)
         log.warn("------------ largest distance results -------------")
         log.warn("idx numbers:\t" + ppr.pformat(self.get_mdpair()))
         log.warn("coordinates:\t" + ppr.pformat(self.get_mdpair_coords()))
         log.warn("distance:\t" + ppr.pformat(self.get_mdpair_dist()))
         log.warn("---------------------------------------------------")
         log.warn("perimeter: %s" % self.perimeter)
-        log.debug("edges: %s" % self.edges)
+        log.debug("edges: %s", truncated(self.edges))
 
     def get_longest_edge(self):
         """Determine the longest transversal edge.
 
-        Scans through the edges that were returned from the tesselation and
-        identifies the longest one. This edge can be considered as the maximum
-        width of the CellJunction object."""
-        if self._te_max is None:
-            tmplen = 0
-            for edge in self.edges:
-                curlen = self.get_edm()[edge[0], edge[1]]
-                if curlen > tmplen:
-                    tmplen = curlen
-                    self._te_max = edge
+        Calculates the lengths of the edges that were returned from the
+        tesselation and identifies the longest one. This edge can be
+        considered as the maximum width of the CellJunction object."""
+        if self._te_max is None and len(self.edges) > 0:
+            with prof.stage('junction.edges'):
+                lengths = edge_lengths(self.data, self.edges)
+            self._te_max = tuple(self.edges[lengths.argmax()].tolist())
             log.warn("longest edge from tesselation: %s" % str(self._te_max))
         return self._te_max
 
     def get_longest_edge_len(self):
         """Get the length of the longest edge."""
         edge = self.get_longest_edge()
-        return self.get_edm()[edge[0], edge[1]]
+        return edge_lengths(self.data, [edge])[0]
 
     def get_longest_edge_pos(self):
         """Get the position for the label of the longest edge."""
@@ -1057,43 +2239,70 @@ class CellJunction(Points3D):
     def get_vertices(self):
         """Calculate the list of vertices of the tesselation result."""
         if self._vtxlist == []:
-            for (vtx1, vtx2, vtx3) in self.triangles:
-                self._vtxlist.append([tuple(self.data[vtx1]),
-                                      tuple(self.data[vtx2]),
-                                      tuple(self.data[vtx3])])
-                self._area += tri_area(self.data[vtx1],
-                                       self.data[vtx2],
-                                       self.data[vtx3])
-            log.debug("vtxlist: %s" % self._vtxlist)
+            self._vtxlist = [[tuple(vtx) for vtx in tri]
+                             for tri in self.data[self.triangles]]
+            log.debug("vtxlist: %s", truncated(self._vtxlist))
         return self._vtxlist
 
+    def get_tri_areas(self):
+        """Get the areas of the tesselation triangles as np.ndarray."""
+        if self._tri_areas is None:
+            with prof.stage('junction.areas'):
+                self._tri_areas = tri_areas(self.data, self.triangles)
+        return self._tri_areas
+
+    def get_tri_normals(self):
+        """Get the unit normal vectors of the tesselation triangles."""
+        return tri_normals(self.data, self.triangles)
+
     def get_area(self):
         """Calculate the area of the tesselation result."""
-        # The actual calculation is done when creating the list of vertices, so
-        # we just check if that was already done or delegate it otherwise.
-        if self._area == 0:
-            self.get_vertices()
+        if self._area == 0 and len(self.triangles) > 0:
+            # cumsum() adds up the areas in sequence like a plain loop (unlike
+            # sum(), which uses pairwise summation), the total only differs
+            # by the rounding of the single areas (see tri_areas()):
+            self._area = self.get_tri_areas().cumsum()[-1]
             log.warn("overall area: %s" % self._area)
         return self._area
 
+    def get_results(self):
+        """Collect the results reported by write_output().
+
+        Returns
+        -------
+        results : list((str, object))
+            Pairs of field names (see "result_fields") and values, in the
+            order of write_output().
+        """
+        mdpts = self.get_mdpair_coords()
+        values = [str(self.get_mdpair()),
+                  mdpts[0],
+                  mdpts[1],
+                  str(self.get_mdpair_dist()),
+                  self.get_longest_edge_len(),
+                  self.get_area(),
+                  self.perimeter]
+        return zip(self.result_fields, values)
+
     def write_output(self, f_out, f_in):
         """Assemble output file with collected results."""
-        out = csv.writer(f_out, dialect='excel', delimiter=';')
-        write = out.writerow
-        mdpair = self.get_mdpair()
-        mdpts = self.get_mdpair_coords()
-        write(['input filename', filename(f_in)])
-        write([])
-        write(['distance results'])
-        write(['largest distance points (indices)', str(mdpair)])
-        write(['coordinates of point %s' % mdpair[0], mdpts[0]])
-        write(['coordinates of point %s' % mdpair[1], mdpts[1]])
-        write(['distance', str(self.get_edm()[mdpair])])
-        write([])
-        write(['area results calculated by triangular tesselation'])
-        write(['longest transversal edge', self.get_longest_edge_len()])
-        write(['overall area', self.get_area()])
-        write(['perimeter', self.perimeter])
+        with prof.stage('junction.output'):
+            out = csv.writer(f_out, dialect='excel', delimiter=';')
+            write = out.writerow
+            mdpair = self.get_mdpair()
+            mdpts = self.get_mdpair_coords()
+            write(['input filename', filename(f_in)])
+            write([])
+            write(['distance results'])
+            write(['largest distance points (indices)', str(mdpair)])
+            write(['coordinates of point %s' % mdpair[0], mdpts[0]])
+            write(['coordinates of point %s' % mdpair[1], mdpts[1]])
+            write(['distance', str(self.get_mdpair_dist())])
+            write([])
+            write(['area results calculated by triangular tesselation'])
+            write(['longest transversal edge', self.get_longest_edge_len()])
+            write(['overall area', self.get_area()])
+            write(['perimeter', self.perimeter])
 
 
 if __name__ == "__main__":
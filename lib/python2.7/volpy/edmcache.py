@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+"""Persistent on-disk cache for euclidean distance matrices.
+
+Calculating the EDM is the most expensive step when repeatedly analyzing the
+same datasets (e.g. while tuning plots or outputs). The cache stores each
+matrix as a ".npy" file in a given directory, named by a hash of the point
+coordinates (plus data type and layout of the matrix). Cached matrices are
+memory-mapped when requested again, so they don't even need to fit into RAM.
+Files that can't be read (e.g. truncated by a full disk) are removed and
+calculated again.
+
+The cache is bounded in size: whenever a new matrix is added, the least
+recently used ones are removed until the total size is below the limit.
+
+The cache is opt-in and only available through the library, none of the
+commandline tools use it (since the junction analysis no longer needs the
+EDM, no tool calculates a full one). It has to be assigned to a Points3D
+object explicitly:
+>>> import volpy as vp
+>>> from volpy.edmcache import EDMCache
+>>> p3d = vp.Points3D('points.csv')              # doctest: +SKIP
+>>> p3d.edm_cache = EDMCache('/tmp/edm_cache')   # doctest: +SKIP
+>>> edm = p3d.get_edm()                          # doctest: +SKIP
+
+To inspect or clear a cache directory from the commandline, run this module
+as a script, e.g. "python edmcache.py /tmp/edm_cache --clear".
+"""
+
+import os
+import sys
+import glob
+import time
+import hashlib
+import argparse
+import numpy as np
+
+import volpy as vp
+from log import log, set_loglevel
+
+
+class EDMCache(object):
+
+    """A size-bounded directory of memory-mapped distance matrices.
+
+    Example
+    -------
+    >>> import tempfile, shutil
+    >>> cachedir = tempfile.mkdtemp()
+    >>> cache = EDMCache(cachedir)
+    >>> pts = [ [1, 2], [4, 6], [1, 6] ]
+    >>> cache.get_edm(pts).tolist()
+    [[0.0, 5.0, 4.0], [5.0, 0.0, 3.0], [4.0, 3.0, 0.0]]
+    >>> len(cache.entries())
+    1
+    >>> cache.get_edm(pts, condensed=True)[1].tolist()
+    [5.0, 0.0, 3.0]
+    >>> (len(cache.entries()), cache.hits, cache.misses)
+    (2, 0, 2)
+    >>> type(cache.get_edm(pts)).__name__
+    'memmap'
+    >>> cache.hits
+    1
+
+    Unreadable files are calculated again:
+    >>> open(cache.fname(cache.key(pts)), 'wb').write('\\x93NUMPY')
+    >>> cache.get_edm(pts).tolist()
+    [[0.0, 5.0, 4.0], [5.0, 0.0, 3.0], [4.0, 3.0, 0.0]]
+    >>> cache.misses
+    3
+    >>> cache.clear()
+    >>> cache.entries()
+    []
+    >>> shutil.rmtree(cachedir)
+    """
+
+    def __init__(self, path, maxsize=4 * 1024 ** 3):
+        """Set up a cache in the given directory (created if necessary).
+
+        Parameters
+        ----------
+        path : str
+            The directory to store the cached matrices in.
+        maxsize : int, optional
+            The maximum overall size of the cached files in bytes (4 GB by
+            default).
+
+        Instance Variables
+        ------------------
+        hits, misses : int
+            The number of lookups served from / not found in the cache.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __repr__(self):
+        return "EDMCache('%s', %i entries, %.1f MB)" % \
+            (self.path, len(self.entries()), self.size() / 1024.0 ** 2)
+
+    def key(self, pts, dtype=np.float64, condensed=False):
+        """Calculate the cache key for a set of points.
+
+        The key is a hash of the coordinates (including their shape) combined
+        with the data type and layout of the requested matrix.
+        """
+        pts = np.ascontiguousarray(pts, dtype=np.float64)
+        digest = hashlib.sha1(str(pts.shape).encode())
+        digest.update(pts.data)
+        layout = 'condensed' if condensed else 'full'
+        return '%s-%s-%s' % (digest.hexdigest(), np.dtype(dtype).name, layout)
+
+    def fname(self, key):
+        """Get the full path of the file for a given key."""
+        return os.path.join(self.path, 'edm-%s.npy' % key)
+
+    def entries(self):
+        """Get the cached files with their size, least recently used first.
+
+        Returns
+        -------
+        entries : list((str, int, float))
+            Tuples of (filename, size in bytes, time of last use).
+        """
+        entries = []
+        for fname in glob.glob(os.path.join(self.path, 'edm-*.npy')):
+            stat = os.stat(fname)
+            entries.append((fname, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """Get the overall size of the cached files in bytes."""
+        return sum([entry[1] for entry in self.entries()])
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the size limit holds.
+
+        Parameters
+        ----------
+        keep : str, optional
+            A filename that must not be removed (e.g. the one just added).
+        """
+        entries = self.entries()
+        total = sum([entry[1] for entry in entries])
+        for (fname, size, _) in entries:
+            if total <= self.maxsize:
+                break
+            if fname == keep:
+                continue
+            log.info('Evicting EDM from cache: %s' % fname)
+            os.remove(fname)
+            total -= size
+
+    def clear(self):
+        """Remove all cached matrices."""
+        for entry in self.entries():
+            os.remove(entry[0])
+
+    def get_edm(self, pts, dtype=np.float64, condensed=False):
+        """Get the EDM of the given points, from the cache if possible.
+
+        If the matrix is not cached yet, it is calculated directly into a new
+        cache file (see vp.dist_matrix()), unless it is larger than the size
+        limit of the whole cache.
+
+        Parameters
+        ----------
+        pts : np.ndarray (shape = (N, D))
+        dtype : np.dtype, optional
+        condensed : bool, optional
+            See vp.dist_matrix().
+
+        Returns
+        -------
+        edm : np.memmap or vp.CondensedEDM
+            The matrix, memory-mapped read-only from the cache file.
+        """
+        pts = np.asarray(pts, dtype=np.float64)
+        count = len(pts)
+        fname = self.fname(self.key(pts, dtype, condensed))
+        if condensed:
+            shape = (count * (count - 1) // 2,)
+        else:
+            shape = (count, count)
+        edm = None
+        if os.path.exists(fname):
+            try:
+                edm = np.load(fname, mmap_mode='r')
+                if edm.shape != shape or edm.dtype != np.dtype(dtype):
+                    raise ValueError('unexpected shape or dtype')
+            except (IOError, ValueError, EOFError) as err:
+                log.warn('Removing unreadable EDM from cache: %s (%s)' %
+                         (fname, err))
+                edm = None
+                os.remove(fname)
+        if edm is not None:
+            self.hits += 1
+            log.info('Using cached EDM: %s' % fname)
+            # the modification time is used to track the last usage:
+            os.utime(fname, None)
+        else:
+            self.misses += 1
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if nbytes > self.maxsize:
+                log.warn('EDM too large for the cache (%i bytes).' % nbytes)
+                return vp.dist_matrix(pts, dtype=dtype, condensed=condensed)
+            # write to a temporary file first, so an interrupted calculation
+            # never leaves an incomplete matrix in the cache:
+            tmpname = '%s.%i.tmp' % (fname, os.getpid())
+            edm = np.lib.format.open_memmap(tmpname, mode='w+', dtype=dtype,
+                                            shape=shape)
+            vp.dist_matrix(pts, out=edm, condensed=condensed)
+            edm.flush()
+            del edm
+            os.rename(tmpname, fname)
+            log.info('Stored EDM in cache: %s' % fname)
+            self.evict(keep=fname)
+            edm = np.load(fname, mmap_mode='r')
+        if condensed:
+            return vp.CondensedEDM(edm, count)
+        return edm
+
+
+def main():
+    """Show the contents of a cache directory, optionally clearing it."""
+    argparser = argparse.ArgumentParser(
+        description='Inspect or clear an EDM cache directory.')
+    argparser.add_argument('path', help='the cache directory')
+    argparser.add_argument('--clear', action='store_true', default=False,
+        help='remove all cached matrices')
+    argparser.add_argument('-v', '--verbosity', dest='verbosity',
+        action='count', default=0)
+    args = argparser.parse_args()
+    set_loglevel(args.verbosity)
+    cache = EDMCache(args.path)
+    for (fname, size, mtime) in cache.entries():
+        print('%10.1f MB  %s  %s' % (size / 1024.0 ** 2,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)),
+            os.path.basename(fname)))
+    print(cache)
+    if args.clear:
+        cache.clear()
+        print('Cache cleared.')
+
+
+if __name__ == "__main__":
+    if '--doctest' in sys.argv:
+        print('Running doctest on file "%s".' % __file__)
+        import doctest
+        doctest.testmod()
+    else:
+        sys.exit(main())
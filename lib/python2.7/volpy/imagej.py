@@ -4,9 +4,10 @@
 
 import numpy as np
 import volpy as vp
+from volpy import loader
 import csv
 import misc
-from log import log
+from log import log, prof, truncated
 
 
 def read_csv_com(fname):
@@ -45,7 +46,7 @@ def read_csv_com(fname):
     for item in roi_reader:
         roi_tmp.append([item['XM'], item['YM']])
     coords = np.array(roi_tmp, dtype=float)
-    log.debug(coords)
+    log.debug('%s', truncated(coords))
     log.info('Done.')
     return coords
 
@@ -67,17 +68,22 @@ class WingJStructure(object):
         ------------------
         data : dict(np.array)
         calib : float
+        edm_dtype : np.dtype
+            The data type used for distance matrices (see vp.dist_matrix).
         """
         log.info('Reading WingJ CSV files...')
         self.data = {}
         self.calib = calib
-        self._read_wingj_files(files)
-        # data['XX'].shape = (M, 2)
-        # calibrate the WingJ data if requested:
-        self.data['AP'] *= calib
-        self.data['VD'] *= calib
-        self.data['CT'] *= calib
-        self._calc_origin()
+        self.edm_dtype = np.float64
+        with prof.stage('wingj.read'):
+            self._read_wingj_files(files)
+            # data['XX'].shape = (M, 2)
+            # calibrate the WingJ data if requested:
+            self.data['AP'] *= calib
+            self.data['VD'] *= calib
+            self.data['CT'] *= calib
+        with prof.stage('wingj.origin'):
+            self._calc_origin()
         log.info('Done.')
 
     def _read_wingj_files(self, files, delimiter='\t'):
@@ -89,20 +95,21 @@ class WingJStructure(object):
             filelist.append(files + '/structure_V-D.txt')
             filelist.append(files + '/structure_contour.txt')
             files = filelist
-        self.data['AP'] = np.loadtxt(files[0], delimiter=delimiter)
-        self.data['VD'] = np.loadtxt(files[1], delimiter=delimiter)
-        self.data['CT'] = np.loadtxt(files[2], delimiter=delimiter)
+        self.data['AP'] = prof.track(loader.loadtxt(files[0],
+                                                      delimiter=delimiter))
+        self.data['VD'] = prof.track(loader.loadtxt(files[1],
+                                                      delimiter=delimiter))
+        self.data['CT'] = prof.track(loader.loadtxt(files[2],
+                                                      delimiter=delimiter))
 
     def _calc_origin(self):
         """Calculate the origin (the intersection of A-P and V-D lines)."""
         # TODO: investigate more WingJ structure files, probably the origin
         # spot is always stored as the "central" element in the AP/VD files
         # (meaning entry 500 of 1000).
-        edm = vp.dist_matrix(np.vstack([self.data['AP'], self.data['VD']]))
-        closest = vp.get_min_dist_pair(edm, self.data['AP'].shape[0])
+        closest = vp.min_cross_pair(self.data['AP'], self.data['VD'])
         log.debug(self.data['AP'][closest[0]])
-        log.debug(self.data['VD'][closest[1] - self.data['AP'].shape[0]])
-        log.debug(edm[closest])
+        log.debug(self.data['VD'][closest[1]])
         # *IF* the above holds, we can just use the coordinates of the first
         # spot, instead of calculating "new" coordinates:
         self.data['orig'] = self.data['AP'][closest[0]]
@@ -126,35 +133,24 @@ class WingJStructure(object):
         """
         edm = {}
         log.info('Calculating distance matrices for all objects...')
-        edm['AP'] = vp.dist_matrix(np.vstack([coords, self.data['AP']]))
-        edm['VD'] = vp.dist_matrix(np.vstack([coords, self.data['VD']]))
-        edm['CT'] = vp.dist_matrix(np.vstack([coords, self.data['CT']]))
-        edm['orig'] = vp.dist_matrix(np.vstack([coords, self.data['orig']]))
-        # edm['XX'].shape (N+M, N+M)
-        log.info('Done.')
-
-        # number of objects from coordinates file
-        count = coords.shape[0]
-        # slice distance matrices: the rows for all object points ([:count,:])
-        # and the columns for the WingJ structure points ([:,count:])
-        edm['AP'] = edm['AP'][:count, count:]
-        edm['VD'] = edm['VD'][:count, count:]
-        edm['CT'] = edm['CT'][:count, count:]
-        # there is just one "orig" spot, so we just slice the first row:
-        edm['orig'] = edm['orig'][0, 1:]
+        with prof.stage('wingj.dist_matrices'):
+            for struct in ('AP', 'VD', 'CT'):
+                edm[struct] = vp.cross_dist(coords, self.data[struct],
+                                            dtype=self.edm_dtype)
+            # there is just one "orig" spot, so we just take the single column:
+            edm['orig'] = vp.cross_dist(coords, [self.data['orig']],
+                                        dtype=self.edm_dtype)[:, 0]
         # edm['XX'].shape = (N, M)
-        # log.debug('Distances to "AP" structure:\n%s' % edm['AP'])
-        # log.debug('Distances to "VD" structure:\n%s' % edm['VD'])
-        # log.debug('Distances to "CT" structure:\n%s' % edm['CT'])
-        log.debug('Distances to origin:\n%s' % edm['orig'])
+        log.info('Done.')
+        log.debug('Distances to origin:\n%s', truncated(edm['orig']))
         return edm
 
     def min_dist_to_structures(self, coords):
         """Find minimal distances of coordinates to the WingJ structures.
 
-        By using the dist_to_structures() result, we can just iterate through
-        all rows finding the minimum and we get the shortest distance for
-        each point to one of the WingJ structures.
+        The WingJ structures are put into a spatial index (see
+        vp.SpatialIndex) to look up the closest structure point for each of
+        the given coordinates, so no distance matrices are required.
 
         Parameters
         ----------
@@ -167,18 +163,14 @@ class WingJStructure(object):
             A dictionary with the arrays containing the minimal distance of a
             coordinate pair to the WingJ structure.
         """
-        count = coords.shape[0]
-        dists = self.dist_to_structures(coords)
         mindists = {}
         log.info('Finding shortest distances...')
-        mindists['AP'] = np.zeros((count))
-        mindists['VD'] = np.zeros((count))
-        mindists['CT'] = np.zeros((count))
-        mindists['orig'] = dists['orig']
-        for i in range(count):
-            mindists['AP'][i] = dists['AP'][i].min()
-            mindists['VD'][i] = dists['VD'][i].min()
-            mindists['CT'][i] = dists['CT'][i].min()
+        with prof.stage('wingj.min_dists'):
+            for struct in ('AP', 'VD', 'CT'):
+                index = vp.SpatialIndex(self.data[struct])
+                mindists[struct] = index.knn(coords)[0][:, 0]
+            mindists['orig'] = vp.cross_dist(coords,
+                                             [self.data['orig']])[:, 0]
         log.info('Done.')
         return mindists
 
@@ -194,12 +186,13 @@ class WingJStructure(object):
             filelist.append(files + '/mindists_orig.csv')
             files = filelist
         mindists = self.min_dist_to_structures(coords)
-        # export the results as CSV files
-        log.info('Writing "%s".' % misc.filename(files[0]))
-        np.savetxt(files[0], mindists['AP'], fmt='%.5f', delimiter=',')
-        log.info('Writing "%s".' % misc.filename(files[1]))
-        np.savetxt(files[1], mindists['VD'], fmt='%.5f', delimiter=',')
-        log.info('Writing "%s".' % misc.filename(files[2]))
-        np.savetxt(files[2], mindists['CT'], fmt='%.5f', delimiter=',')
-        log.info('Writing "%s".' % misc.filename(files[3]))
-        np.savetxt(files[3], mindists['orig'], fmt='%.5f', delimiter=',')
+        with prof.stage('wingj.export'):
+            # export the results as CSV files
+            log.info('Writing "%s".' % misc.filename(files[0]))
+            np.savetxt(files[0], mindists['AP'], fmt='%.5f', delimiter=',')
+            log.info('Writing "%s".' % misc.filename(files[1]))
+            np.savetxt(files[1], mindists['VD'], fmt='%.5f', delimiter=',')
+            log.info('Writing "%s".' % misc.filename(files[2]))
+            np.savetxt(files[2], mindists['CT'], fmt='%.5f', delimiter=',')
+            log.info('Writing "%s".' % misc.filename(files[3]))
+            np.savetxt(files[3], mindists['orig'], fmt='%.5f', delimiter=',')
@@ -0,0 +1,414 @@
+#!/usr/bin/python
+
+"""Loading of text-based point data with binary sidecar files.
+
+Numeric CSV / TSV files are parsed in large chunks with a bulk conversion (see
+parse_numeric()), falling back to np.loadtxt() for anything unusual. As even
+this takes time for large exports, the parsed array is stored next to the
+text file as a ".npy" sidecar (one per dtype, e.g. "points.csv.float64.npy"),
+together with a small JSON file recording the size and modification time of
+the source file. On subsequent loads the
+sidecar is memory-mapped instead of parsing the text again, as long as the
+source file is unchanged.
+
+Writing the sidecars is best-effort: if the directory is not writable the data
+is simply parsed every time. Sidecars can be disabled completely by setting
+the module variable "SIDECARS" to False.
+
+Example
+-------
+>>> import os, tempfile, shutil
+>>> tmpdir = tempfile.mkdtemp()
+>>> fname = os.path.join(tmpdir, 'points.csv')
+>>> open(fname, 'w').write('1,2,3\\n4,5,6\\n')
+>>> loadtxt(fname).tolist()
+[[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+>>> os.path.exists(sidecar_name(fname))
+True
+>>> isinstance(loadtxt(fname).base, np.memmap)
+True
+>>> loadtxt(fname, dtype=int).tolist()
+[[1, 2, 3], [4, 5, 6]]
+>>> os.path.exists(sidecar_name(fname, dtype=int))
+True
+>>> isinstance(loadtxt(fname).base, np.memmap)
+True
+>>> convert_dir(tmpdir, dtype=int)
+[]
+
+Filehandles are only parsed from their current position (skipping e.g. a
+header line that was already read):
+>>> fhandle = open(fname)
+>>> fhandle.readline()
+'1,2,3\\n'
+>>> loadtxt(fhandle).tolist()
+[4.0, 5.0, 6.0]
+>>> fhandle.close()
+>>> shutil.rmtree(tmpdir)
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import warnings
+import numpy as np
+
+from log import log, prof, set_loglevel
+
+# global switch to enable / disable reading and writing sidecar files:
+SIDECARS = True
+
+# the version of the sidecar format, stored in the metadata:
+FORMAT_VERSION = 1
+
+
+def sidecar_name(fname, dtype=np.float64):
+    """Get the name of the binary sidecar file for a text file and dtype."""
+    return '%s.%s.npy' % (fname, np.dtype(dtype).name)
+
+
+def _meta_name(fname, dtype=np.float64):
+    """Get the name of the sidecar metadata file for a text file and dtype."""
+    return sidecar_name(fname, dtype) + '.json'
+
+
+def file_stamp(fname):
+    """Get a stamp identifying the current state of a file.
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    stamp : dict
+        The size (in bytes) and the modification time of the file.
+    """
+    stat = os.stat(fname)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def stamp_matches(stamp, fname):
+    """Check if a stamp (see file_stamp()) still matches a file."""
+    try:
+        current = file_stamp(fname)
+    except OSError:
+        return False
+    return (stamp.get('size') == current['size'] and
+            stamp.get('mtime') == current['mtime'])
+
+
+def source_path(infile):
+    """Get the path of a text source (a filename or a filehandle).
+
+    Returns None for anything else that np.loadtxt() can handle (e.g. a list
+    of lines or a file-like object that doesn't correspond to a file), and for
+    filehandles that are not at the beginning of the file, as reopening the
+    file by its name would parse the part already consumed by the caller.
+    """
+    if isinstance(infile, basestring):
+        path = infile
+    elif isinstance(infile, file):
+        try:
+            if infile.tell() != 0:
+                return None
+        except IOError:
+            # not seekable (e.g. a pipe):
+            return None
+        path = infile.name
+    else:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+def _parse_chunk(text, delimiter, ncols, dtype):
+    """Convert a chunk of complete lines, returning None if it's irregular.
+
+    The chunk is accepted only if every line contains exactly "ncols" values
+    separated by the delimiter, which is verified on the raw bytes.
+    """
+    raw = np.frombuffer(text, dtype=np.uint8)
+    # the (exclusive) end of every line, the last one may lack a newline:
+    ends = np.flatnonzero(raw == ord('\n'))
+    if raw[-1] != ord('\n'):
+        ends = np.append(ends, len(raw))
+    delims = np.flatnonzero(raw == ord(delimiter))
+    per_line = np.diff(np.concatenate([[0], np.searchsorted(delims, ends)]))
+    if (per_line != ncols - 1).any():
+        return None
+    # integers are parsed as int64 and converted afterwards (wrapping around
+    # like np.loadtxt() does), as np.fromstring() handles smaller types
+    # inconsistently:
+    is_int = np.dtype(dtype).kind in 'iu'
+    # np.fromstring() silently stops at the first invalid value, so a
+    # sentinel value is appended to detect this even for the last one (newer
+    # numpy versions also issue a warning then, which is not needed here):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        values = np.fromstring(text.replace(delimiter, ' ') + ' 0',
+                               dtype=np.int64 if is_int else dtype, sep=' ')
+    if len(values) != len(ends) * ncols + 1:
+        return None
+    values = values[:-1]
+    if is_int:
+        # out-of-range integers are clamped instead of raising an error like
+        # np.loadtxt() does, so leave anything at the limits to the latter:
+        limits = np.iinfo(np.int64)
+        if ((values == limits.max) | (values == limits.min)).any():
+            return None
+        values = values.astype(dtype)
+    return values.reshape(-1, ncols)
+
+
+def parse_numeric(infile, delimiter=',', dtype=np.float64,
+                  chunksize=16 * 1024 ** 2):
+    """Parse a numeric CSV / TSV file in large chunks.
+
+    The text is read in chunks of complete lines that are converted by a
+    single call to np.fromstring() each, instead of processing it line by
+    line. The structure of every chunk is verified (each line having the same
+    number of values). If anything doesn't fit (e.g. comments, blank lines,
+    headers or non-numeric values) the file is parsed using np.loadtxt()
+    instead, so the results (and errors) are the same in any case.
+
+    Parameters
+    ----------
+    infile : str, filehandle or anything else np.loadtxt() accepts
+    delimiter : str, optional
+        A single character like ',' (Imaris), '\\t' (WingJ) or ';'.
+    dtype : np.dtype, optional
+    chunksize : int, optional
+        The number of bytes to read at once.
+
+    Returns
+    -------
+    data : np.ndarray
+        Shaped like the result of np.loadtxt() (i.e. squeezed).
+
+    Example
+    -------
+    >>> parse_numeric(['1;2;3', '4;5;6'], delimiter=';').tolist()
+    [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+    >>> parse_numeric(['1,2', '3,4'], dtype=int).tolist()
+    [[1, 2], [3, 4]]
+
+    Integers out of range raise an error, like with np.loadtxt():
+    >>> import tempfile
+    >>> (fd, fname) = tempfile.mkstemp(suffix='.csv')
+    >>> os.fdopen(fd, 'w').write('1,99999999999999999999\\n')
+    >>> parse_numeric(fname, dtype=int)
+    Traceback (most recent call last):
+        ...
+    OverflowError: Python int too large to convert to C long
+    >>> os.remove(fname)
+    """
+    path = source_path(infile)
+    if path is None or delimiter is None or len(delimiter) != 1:
+        return np.loadtxt(infile, delimiter=delimiter, dtype=dtype)
+    chunks = []
+    ncols = None
+    tail = ''
+    with open(path, 'rb') as fhandle:
+        while True:
+            block = fhandle.read(chunksize)
+            text = tail + block
+            if block:
+                # process complete lines only, keep the rest for later:
+                cut = text.rfind('\n') + 1
+                (text, tail) = (text[:cut], text[cut:])
+            if text.strip():
+                if ncols is None:
+                    ncols = text.split('\n', 1)[0].count(delimiter) + 1
+                chunk = _parse_chunk(text, delimiter, ncols, dtype)
+                if chunk is None:
+                    log.debug('Irregular text, using np.loadtxt() instead.')
+                    return np.loadtxt(path, delimiter=delimiter, dtype=dtype)
+                chunks.append(chunk)
+            if not block:
+                break
+    if not chunks:
+        return np.loadtxt(path, delimiter=delimiter, dtype=dtype)
+    return np.squeeze(np.concatenate(chunks))
+
+
+def _meta(path, dtype, delimiter):
+    """Assemble the sidecar metadata for a text file."""
+    meta = file_stamp(path)
+    meta.update({'dtype': np.dtype(dtype).str,
+                 'delimiter': delimiter,
+                 'version': FORMAT_VERSION})
+    return meta
+
+
+def load_sidecar(path, dtype=np.float64, delimiter=','):
+    """Load the sidecar of a text file if it is up to date.
+
+    Parameters
+    ----------
+    path : str
+        The name of the text (source) file.
+    dtype, delimiter : optional
+        The parameters the text file is parsed with, they need to match the
+        ones used when the sidecar was created.
+
+    Returns
+    -------
+    data : np.ndarray or None
+        The memory-mapped array (in copy-on-write mode, so it can be modified
+        without affecting the file) or None if no valid sidecar exists. It is
+        returned as a plain ndarray view, so results derived from it don't
+        turn into np.memmap objects.
+    """
+    try:
+        with open(_meta_name(path, dtype)) as metafile:
+            meta = json.load(metafile)
+    except (IOError, ValueError):
+        return None
+    expected = _meta(path, dtype, delimiter)
+    if meta != expected:
+        log.debug('Sidecar of "%s" is outdated.' % path)
+        return None
+    try:
+        data = np.load(sidecar_name(path, dtype), mmap_mode='c')
+    except (IOError, ValueError) as err:
+        log.warn('Error reading sidecar of "%s": %s' % (path, err))
+        return None
+    if data.dtype != np.dtype(dtype):
+        log.warn('Sidecar of "%s" has dtype %s instead of %s.' %
+                 (path, data.dtype, np.dtype(dtype)))
+        return None
+    log.info('Loaded "%s" from sidecar.' % path)
+    return np.asarray(data)
+
+
+def write_sidecar(path, data, dtype=np.float64, delimiter=','):
+    """Store the parsed data of a text file as sidecar.
+
+    Errors (e.g. a read-only directory) are logged but otherwise ignored.
+
+    Returns
+    -------
+    success : bool
+    """
+    npyname = sidecar_name(path, dtype)
+    metaname = _meta_name(path, dtype)
+    try:
+        meta = _meta(path, dtype, delimiter)
+        # write to temporary files first, so other processes never see
+        # incomplete sidecars:
+        tmpname = '%s.%i.tmp' % (npyname, os.getpid())
+        with open(tmpname, 'wb') as npyfile:
+            np.save(npyfile, data)
+        # the old metadata must not be valid for the new array (e.g. if
+        # writing the new metadata fails below):
+        if os.path.exists(metaname):
+            os.remove(metaname)
+        os.rename(tmpname, npyname)
+        tmpname = '%s.%i.tmp' % (metaname, os.getpid())
+        with open(tmpname, 'w') as metafile:
+            json.dump(meta, metafile)
+        os.rename(tmpname, metaname)
+    except (IOError, OSError) as err:
+        log.warn('Could not write sidecar for "%s": %s' % (path, err))
+        return False
+    log.info('Written sidecar "%s".' % npyname)
+    return True
+
+
+def loadtxt(infile, delimiter=',', dtype=np.float64):
+    """Load data from a text file, using a binary sidecar if possible.
+
+    A drop-in replacement for np.loadtxt(infile, delimiter=..., dtype=...):
+    if the sidecar of the file is up to date, it is memory-mapped, otherwise
+    the text is parsed (see parse_numeric()) and a new sidecar gets written.
+
+    Parameters
+    ----------
+    infile : str, filehandle or anything else np.loadtxt() accepts
+        Sidecars are only used for files on disk.
+    delimiter : str, optional
+    dtype : np.dtype, optional
+
+    Returns
+    -------
+    data : np.ndarray
+    """
+    path = source_path(infile)
+    if not SIDECARS or path is None:
+        return parse_numeric(infile, delimiter=delimiter, dtype=dtype)
+    data = load_sidecar(path, dtype, delimiter)
+    if data is None:
+        prof.count('loader.parsed')
+        data = parse_numeric(path, delimiter=delimiter, dtype=dtype)
+        write_sidecar(path, data, dtype, delimiter)
+    else:
+        prof.count('loader.sidecar_hits')
+    return data
+
+
+def convert_dir(path, pattern='*.csv', delimiter=',', dtype=np.float64):
+    """Create the sidecars for all matching text files in a directory.
+
+    Files with an up-to-date sidecar are skipped, as are files that can't be
+    parsed with the given settings.
+
+    Parameters
+    ----------
+    path : str
+        The directory containing the text files.
+    pattern : str, optional
+        A glob pattern for the files to convert.
+    delimiter, dtype : optional
+        See loadtxt().
+
+    Returns
+    -------
+    converted : list(str)
+        The names of the files that were converted.
+    """
+    converted = []
+    for fname in sorted(glob.glob(os.path.join(path, pattern))):
+        if load_sidecar(fname, dtype, delimiter) is not None:
+            continue
+        try:
+            data = parse_numeric(fname, delimiter=delimiter, dtype=dtype)
+        except ValueError as err:
+            log.warn('Skipping "%s": %s' % (fname, err))
+            continue
+        if write_sidecar(fname, data, dtype, delimiter):
+            converted.append(fname)
+    return converted
+
+
+def main():
+    """Convert the text files in a directory from the commandline."""
+    argparser = argparse.ArgumentParser(
+        description='Create binary sidecars for text-based point data.')
+    argparser.add_argument('path', help='the directory containing the files')
+    argparser.add_argument('--pattern', default='*.csv',
+        help='glob pattern of the files to convert (default: "*.csv")')
+    argparser.add_argument('--delimiter', default=',',
+        help='the column delimiter (default: ",")')
+    argparser.add_argument('--int', dest='dtype', action='store_const',
+        const=int, default=np.float64,
+        help='parse the values as integers (e.g. for filament edges)')
+    argparser.add_argument('-v', '--verbosity', dest='verbosity',
+        action='count', default=0)
+    args = argparser.parse_args()
+    set_loglevel(args.verbosity)
+    delimiter = args.delimiter.decode('string_escape')
+    converted = convert_dir(args.path, args.pattern, delimiter, args.dtype)
+    print('Converted %i files.' % len(converted))
+
+
+if __name__ == "__main__":
+    if '--doctest' in sys.argv:
+        print('Running doctest on file "%s".' % __file__)
+        import doctest
+        doctest.testmod()
+    else:
+        sys.exit(main())
@@ -2,8 +2,8 @@
 
 """Plotting submodule for volpy using matplotlib."""
 
-from log import log
-from volpy import sort_neighbors, build_tuple_seq
+from log import log, truncated
+from volpy import sort_neighbors_pts, build_tuple_seq
 
 import matplotlib.pyplot as plt
 from matplotlib.colors import colorConverter
@@ -156,8 +156,8 @@ def filaments(axes, pts3d):
     pts3d : Points3D
     """
     data = pts3d.get_coords()
-    adjacent = sort_neighbors(pts3d.get_edm())
-    log.debug(adjacent)
+    adjacent = sort_neighbors_pts(data)
+    log.debug('%s', truncated(adjacent))
     for pair in build_tuple_seq(adjacent, cyclic=True):
         coords = [data[pair[0]], data[pair[1]]]
         line(axes, coords, 'm')
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+"""Selection of the fastest available ElementTree implementation.
+
+The XML parsers of this package only use the common ElementTree API, so any
+implementation of it can be plugged in. The backends are tried in the order
+given in BACKENDS, the first one that can be imported is used by default:
+
+ - "lxml": lxml.etree (libxml2 based, needs to be installed separately)
+ - "cElementTree": the C accelerator shipped with CPython
+ - "ElementTree": the pure-Python standard library version
+
+The latter is always available (also in Jython, e.g. from within Fiji). Code
+using the backend must access it through this module (e.g. by calling parse()
+or iterparse()) instead of importing "etree" directly, so a backend chosen
+later by select() takes effect everywhere.
+
+Before parsing a whole document, its type can be checked by "sniffing" just the
+prolog and the root element (see check_root()), so files that are obviously
+wrong are rejected immediately. The same check can be used to pre-filter the
+files of a directory (see find_files()).
+
+Example
+-------
+>>> select('ElementTree')
+'ElementTree'
+>>> from StringIO import StringIO
+>>> tree = parse(StringIO('<XYStage><Mosaic No="0"/></XYStage>'))
+>>> tree.getroot().find('Mosaic').get('No')
+'0'
+>>> select('no-such-backend')
+Traceback (most recent call last):
+    ...
+ValueError: Unknown XML backend: no-such-backend
+>>> select() in available()
+True
+"""
+
+import os
+import glob
+from log import log
+
+# the supported backends, ordered by preference:
+BACKENDS = ('lxml', 'cElementTree', 'ElementTree')
+
+# the module providing the ElementTree API and its name (set by select()):
+etree = None
+name = None
+
+
+def _import(backend):
+    """Import the module of a backend, returning None if it's unavailable."""
+    try:
+        if backend == 'lxml':
+            from lxml import etree as module
+        elif backend == 'cElementTree':
+            import xml.etree.cElementTree as module
+        elif backend == 'ElementTree':
+            import xml.etree.ElementTree as module
+        else:
+            raise ValueError('Unknown XML backend: %s' % backend)
+    except ImportError:
+        return None
+    return module
+
+
+def available():
+    """Get the names of all backends that can be imported here.
+
+    Returns
+    -------
+    names : list(str)
+        Ordered by preference, see BACKENDS.
+    """
+    return [backend for backend in BACKENDS if _import(backend) is not None]
+
+
+def select(backend=None):
+    """Set the ElementTree implementation to be used.
+
+    Parameters
+    ----------
+    backend : str, optional
+        One of BACKENDS, by default the first available one is used.
+
+    Returns
+    -------
+    name : str
+        The name of the selected backend.
+    """
+    global etree, name
+    candidates = BACKENDS if backend is None else (backend,)
+    for candidate in candidates:
+        module = _import(candidate)
+        if module is not None:
+            (etree, name) = (module, candidate)
+            log.debug('Using XML backend: %s' % name)
+            return name
+    raise ImportError('XML backend not available: %s' % backend)
+
+
+def parse(source):
+    """Parse an XML document into an element tree (see etree.parse())."""
+    return etree.parse(source)
+
+
+def iterparse(source, events=('end',)):
+    """Parse an XML document incrementally (see etree.iterparse())."""
+    return etree.iterparse(source, events)
+
+
+def split_tag(tag):
+    """Split an element tag into its namespace and its local name.
+
+    Example
+    -------
+    >>> split_tag('{urn:schemas-microsoft-com:office:spreadsheet}Workbook')
+    ('urn:schemas-microsoft-com:office:spreadsheet', 'Workbook')
+    >>> split_tag('XYStage')
+    ('', 'XYStage')
+    """
+    if tag.startswith('{'):
+        return tuple(tag[1:].split('}', 1))
+    return ('', tag)
+
+
+def root_tag(fname):
+    """Get the tag of the root element of an XML file.
+
+    The file is parsed incrementally up to the start of the root element, so
+    only the prolog and the first block of the file are read, independently
+    of its size.
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    tag : str
+        The tag including the namespace (e.g. "{namespace}Workbook").
+
+    Raises
+    ------
+    TypeError
+        If the beginning of the file is not well-formed XML.
+    """
+    fhandle = open(fname, 'rb')
+    try:
+        try:
+            for (_, elem) in iterparse(fhandle, ('start',)):
+                return elem.tag
+        except SyntaxError as err:
+            # all backends derive their ParseError from SyntaxError:
+            raise TypeError('Not a valid XML file "%s": %s' % (fname, err))
+    finally:
+        fhandle.close()
+    raise TypeError('No root element found in "%s"' % fname)
+
+
+def check_root(fname, tag, namespace=''):
+    """Check if the root element of an XML file has the expected tag.
+
+    See root_tag(), this is meant to be done before parsing the whole file.
+
+    Parameters
+    ----------
+    fname : str
+    tag : str
+        The expected tag of the root element (without the namespace).
+    namespace : str, optional
+        The expected namespace of the root element, none by default.
+
+    Raises
+    ------
+    TypeError
+        If the file is not XML or the root element doesn't match.
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> (fd, fname) = tempfile.mkstemp(suffix='.log')
+    >>> os.fdopen(fd, 'w').write('<?xml version="1.0"?>\\n<XYStage/>')
+    >>> check_root(fname, 'XYStage')
+    >>> check_root(fname, 'XYStage', 'urn:other')  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    TypeError: Unexpected root element "XYStage" ...
+    >>> open(fname, 'w').write('\\x89PNG\\r\\n')
+    >>> check_root(fname, 'XYStage')  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    TypeError: Not a valid XML file ...
+    >>> os.remove(fname)
+    """
+    found = root_tag(fname)
+    if split_tag(found) != (namespace, tag):
+        raise TypeError('Unexpected root element "%s" in "%s" (expected '
+                        '"%s" in namespace "%s")' %
+                        (found, fname, tag, namespace))
+    log.debug('Root element of "%s": %s' % (fname, found))
+
+
+def filter_files(fnames, tag, namespace=''):
+    """Select the XML files having a certain root element.
+
+    Files that can't be read or fail check_root() are skipped with a warning.
+
+    Parameters
+    ----------
+    fnames : list(str)
+    tag, namespace : str
+        See check_root().
+
+    Returns
+    -------
+    selected : list(str)
+    """
+    selected = []
+    for fname in fnames:
+        try:
+            check_root(fname, tag, namespace)
+        except (TypeError, IOError) as err:
+            log.warn('Skipping "%s": %s' % (fname, err))
+            continue
+        selected.append(fname)
+    return selected
+
+
+def find_files(path, tag, namespace='', pattern='*'):
+    """Find the XML files in a directory having a certain root element.
+
+    Parameters
+    ----------
+    path : str
+        The directory to search in.
+    tag, namespace : str
+        See check_root().
+    pattern : str, optional
+        A glob pattern preselecting the files.
+
+    Returns
+    -------
+    fnames : list(str)
+        The (sorted) names of the matching files.
+    """
+    fnames = sorted(glob.glob(os.path.join(path, pattern)))
+    return filter_files([fname for fname in fnames if os.path.isfile(fname)],
+                        tag, namespace)
+
+
+select()
+
+
+if __name__ == "__main__":
+    print('Running doctest on file "%s".' % __file__)
+    import doctest
+    doctest.testmod()
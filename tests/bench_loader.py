@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+"""Benchmark the volpy text loader against np.loadtxt().
+
+Synthetic files resembling the typical inputs (Imaris coordinates and
+filament edges as CSV, WingJ structures as TSV) are written to a temporary
+directory and parsed with np.loadtxt(), the chunked parser and from the
+binary sidecar, verifying that all of them give identical results.
+
+Example
+-------
+./bench_loader.py --rows 1000000
+./bench_loader.py --rows 100000 1000000 --keep /scratch/bench
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from volpy import loader
+
+
+def write_inputs(path, rows, seed=42):
+    """Write the synthetic input files, returning their parse settings."""
+    rstate = np.random.RandomState(seed)
+    coords = rstate.uniform(-500, 500, (rows, 3))
+    edges = np.vstack([np.arange(rows), np.roll(np.arange(rows), -1)]).T
+    inputs = [
+        ('p3d.csv', coords, '%.6f', ',', np.float64),
+        ('edges.csv', edges, '%i', ',', int),
+        ('structure.txt', coords[:, :2], '%.9f', '\t', np.float64),
+    ]
+    files = []
+    for (name, data, fmt, delimiter, dtype) in inputs:
+        fname = os.path.join(path, '%i-%s' % (rows, name))
+        np.savetxt(fname, data, fmt=fmt, delimiter=delimiter)
+        files.append((fname, delimiter, dtype))
+    return files
+
+
+def timed(func, *args, **kwargs):
+    """Call a function, returning its result and the elapsed time."""
+    start = time.time()
+    res = func(*args, **kwargs)
+    return (res, time.time() - start)
+
+
+def bench_file(fname, delimiter, dtype):
+    """Run all loaders on a file and return their timings."""
+    (ref, t_loadtxt) = timed(np.loadtxt, fname, delimiter=delimiter,
+                             dtype=dtype)
+    (res, t_chunked) = timed(loader.parse_numeric, fname, delimiter, dtype)
+    if not np.array_equal(ref, res):
+        raise ValueError('Chunked parser results differ for "%s"!' % fname)
+    # the first call writes the sidecar, the second one maps it:
+    (_, t_first) = timed(loader.loadtxt, fname, delimiter, dtype)
+    (res, t_sidecar) = timed(loader.loadtxt, fname, delimiter, dtype)
+    if not np.array_equal(ref, res):
+        raise ValueError('Sidecar results differ for "%s"!' % fname)
+    return (t_loadtxt, t_chunked, t_first, t_sidecar)
+
+
+def parse_arguments():
+    """Parse the commandline arguments."""
+    argparser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--rows', type=int, nargs='+', default=[1000000],
+        help='numbers of rows of the generated files')
+    argparser.add_argument('--keep', default=None,
+        help='directory to write the files to (kept after the benchmark)')
+    return argparser.parse_args()
+
+
+def main():
+    """Run the benchmarks and print the results."""
+    args = parse_arguments()
+    path = args.keep or tempfile.mkdtemp(prefix='bench_loader_')
+    try:
+        print('%-24s %12s %12s %12s %12s %9s' %
+              ('file', 'loadtxt [s]', 'chunked [s]', '+sidecar [s]',
+               'mmap [s]', 'speedup'))
+        for rows in args.rows:
+            for (fname, delimiter, dtype) in write_inputs(path, rows):
+                res = bench_file(fname, delimiter, dtype)
+                print('%-24s %12.3f %12.3f %12.3f %12.4f %8.1fx' %
+                      ((os.path.basename(fname),) + res + (res[0] / res[1],)))
+    finally:
+        if args.keep is None:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
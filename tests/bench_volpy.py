@@ -0,0 +1,390 @@
+#!/usr/bin/python
+
+"""Benchmark volpy on synthetic point clouds, filament loops and junctions.
+
+Every benchmark case is run in a separate process, so the reported peak
+memory (the maximum resident set size of that process) is not influenced by
+the previous cases. The input data of a case is generated in that process
+before the measurement starts:
+
+cloud : points drawn uniformly from a 100^3 volume
+loop  : points along a (noisy) closed loop, in random order
+rim   : a cell junction rim, i.e. a closed saddle-shaped loop whose vertices
+        are connected by filament edges (written to CSV files like the ones
+        exported from Imaris, for the Filament and CellJunction cases)
+
+Cases requiring a full distance matrix are skipped if the matrix would exceed
+the limit given by "--max-edm", cases walking over all pairs of points (without
+storing their distances) are skipped above the number of pairs given by
+"--max-pairs". The results can be saved as JSON to compare
+different versions, including the per-stage data of the volpy profiler (see
+log.Profiler).
+
+Example
+-------
+./bench_volpy.py --sizes 1000 10000 50000 --float32 --memmap /scratch
+./bench_volpy.py --cases path_greedy_pts sort_neighbors_pts --legacy
+./bench_volpy.py --sizes 1000 1000000 --json results-$(git describe).json
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import argparse
+import resource
+import logging
+import tempfile
+import multiprocessing
+
+import numpy as np
+import volpy as vp
+from volpy import loader
+from log import log, prof
+
+
+def random_points(count, dim=3, seed=42):
+    """Generate a reproducible random point cloud."""
+    return np.random.RandomState(seed).uniform(0, 100, (count, dim))
+
+
+def loop_points(count, seed=42):
+    """Generate points along a (noisy) closed loop in random order."""
+    rstate = np.random.RandomState(seed)
+    angles = rstate.permutation(count) * 2 * np.pi / count
+    loop = np.vstack([50 * np.cos(angles), 20 * np.sin(angles),
+                      10 * np.sin(2 * angles)]).T
+    return loop + rstate.normal(0, 0.1, (count, 3))
+
+
+def rim_points(count, seed=42):
+    """Generate the vertices of a junction rim in their order along the loop.
+
+    Returns
+    -------
+    (pts, pl1, pl2) : (np.ndarray, list(int), list(int))
+        The coordinates and the two halves of the loop (as index numbers)
+        running from the first vertex to the opposite one, as expected by
+        the tesselation functions.
+    """
+    rstate = np.random.RandomState(seed)
+    angles = np.arange(count) * 2 * np.pi / count
+    pts = np.vstack([40 * np.cos(angles), 25 * np.sin(angles),
+                     8 * np.cos(2 * angles)]).T
+    pts += rstate.normal(0, 0.05, (count, 3))
+    half = count // 2
+    pl1 = range(half + 1)
+    pl2 = [0] + range(count - 1, half - 1, -1)
+    return (pts, pl1, pl2)
+
+
+def rim_files(count, path, seed=42):
+    """Write a junction rim to CSV files (vertex IDs in random order).
+
+    Returns
+    -------
+    (p3d, edges) : (str, str)
+        The names of the coordinates and edges files.
+    """
+    p3d = os.path.join(path, 'rim-p3d-%i.csv' % count)
+    edges = os.path.join(path, 'rim-edges-%i.csv' % count)
+    if os.path.exists(p3d) and os.path.exists(edges):
+        return (p3d, edges)
+    pts = rim_points(count, seed)[0]
+    # the exported vertex IDs don't follow the loop:
+    ids = np.random.RandomState(seed).permutation(count)
+    coords = np.empty_like(pts)
+    coords[ids] = pts
+    pairs = np.vstack([ids, np.roll(ids, -1)]).T
+    np.savetxt(p3d, coords, fmt='%.6f', delimiter=',')
+    np.savetxt(edges, pairs, fmt='%i', delimiter=',')
+    return (p3d, edges)
+
+
+def rim_edm(count, dtype=np.float64):
+    """Generate a junction rim (see rim_points()) plus its EDM."""
+    (pts, pl1, pl2) = rim_points(count)
+    return (pts, pl1, pl2, vp.dist_matrix(pts, dtype=dtype))
+
+
+def opposite_pair(pts):
+    """Get the pair (0, i) where point i is the farthest one from point 0."""
+    return (0, int(((pts - pts[0]) ** 2).sum(axis=1).argmax()))
+
+
+def dist_matrix_legacy(pts):
+    """The former, unblocked EDM calculation, kept here for comparison."""
+    count = len(pts)
+    delta = np.tile(pts, (count, 1)) - np.repeat(pts, count, axis=0)
+    return np.sqrt(np.sum(delta ** 2, axis=1)).reshape((count, count))
+
+
+def path_greedy_legacy(edm, pair):
+    """The former greedy path search using find_neighbor() in every step."""
+    mask = [0] * len(edm[0])
+    (cur, pathlen) = (pair[0], 0)
+    while True:
+        mask[cur] = 1
+        closest = vp.find_neighbor(cur, edm, mask)
+        pathlen += edm[cur, closest]
+        if closest == pair[1]:
+            return pathlen
+        cur = closest
+
+
+def sort_neighbors_legacy(edm):
+    """The former neighbour sorting using find_neighbor() in every step."""
+    mask = [0] * edm.shape[0]
+    cur = 0
+    for _ in xrange(edm.shape[0]):
+        mask[cur] = 1
+        cur = vp.find_neighbor(cur, edm, mask)
+
+
+# the input generators, they are called with the number of points and the
+# options and their results are passed on to the cases:
+INPUTS = {
+    'cloud': lambda count, opts: random_points(count),
+    'cloud_edm': lambda count, opts: vp.dist_matrix(random_points(count),
+                                                    dtype=opts.dtype),
+    'loop': lambda count, opts: loop_points(count),
+    'rim': lambda count, opts: rim_points(count),
+    'rim_edm': lambda count, opts: rim_edm(count, opts.dtype),
+    'rim_files': lambda count, opts: rim_files(count, opts.tmpdir),
+}
+
+
+def case_dist_matrix(pts, opts):
+    """Calculate an EDM, optionally into a memory-mapped file."""
+    count = len(pts)
+    out = None
+    if opts.memmap is not None:
+        fname = os.path.join(opts.memmap, 'bench_edm_%i.dat' % count)
+        out = np.memmap(fname, dtype=opts.dtype, mode='w+',
+                        shape=(count, count))
+    vp.dist_matrix(pts, dtype=opts.dtype, out=out)
+    if out is not None:
+        del out
+        os.remove(fname)
+
+
+def case_dist_matrix_legacy(pts, opts):
+    """Calculate an EDM using the legacy implementation."""
+    # "dtype" and "memmap" are not supported by the legacy code:
+    # pylint: disable-msg=W0613
+    dist_matrix_legacy(pts)
+
+
+def case_get_max_dist_pair(edm, opts):
+    """Find the farthest pair in a given EDM."""
+    # pylint: disable-msg=W0613
+    vp.get_max_dist_pair(edm)
+
+
+def case_farthest_pair(pts, opts):
+    """Find the farthest pair of a point cloud, no EDM."""
+    # pylint: disable-msg=W0613
+    vp.farthest_pair(pts)
+
+
+def case_path_greedy(pts, opts):
+    """Greedy path between two opposite points of a loop, EDM included."""
+    edm = vp.dist_matrix(pts, dtype=opts.dtype)
+    vp.path_greedy(edm, None, opposite_pair(pts))
+
+
+def case_path_greedy_legacy(pts, opts):
+    """Legacy greedy path between two opposite points, EDM included."""
+    edm = vp.dist_matrix(pts, dtype=opts.dtype)
+    path_greedy_legacy(edm, opposite_pair(pts))
+
+
+def case_path_greedy_pts(pts, opts):
+    """Greedy path between two opposite points of a loop, no EDM."""
+    # pylint: disable-msg=W0613
+    vp.path_greedy_pts(pts, None, opposite_pair(pts))
+
+
+def case_sort_neighbors(pts, opts):
+    """Sort all points of a loop by their neighbours, EDM included."""
+    vp.sort_neighbors(vp.dist_matrix(pts, dtype=opts.dtype))
+
+
+def case_sort_neighbors_legacy(pts, opts):
+    """Legacy neighbour sorting, EDM included."""
+    sort_neighbors_legacy(vp.dist_matrix(pts, dtype=opts.dtype))
+
+
+def case_sort_neighbors_pts(pts, opts):
+    """Sort all points of a loop by their neighbours, no EDM."""
+    # pylint: disable-msg=W0613
+    vp.sort_neighbors_pts(pts)
+
+
+def case_tesselate(rim, opts):
+    """Tesselate a junction rim using a given EDM."""
+    # pylint: disable-msg=W0613
+    (_, pl1, pl2, edm) = rim
+    vp.tesselate(pl1, pl2, edm)
+
+
+def case_tesselate_pts(rim, opts):
+    """Tesselate a junction rim, no EDM."""
+    # pylint: disable-msg=W0613
+    (pts, pl1, pl2) = rim
+    vp.tesselate_pts(pl1, pl2, pts)
+
+
+def case_filament(files, opts):
+    """Parse a junction rim and build its filament path."""
+    # pylint: disable-msg=W0613
+    vp.Filament(vp.Points3D(files[0]), files[1])
+
+
+def case_cell_junction(files, opts):
+    """Run the full junction analysis on a rim (without the output)."""
+    # pylint: disable-msg=W0613
+    vp.CellJunction(files[0], files[1]).get_results()
+
+
+# the available cases as tuples of (name, input, cost, function, legacy
+# counterpart or None), the cost being 'edm' for cases requiring a full
+# distance matrix, 'pairs' for ones visiting all pairs of points without it
+# (i.e. O(N^2) time, but not memory) and None otherwise:
+CASES = [
+    ('dist_matrix', 'cloud', 'edm',
+     case_dist_matrix, case_dist_matrix_legacy),
+    ('get_max_dist_pair', 'cloud_edm', 'edm', case_get_max_dist_pair, None),
+    ('farthest_pair', 'cloud', None, case_farthest_pair, None),
+    ('path_greedy', 'loop', 'edm',
+     case_path_greedy, case_path_greedy_legacy),
+    ('path_greedy_pts', 'loop', 'pairs', case_path_greedy_pts, None),
+    ('sort_neighbors', 'loop', 'edm',
+     case_sort_neighbors, case_sort_neighbors_legacy),
+    ('sort_neighbors_pts', 'loop', 'pairs', case_sort_neighbors_pts, None),
+    ('tesselate', 'rim_edm', 'edm', case_tesselate, None),
+    ('tesselate_pts', 'rim', None, case_tesselate_pts, None),
+    ('filament', 'rim_files', None, case_filament, None),
+    ('cell_junction', 'rim_files', None, case_cell_junction, None),
+]
+
+
+def _run(args):
+    """Prepare the inputs of a single case (in a child process), measure it.
+
+    Returns
+    -------
+    (walltime, peak, delta, profile) : (float, float, float, dict)
+        The time in seconds, the peak RSS of the process and its increase
+        during the case in MB and the data of the volpy profiler.
+    """
+    (case, kind, count, opts) = args
+    # the time for parsing the text files is part of the measurement:
+    loader.SIDECARS = False
+    # don't clutter the results with the junction statistics:
+    log.setLevel(logging.ERROR)
+    data = INPUTS[kind](count, opts)
+    prof.enable()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    case(data, opts)
+    walltime = time.time() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in kilobytes on Linux:
+    return (walltime, rss_after / 1024.0, (rss_after - rss_before) / 1024.0,
+            prof.results())
+
+
+def run_case(case, kind, count, opts):
+    """Run a benchmark case in a fresh process."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_run, ((case, kind, count, opts),))
+    finally:
+        pool.terminate()
+
+
+def parse_arguments():
+    """Parse the commandline arguments."""
+    argparser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--sizes', type=int, nargs='+',
+        default=[1000, 10000, 100000, 1000000],
+        help='numbers of points to test')
+    argparser.add_argument('--cases', nargs='+',
+        default=[case[0] for case in CASES],
+        choices=[case[0] for case in CASES],
+        help='the cases to run (default: all)')
+    argparser.add_argument('--float32', dest='dtype', action='store_const',
+        const=np.float32, default=np.float64,
+        help='calculate single precision distance matrices')
+    argparser.add_argument('--memmap', nargs='?', const=tempfile.gettempdir(),
+        default=None, help='store the matrices in memory-mapped files')
+    argparser.add_argument('--max-edm', dest='max_edm', type=float,
+        default=4096, help='skip cases with larger distance matrices [MB]')
+    argparser.add_argument('--max-pairs', dest='max_pairs', type=float,
+        default=1e10,
+        help='skip cases visiting all pairs of more points than this')
+    argparser.add_argument('--legacy', action='store_true', default=False,
+        help='also run the legacy implementations (if available)')
+    argparser.add_argument('--json', dest='json', default=None,
+        help='file to save the results to')
+    return argparser.parse_args()
+
+
+def describe(args):
+    """Assemble the description of the benchmark environment."""
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(),
+            'dtype': np.dtype(args.dtype).name,
+            'memmap': args.memmap is not None}
+
+
+def main():
+    """Run the benchmarks and print the results."""
+    args = parse_arguments()
+    args.tmpdir = tempfile.mkdtemp(prefix='bench_volpy_')
+    cases = []
+    for (name, kind, cost, case, legacy) in CASES:
+        if name not in args.cases:
+            continue
+        cases.append((name, kind, cost, case))
+        if args.legacy and legacy is not None:
+            cases.append((name + ' (legacy)', kind, cost, legacy))
+    itemsize = np.dtype(args.dtype).itemsize
+    results = []
+    print('%-28s %10s %10s %14s %14s' %
+          ('case', 'points', 'time [s]', 'peak RSS [MB]', 'delta [MB]'))
+    try:
+        for (name, kind, cost, case) in cases:
+            for count in args.sizes:
+                edm_mb = count ** 2 * itemsize / 1024.0 ** 2
+                if ((cost == 'edm' and edm_mb > args.max_edm) or
+                        (cost == 'pairs' and
+                         count * (count - 1) / 2.0 > args.max_pairs)):
+                    print('%-28s %10i %10s' % (name, count, 'skipped'))
+                    results.append({'case': name, 'points': count,
+                                    'skipped': True})
+                    continue
+                res = run_case(case, kind, count, args)
+                print('%-28s %10i %10.3f %14.1f %14.1f' %
+                      ((name, count) + res[:3]))
+                results.append({'case': name, 'points': count,
+                                'skipped': False, 'seconds': res[0],
+                                'peak_rss_mb': res[1], 'delta_rss_mb': res[2],
+                                'profile': res[3]})
+    finally:
+        shutil.rmtree(args.tmpdir)
+    if args.json is not None:
+        with open(args.json, 'w') as fout:
+            json.dump({'environment': describe(args), 'results': results},
+                      fout, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+"""Benchmark the XML backends on Imaris statistics and FluoView mosaic files.
+
+Every available backend (see xmlbackend) is used to extract the spot positions
+from Imaris statistics exports (parsing the whole tree and in streaming mode)
+and to read a FluoView "MATL_Mosaic.log" project, verifying that all of them
+give identical results. By default synthetic files are generated, existing
+statistics exports can be given using "--xml".
+
+Example
+-------
+./bench_xml.py --spots 10000 100000 --mosaics 500
+./bench_xml.py --xml /scratch/exports/*.xml --backends lxml cElementTree
+"""
+
+import gc
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+import xmlbackend
+from log import log
+from imaris_xml import ImarisXML
+from microscopy.fluoview import FluoViewMosaic
+
+EXCEL_NS = 'urn:schemas-microsoft-com:office:spreadsheet'
+
+
+def write_statistics(fname, spots, seed=42):
+    """Write a synthetic Imaris statistics export with a number of spots."""
+    rnd = random.Random(seed)
+    out = open(fname, 'w')
+    out.write('<?xml version="1.0"?>\n'
+              '<Workbook xmlns="%s" xmlns:ss="%s">\n'
+              ' <Styles><Style ss:ID="s1"><Font ss:Bold="1"/></Style>'
+              '</Styles>\n' % (EXCEL_NS, EXCEL_NS))
+
+    def worksheet(name, header, rows):
+        """Write a worksheet with a title row and a header row."""
+        out.write(' <Worksheet ss:Name="%s">\n  <Table>\n' % name)
+        for labels in ([name], header):
+            out.write('   <Row ss:StyleID="s1">%s</Row>\n' % ''.join(
+                '<Cell><Data ss:Type="String">%s</Data></Cell>' % label
+                for label in labels))
+        for row in rows:
+            out.write('   <Row>%s</Row>\n' % ''.join(
+                '<Cell><Data ss:Type="Number">%s</Data></Cell>' % val
+                for val in row))
+        out.write('  </Table>\n </Worksheet>\n')
+
+    worksheet('Overall', ['Variable', 'Value', 'Time'],
+              [['Total Number of Spots', spots, 1]])
+    worksheet('Intensity Mean', ['Intensity Mean', 'Channel', 'Time', 'ID'],
+              ([rnd.uniform(0, 255), 1, 1, i] for i in xrange(spots)))
+    worksheet('Position', ['Position X', 'Position Y', 'Position Z',
+                           'Time', 'ID'],
+              ([round(rnd.uniform(0, 500), 3), round(rnd.uniform(0, 500), 3),
+                round(rnd.uniform(0, 50), 3), 1, i] for i in xrange(spots)))
+    worksheet('Volume', ['Volume', 'Time', 'ID'],
+              ([rnd.uniform(1, 9), 1, i] for i in xrange(spots)))
+    out.write('</Workbook>\n')
+    out.close()
+
+
+def write_mosaic_log(fname, mosaics, tiles=4):
+    """Write a synthetic FluoView project with tiles x tiles per mosaic."""
+    out = open(fname, 'w')
+    out.write('<?xml version="1.0" encoding="ASCII"?>\n<XYStage>\n'
+              ' <XAxisDirection>LeftToRight</XAxisDirection>\n'
+              ' <YAxisDirection>TopToBottom</YAxisDirection>\n'
+              ' <NumberOfMosaics>%i</NumberOfMosaics>\n' % (mosaics - 1))
+    for mno in xrange(mosaics):
+        out.write(' <Mosaic No="%i">\n'
+                  '  <XScanDirection>LeftToRight</XScanDirection>\n'
+                  '  <YScanDirection>TopToBottom</YScanDirection>\n'
+                  '  <XImages>%i</XImages>\n  <YImages>%i</YImages>\n'
+                  '  <IndexRatio>85.0</IndexRatio>\n' % (mno, tiles, tiles))
+        for tno in xrange(tiles * tiles):
+            (yno, xno) = divmod(tno, tiles)
+            out.write('  <ImageInfo>\n   <No>%i</No>\n'
+                      '   <Filename>Slide1sec%03i_%02i.oif</Filename>\n'
+                      '   <XPos>%.1f</XPos>\n   <YPos>%.1f</YPos>\n'
+                      '   <Xno>%i</Xno>\n   <Yno>%i</Yno>\n'
+                      '  </ImageInfo>\n' %
+                      (tno, mno, tno + 1, 1000.0 * mno + 435.2 * xno,
+                       -435.2 * yno, xno + 1, yno + 1))
+        out.write(' </Mosaic>\n')
+    out.write('</XYStage>\n')
+    out.close()
+
+
+def timed(func, *args, **kwargs):
+    """Call a function, returning its result and the elapsed time."""
+    # don't let the garbage of a previous run slow down this one:
+    gc.collect()
+    start = time.time()
+    res = func(*args, **kwargs)
+    return (res, time.time() - start)
+
+
+def read_positions(fname, streaming):
+    """Extract the spot positions from a statistics export."""
+    return ImarisXML(fname, streaming=streaming).coordinates('Position')
+
+
+def read_tiles(fname):
+    """Read the tile positions of all mosaics of a FluoView project.
+
+    The image data referenced by the project is not available, so instead of
+    FluoViewMosaic.add_mosaics() the values it uses are looked up directly.
+    """
+    mosaic = FluoViewMosaic(fname, runparser=False)
+    tiles = []
+    for tree in mosaic.mosaictrees:
+        for img in tree.findall('ImageInfo'):
+            tiles.append((img.find('Filename').text,
+                          float(img.find('XPos').text),
+                          float(img.find('YPos').text)))
+    return tiles
+
+
+def bench(label, backends, func, *args):
+    """Run a function with every backend, printing the timings.
+
+    The speedup is given relative to the standard library "ElementTree" (or
+    the slowest backend if that one isn't benchmarked).
+    """
+    ref = None
+    timings = []
+    for backend in backends:
+        xmlbackend.select(backend)
+        (res, elapsed) = timed(func, *args)
+        if ref is None:
+            ref = res
+        elif not np.array_equal(ref, res):
+            raise ValueError('Results of "%s" differ for %s!' %
+                             (backend, label))
+        timings.append((backend, elapsed))
+    t_ref = dict(timings).get('ElementTree', max(dict(timings).values()))
+    for (backend, elapsed) in timings:
+        print('%-40s %-14s %10.3f %8.1fx' %
+              (label, backend, elapsed, t_ref / elapsed))
+
+
+def parse_arguments():
+    """Parse the commandline arguments."""
+    argparser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--xml', nargs='+', default=[],
+        help='statistics exports to use instead of synthetic ones')
+    argparser.add_argument('--spots', type=int, nargs='+', default=[100000],
+        help='numbers of spots of the generated statistics exports')
+    argparser.add_argument('--mosaics', type=int, default=500,
+        help='number of mosaics of the generated FluoView project')
+    argparser.add_argument('--backends', nargs='+',
+        default=xmlbackend.available(), choices=xmlbackend.BACKENDS,
+        help='the XML backends to compare (default: all available)')
+    argparser.add_argument('--keep', default=None,
+        help='directory to write the files to (kept after the benchmark)')
+    return argparser.parse_args()
+
+
+def main():
+    """Run the benchmarks and print the results."""
+    args = parse_arguments()
+    log.setLevel(logging.ERROR)
+    path = args.keep or tempfile.mkdtemp(prefix='bench_xml_')
+    try:
+        exports = list(args.xml)
+        if not exports:
+            for spots in args.spots:
+                exports.append(os.path.join(path, 'stats-%i.xml' % spots))
+                write_statistics(exports[-1], spots)
+        mosaic_log = os.path.join(path, 'MATL_Mosaic.log')
+        write_mosaic_log(mosaic_log, args.mosaics)
+        print('%-40s %-14s %10s %9s' % ('file', 'backend', 'time [s]',
+                                        'speedup'))
+        for fname in exports:
+            for streaming in (False, True):
+                label = '%s (%s)' % (os.path.basename(fname),
+                                     'streaming' if streaming else 'tree')
+                bench(label, args.backends, read_positions, fname, streaming)
+        bench('MATL_Mosaic.log (%i mosaics)' % args.mosaics, args.backends,
+              read_tiles, mosaic_log)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())